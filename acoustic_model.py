@@ -0,0 +1,51 @@
+"""
+MMS_FA声学模型的推理封装
+与torchaudio对模型的封装相同（输入归一化、log_softmax、追加star列），另外支持补零的多行输入，
+多首歌曲的音频块可以拼成一个mini-batch只做一次前向
+"""
+from typing import Optional, Tuple
+import torch
+
+class PaddedAcousticModel(torch.nn.Module):
+    """
+    输入 (batch, 采样点) 与可选的每行真实长度，输出 (emission, 每行的帧数)
+    不指定lengths时与torchaudio的封装完全相同；指定时每行只在真实长度内归一化，
+    补零部分由wav2vec2的注意力掩码屏蔽，每行的结果与单独推理该行相同（浮点误差以内）
+    """
+
+    def __init__(self, model: torch.nn.Module, normalize_waveform: bool,
+                 apply_log_softmax: bool, append_star: bool):
+        super().__init__()
+        self.model = model
+        self.normalize_waveform = normalize_waveform
+        self.apply_log_softmax = apply_log_softmax
+        self.append_star = append_star
+
+    def forward(self, waveforms: torch.Tensor,
+                lengths: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        if self.normalize_waveform:
+            if lengths is None:
+                waveforms = torch.nn.functional.layer_norm(waveforms, waveforms.shape)
+            else:
+                waveforms = normalize_rows(waveforms, lengths)
+        output, output_lengths = self.model(waveforms, lengths)
+        if self.apply_log_softmax:
+            output = torch.nn.functional.log_softmax(output, dim=-1)
+        if self.append_star:
+            # torchaudio的封装按batch为1追加star列，这里按实际的batch大小追加
+            star = torch.zeros((output.size(0), output.size(1), 1), dtype=output.dtype, device=output.device)
+            output = torch.cat((output, star), dim=-1)
+        return output, output_lengths
+
+def normalize_rows(waveforms: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+    """每行只用前lengths[i]个采样点归一化，补零部分保持为0"""
+    normalized = torch.zeros_like(waveforms)
+    for row in range(waveforms.size(0)):
+        length = int(lengths[row])
+        normalized[row, :length] = torch.nn.functional.layer_norm(waveforms[row, :length], [length])
+    return normalized
+
+def wrap_bundle_model(model):
+    """把torchaudio Wav2Vec2FABundle.get_model()的封装换成PaddedAcousticModel，共享同一份权重"""
+    return PaddedAcousticModel(model.model, model.normalize_waveform,
+                               model.apply_log_softmax, model.append_star)
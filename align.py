@@ -1,260 +1,1231 @@
-import torch
-import torchaudio
-import librosa
-import numpy as np
-from utils import parse_time_to_hundredths, format_hundredths_to_time_str, format_time_from_seconds
-
-def align_audio_with_text(audio_file_path, text_tokens):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    try:
-        bundle = torchaudio.pipelines.MMS_FA
-        waveform, sample_rate = torchaudio.load(audio_file_path)
-        waveform = waveform.mean(0, keepdim=True)
-        waveform = torchaudio.functional.resample(
-            waveform, sample_rate, int(bundle.sample_rate)
+import bisect
+import functools
+import logging
+import math
+import os
+import threading
+import instrument
+from cache import file_sha256, make_cache_key
+from utils import ERROR_TIME, format_token_time, time_or_zero, seconds_to_hundredths
+
+logger = logging.getLogger(__name__)
+
+# 声学模型的推理后端
+INFERENCE_BACKENDS = ('eager', 'torchscript', 'int8')
+
+@functools.lru_cache(maxsize=None)
+def load_alignment_model(device_type, backend='eager'):
+    """加载MMS_FA声学模型并按backend准备推理（每种组合进程内只加载一次）"""
+    import torch
+    import torchaudio
+    import acoustic_model
+    bundle = torchaudio.pipelines.MMS_FA
+    # 换成支持补零多行输入的封装，批量推理与单首推理共用同一个模型
+    model = acoustic_model.wrap_bundle_model(bundle.get_model()).to(torch.device(device_type))
+    return prepare_inference_backend(model, backend, device_type)
+
+def prepare_inference_backend(model, backend='eager', device_type='cpu'):
+    """
+    eager: 原始fp32模型
+    torchscript: 脚本化并冻结，再做面向推理的图优化（常量折叠、算子融合）
+    int8: Linear层动态量化为int8（仅CPU），卷积特征提取器仍为fp32
+    转换失败或设备不支持时退回eager
+    """
+    import torch
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"未知的推理后端: {backend}，可选: {', '.join(INFERENCE_BACKENDS)}")
+    model = model.eval()
+    if backend == 'int8':
+        if device_type != 'cpu':
+            logger.warning("int8动态量化只支持CPU，使用eager后端")
+            return model
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == 'torchscript':
+        try:
+            return torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.script(model)))
+        except Exception as e:
+            logger.warning(f"TorchScript转换失败（{e}），使用eager后端")
+    return model
+
+@functools.lru_cache(maxsize=None)
+def load_text_aligner():
+    """加载MMS_FA的分词器和CTC对齐器（不需要声学模型）"""
+    import torchaudio
+    bundle = torchaudio.pipelines.MMS_FA
+    return bundle.get_tokenizer(), bundle.get_aligner()
+
+@functools.lru_cache(maxsize=None)
+def load_silero_model():
+    """加载Silero VAD模型及其工具函数（进程内只加载一次）"""
+    import torch
+    return torch.hub.load(repo_or_dir='snakers4/silero-vad',
+                          model='silero_vad',
+                          force_reload=False,
+                          trust_repo=True)
+
+def get_device_type():
+    """返回推理使用的设备类型"""
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def preload_models(enable_vad=True, backend='eager'):
+    """预先加载所有模型，批量处理时避免首个歌曲承担加载时间"""
+    load_alignment_model(get_device_type(), backend)
+    load_text_aligner()
+    if enable_vad:
+        load_silero_model()
+
+def get_audio_duration(audio_file_path):
+    """读取音频时长（秒），不解码音频数据"""
+    import torchaudio
+    info = torchaudio.info(audio_file_path)
+    return info.num_frames / info.sample_rate
+
+# 所有模型共用的采样率（MMS_FA 与 Silero VAD 均为16kHz）
+SAMPLE_RATE = 16000
+
+class AudioData:
+    """
+    解码一次、在对齐、Silero VAD和音量检测之间共享的16kHz单声道音频
+    第一次访问samples时才解码，numpy与torch视图共享同一块内存
+    提供pcm_cache时解码结果保存到磁盘，之后的运行直接内存映射缓存文件
+    offset: 片段在整首歌曲中的起点（秒），端点检测的时间据此换算回整首歌曲的时间
+    多个线程同时访问samples时只解码一次
+    """
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE, pcm_cache=None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.pcm_cache = pcm_cache
+        self.offset = 0.0
+        self._samples = None
+        self._rms_db = None
+        self._lock = threading.Lock()
+
+    @property
+    def samples(self):
+        """float32 一维numpy数组"""
+        if self._samples is None:
+            with self._lock:
+                if self._samples is None:
+                    self._samples = self._load_samples()
+        return self._samples
+
+    def rms_db(self):
+        """
+        10ms步长的RMS能量（dB），返回 (rms_db, hop_length)
+        音量检测与能量门共用，多个线程同时调用时只计算一次
+        """
+        if self._rms_db is None:
+            # 先在锁外取得samples（samples本身会获取同一个锁）
+            samples = self.samples
+            with self._lock:
+                if self._rms_db is None:
+                    self._rms_db = compute_rms_db(samples, self.sample_rate)
+        return self._rms_db
+
+    def _load_samples(self):
+        if self.pcm_cache is None:
+            with instrument.stage('decode_audio'):
+                return decode_audio(self.path, self.sample_rate)
+
+        cache_key = make_cache_key(
+            'pcm', file_sha256(self.path), os.path.getmtime(self.path),
+            self.sample_rate, 'mono', 'float32'
         )
-        model = bundle.get_model().to(device)
-        tokenizer = bundle.get_tokenizer()
-        aligner = bundle.get_aligner()
-        valid_tokens = [token for token in text_tokens if token]
+        samples = self.pcm_cache.get(cache_key)
+        if samples is None:
+            with instrument.stage('decode_audio'):
+                samples = decode_audio(self.path, self.sample_rate)
+            self.pcm_cache.put(cache_key, samples)
+        return samples
+
+    @property
+    def duration(self):
+        """音频时长（秒）；尚未解码时只读取文件头"""
+        if self._samples is None:
+            return get_audio_duration(self.path)
+        return len(self._samples) / self.sample_rate
+
+    def as_tensor(self):
+        """零拷贝的一维torch张量视图"""
+        import torch
+        return torch.from_numpy(self.samples)
+
+    def segment(self, start_seconds, end_seconds):
+        """
+        [start_seconds, end_seconds) 的音频片段
+        已解码或有PCM缓存时直接切片（共享内存），否则只解码这一段
+        """
+        start_seconds = max(0.0, start_seconds)
+        if self._samples is not None or self.pcm_cache is not None:
+            first = int(round(start_seconds * self.sample_rate))
+            last = int(round(end_seconds * self.sample_rate))
+            samples = self.samples[first:last]
+        else:
+            with instrument.stage('decode_audio', start=start_seconds, end=end_seconds):
+                samples = decode_audio(self.path, self.sample_rate, start_seconds, end_seconds)
+        segment = AudioData(self.path, self.sample_rate)
+        segment._samples = samples
+        segment.offset = self.offset + start_seconds
+        return segment
+
+# 流式解码时每次读取的时长（秒）
+DECODE_BLOCK_SECONDS = 10.0
+
+def decode_audio(audio_file_path, sample_rate=SAMPLE_RATE, start_seconds=0.0, end_seconds=None):
+    """
+    解码音频并混合为单声道、重采样到sample_rate，返回float32 numpy数组
+    指定start_seconds/end_seconds时只解码这一段
+    按块读取，逐块混合声道并重采样后写入预先分配的输出数组，峰值内存约为输出数组加一块；
+    无法按块读取时整段加载
+    """
+    import torchaudio
+    info = torchaudio.info(audio_file_path)
+    orig_sample_rate = info.sample_rate
+    frame_offset = int(round(start_seconds * orig_sample_rate))
+    # 文件头的帧数只用来预先分配输出：VBR MP3等格式的帧数是按码率估算的，可能偏少或为0，
+    # 因此完整解码时总是读到文件末尾，只有指定end_seconds时才限制读取的帧数
+    expected_frames = max(0, info.num_frames - frame_offset)
+    max_frames = None
+    if end_seconds is not None:
+        max_frames = max(0, int(round((end_seconds - start_seconds) * orig_sample_rate)))
+        expected_frames = min(expected_frames, max_frames) if expected_frames else max_frames
+
+    block_frames = int(DECODE_BLOCK_SECONDS * orig_sample_rate)
+    try:
+        blocks = open_audio_blocks(audio_file_path, orig_sample_rate, frame_offset, block_frames)
+        return decode_blocks(blocks, orig_sample_rate, sample_rate, expected_frames, max_frames)
+    except Exception as e:
+        logger.debug(f"无法按块解码 {audio_file_path}，整段加载: {e}")
+        return decode_audio_full(audio_file_path, sample_rate, start_seconds, end_seconds)
+
+def decode_audio_full(audio_file_path, sample_rate=SAMPLE_RATE, start_seconds=0.0, end_seconds=None):
+    """一次读入整段音频再混合声道、重采样，内存峰值为原始采样率下整段音频的数倍"""
+    import torchaudio
+    kwargs = {}
+    if start_seconds or end_seconds is not None:
+        orig_sample_rate = torchaudio.info(audio_file_path).sample_rate
+        kwargs['frame_offset'] = int(round(start_seconds * orig_sample_rate))
+        if end_seconds is not None:
+            kwargs['num_frames'] = max(0, int(round((end_seconds - start_seconds) * orig_sample_rate)))
+    waveform, orig_sample_rate = torchaudio.load(audio_file_path, **kwargs)
+    waveform = waveform.mean(0)
+    if orig_sample_rate != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, orig_sample_rate, sample_rate)
+    return waveform.numpy()
+
+def open_audio_blocks(audio_file_path, orig_sample_rate, frame_offset, block_frames):
+    """
+    从frame_offset开始按块读取音频，返回逐块产出 (帧数, 声道数) float32数组的迭代器
+    有FFmpeg时使用StreamReader，否则使用libsndfile（与torchaudio.load的后端选择一致）
+    """
+    try:
+        from torchaudio.io import StreamReader
+        reader = StreamReader(audio_file_path)
+        reader.add_basic_audio_stream(frames_per_chunk=block_frames, format='fltp')
+        if frame_offset:
+            reader.seek(frame_offset / orig_sample_rate, mode='precise')
+        return (chunk.numpy() for chunk, in reader.stream())
+    except Exception as e:
+        logger.debug(f"StreamReader不可用，使用libsndfile读取: {e}")
+
+    import soundfile
+    file = soundfile.SoundFile(audio_file_path)
+    file.seek(frame_offset)
+
+    def read_blocks():
+        with file:
+            yield from file.blocks(blocksize=block_frames, dtype='float32', always_2d=True)
+    return read_blocks()
+
+def decode_blocks(blocks, orig_sample_rate, sample_rate, expected_frames=0, max_frames=None):
+    """
+    逐块混合声道并重采样，写入按expected_frames预先分配的输出数组，实际更长时扩大数组
+    max_frames为None时读完所有块，否则最多读取max_frames帧
+    """
+    import numpy as np
+    import torch
+    resampler = StreamingResampler(orig_sample_rate, sample_rate)
+    output = np.empty(resampler.output_length(expected_frames or 0), dtype=np.float32)
+    written = 0
+
+    def write(piece):
+        nonlocal output, written
+        if written + len(piece) > len(output):
+            # 实际帧数多于预计帧数（文件头少报）时扩大输出数组
+            output = np.concatenate([output[:written], np.empty(max(len(piece), written), np.float32)])
+        output[written:written + len(piece)] = piece.numpy()
+        written += len(piece)
+
+    remaining = max_frames
+    for block in blocks:
+        if remaining is not None:
+            block = block[:remaining]
+            remaining -= len(block)
+        write(resampler.push(torch.from_numpy(block).mean(1)))
+        if remaining == 0:
+            break
+    write(resampler.flush())
+    if written < len(output):
+        output.resize(written, refcheck=False)
+    return output
+
+class StreamingResampler:
+    """
+    分块重采样，结果与对整段音频调用torchaudio.functional.resample相同
+    sinc核只覆盖两侧有限的采样点，每次只处理右侧已有足够上下文的输入，
+    并保留左侧上下文作为下一块的滤波器状态
+    """
+
+    def __init__(self, orig_freq, new_freq, lowpass_filter_width=6, rolloff=0.99):
+        self.orig_freq = orig_freq
+        self.new_freq = new_freq
+        gcd = math.gcd(orig_freq, new_freq)
+        # 每step个输入采样点对应out_step个输出采样点，块边界取step的整数倍
+        self.step = orig_freq // gcd
+        self.out_step = new_freq // gcd
+        width = math.ceil(lowpass_filter_width * self.step / (min(self.step, self.out_step) * rolloff))
+        self.context = (width // self.step + 2) * self.step
+        self.lowpass_filter_width = lowpass_filter_width
+        self.rolloff = rolloff
+        self._pending = None
+        self._left = 0
+
+    def output_length(self, num_frames):
+        """num_frames个输入采样点重采样后的长度"""
+        return -(-num_frames * self.out_step // self.step)
+
+    def _resample(self, waveform):
+        import torchaudio
+        return torchaudio.functional.resample(waveform, self.orig_freq, self.new_freq,
+                                              lowpass_filter_width=self.lowpass_filter_width,
+                                              rolloff=self.rolloff)
+
+    def push(self, waveform):
+        """输入一块一维波形，返回可以确定的输出"""
+        import torch
+        if self.orig_freq == self.new_freq:
+            return waveform
+        pending = waveform if self._pending is None else torch.cat([self._pending, waveform])
+        ready = (len(pending) - self._left - self.context) // self.step * self.step
+        if ready <= 0:
+            self._pending = pending
+            return waveform[:0]
+        resampled = self._resample(pending[:self._left + ready + self.context])
+        first = self._left // self.step * self.out_step
+        output = resampled[first:first + ready // self.step * self.out_step]
+        left = min(self.context, self._left + ready)
+        self._pending = pending[self._left + ready - left:]
+        self._left = left
+        return output
+
+    def flush(self):
+        """输入结束，返回剩余的输出（末尾与整段重采样一样按零填充处理）"""
+        import torch
+        pending, self._pending = self._pending, None
+        if pending is None or len(pending) <= self._left:
+            return torch.zeros(0)
+        resampled = self._resample(pending)
+        return resampled[self._left // self.step * self.out_step:]
+
+def load_audio(audio, pcm_cache=None):
+    """接受音频路径或AudioData，统一返回AudioData"""
+    if isinstance(audio, AudioData):
+        return audio
+    return AudioData(audio, pcm_cache=pcm_cache)
+
+# wav2vec2 特征提取器每帧的步长与感受野（采样点）
+FRAME_SAMPLES = 320
+RECEPTIVE_FIELD = 400
+
+def count_emission_frames(num_samples):
+    """wav2vec2 对 num_samples 个采样点输出的帧数"""
+    if num_samples < RECEPTIVE_FIELD:
+        return 0
+    return (num_samples - RECEPTIVE_FIELD) // FRAME_SAMPLES + 1
+
+def compute_emission(model, waveform, sample_rate, chunk_seconds=None, overlap_seconds=1.0):
+    """
+    计算整段音频的emission
+    指定chunk_seconds时按固定长度、两侧带重叠上下文的窗口分块推理，
+    每块只保留中心部分的帧再拼接，峰值内存只取决于块长而与歌曲长度无关
+    """
+    import torch
+    num_samples = waveform.shape[-1]
+    if not chunk_seconds or num_samples <= int((chunk_seconds + 2 * overlap_seconds) * sample_rate):
+        emission, _ = model(waveform)
+        return emission
+
+    pieces = plan_emission_pieces(num_samples, sample_rate, chunk_seconds, overlap_seconds)
+    return torch.cat([compute_emission_piece(model, waveform, piece) for piece in pieces], dim=1)
+
+def plan_emission_pieces(num_samples, sample_rate, chunk_seconds=None, overlap_seconds=1.0, spans=None):
+    """
+    把需要推理的帧（spans为None时是整首歌曲）切成块，返回每块的 (first, last, begin, end)：
+    保留第[first, last)帧，输入第[begin, end)个采样点，即两侧各附加overlap_seconds的音频上下文
+    窗口起点对齐到帧步长，保证输出帧与整段推理的帧一一对应
+    """
+    total_frames = count_emission_frames(num_samples)
+    if spans is None:
+        if not chunk_seconds or num_samples <= int((chunk_seconds + 2 * overlap_seconds) * sample_rate):
+            return [(0, total_frames, 0, num_samples)] if total_frames else []
+        spans = [(0, total_frames)]
+    context_frames = int(overlap_seconds * sample_rate) // FRAME_SAMPLES
+    pieces = []
+    for first, last in spans:
+        hop_frames = last - first
+        if chunk_seconds:
+            hop_frames = max(1, int(chunk_seconds * sample_rate) // FRAME_SAMPLES)
+        for start in range(first, last, hop_frames):
+            stop = min(start + hop_frames, last)
+            ctx_first = max(0, start - context_frames)
+            ctx_last = min(total_frames, stop + context_frames)
+            pieces.append((start, stop, ctx_first * FRAME_SAMPLES,
+                           (ctx_last - 1) * FRAME_SAMPLES + RECEPTIVE_FIELD))
+    return pieces
+
+def compute_emission_piece(model, waveform, piece):
+    """对plan_emission_pieces中的一块推理，返回第[first, last)帧的emission"""
+    first, last, begin, end = piece
+    emission, _ = model(waveform[:, begin:end])
+    offset = begin // FRAME_SAMPLES
+    return emission[:, first - offset:last - offset]
+
+def emission_cache_key(audio, device_type, chunk_seconds, overlap_seconds, backend='eager',
+                       energy_gate=None):
+    """emission缓存键：音频内容 + 模型标识与推理后端 + 重采样、分块与能量门设置"""
+    import torchaudio
+    parts = [
+        'emission',
+        file_sha256(audio.path),
+        'MMS_FA', torchaudio.__version__, device_type, backend,
+        audio.sample_rate, 'sinc_interp_hann',
+        chunk_seconds, overlap_seconds if chunk_seconds else None
+    ]
+    # 不使用能量门时保持原来的键，已有的缓存继续有效
+    if energy_gate:
+        # blank_fill: 静音帧填入构造的blank帧（早期版本填入模型对噪声的输出，不能复用）
+        parts.extend(['gate', *energy_gate, overlap_seconds, 'blank_fill'])
+    return make_cache_key(*parts)
+
+def get_emission(audio, chunk_seconds=None, overlap_seconds=1.0, emission_cache=None,
+                 backend='eager', energy_gate=None):
+    """
+    计算音频的emission，形状为 (1, 帧数, 字符数)
+    audio 可以是音频路径或AudioData
+    提供emission_cache时先按音频内容、模型和重采样设置查找缓存，命中则完全跳过解码和声学模型
+    energy_gate: (阈值dB, 最短静音秒数)，指定时只对有声段运行声学模型，静音段填入以blank为主的构造帧（silence_emission）
+    """
+    import torch
+    audio = load_audio(audio)
+    device = torch.device(get_device_type())
+
+    cache_key = None
+    if emission_cache is not None:
+        cache_key = emission_cache_key(audio, device.type, chunk_seconds, overlap_seconds, backend,
+                                       energy_gate)
+        cached = emission_cache.get(cache_key)
+        if cached is not None:
+            logger.info("命中emission缓存，跳过声学模型推理")
+            return torch.from_numpy(cached)
+
+    waveform = audio.as_tensor().unsqueeze(0)
+    model = load_alignment_model(device.type, backend)
+    spans = None
+    if energy_gate:
+        with instrument.stage('energy_gate'):
+            spans = find_voiced_spans(audio, *energy_gate)
+    with instrument.stage('acoustic_model', samples=waveform.shape[-1]) as event:
+        with torch.inference_mode():
+            if spans is None:
+                emission = compute_emission(model, waveform.to(device), audio.sample_rate,
+                                            chunk_seconds, overlap_seconds)
+            else:
+                emission = compute_gated_emission(model, waveform.to(device), audio.sample_rate, spans,
+                                                  silence_emission(),
+                                                  chunk_seconds, overlap_seconds)
+                event['voiced_frames'] = sum(last - first for first, last in spans)
+        event['frames'] = emission.shape[1]
+    if spans is not None:
+        voiced = event['voiced_frames'] / max(1, event['frames'])
+        logger.info(f"能量门：只对 {voiced:.0%} 的帧运行声学模型，跳过 {len(spans)} 个有声段之间的静音")
+
+    if emission_cache is not None:
+        emission_cache.put(cache_key, emission.cpu().numpy())
+    return emission
+
+# 能量门：有声段两侧保留的上下文（秒），避免切掉弱起的辅音与尾音
+ENERGY_GATE_PADDING_SECONDS = 0.5
+
+def find_voiced_spans(audio, threshold_db=-50, min_silence_seconds=2.0):
+    """
+    用RMS能量找出需要运行声学模型的emission帧区间 [(first, last)]
+    只跳过能量低于threshold_db（相对整首最大值）且持续不短于min_silence_seconds的静音，
+    每个有声段两侧各保留ENERGY_GATE_PADDING_SECONDS
+    """
+    audio = load_audio(audio)
+    rms_db, hop_length = audio.rms_db()
+    starts, ends = find_speech_segments(rms_db > threshold_db, hop_length, audio.sample_rate,
+                                        min_silence_seconds, min_duration=0.0)
+    total_frames = count_emission_frames(len(audio.samples))
+    frames_per_second = audio.sample_rate / FRAME_SAMPLES
+    spans = []
+    for start, end in zip(starts, ends):
+        first = max(0, int((start - ENERGY_GATE_PADDING_SECONDS) * frames_per_second))
+        last = min(total_frames, math.ceil((end + ENERGY_GATE_PADDING_SECONDS) * frames_per_second))
+        if spans and first <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], last))
+        elif first < last:
+            spans.append((first, last))
+    return spans
+
+# 能量门跳过的帧中非blank字符的对数几率（相对blank），远低于模型在真实静音上的输出
+SILENCE_NON_BLANK_LOGIT = -30.0
+
+@functools.lru_cache(maxsize=None)
+def silence_emission():
+    """
+    能量门跳过的帧填入的一帧emission，形状为 (字符数,)
+    直接构造而不是让模型推理静音：MMS_FA会先对输入做归一化，近乎静音的输入被放大成噪声，输出不一定以blank为主
+    blank的对数概率约为0，其他字符约为SILENCE_NON_BLANK_LOGIT，与模型输出一样经过log_softmax；
+    MMS_FA附加的star列与模型输出一样为0
+    """
+    import torch
+    import torchaudio
+    width = len(torchaudio.pipelines.MMS_FA.get_labels())
+    num_labels = count_real_labels(width)
+    logits = torch.full((num_labels,), SILENCE_NON_BLANK_LOGIT)
+    logits[0] = 0.0
+    row = torch.cat([torch.log_softmax(logits, dim=-1), torch.zeros(width - num_labels)])
+    check_silence_row(row)
+    return row
+
+def count_real_labels(width):
+    """emission的列数中真实字符（含blank）的个数：宽度与MMS_FA的标签表相同时最后一列是star"""
+    import torchaudio
+    labels = torchaudio.pipelines.MMS_FA.get_labels()
+    return width - 1 if width == len(labels) and labels[-1] == '*' else width
+
+def check_silence_row(row):
+    """静音帧必须以blank为主，否则CTC对齐会把字符放进被跳过的静音里"""
+    num_labels = count_real_labels(row.shape[-1])
+    assert int(row[:num_labels].argmax()) == 0, "能量门的静音帧必须以blank为主"
+
+def compute_gated_emission(model, waveform, sample_rate, spans, silence_row,
+                           chunk_seconds=None, overlap_seconds=1.0):
+    """
+    只对spans中的帧运行声学模型（两侧带overlap_seconds上下文，长段按chunk_seconds分块），
+    其余帧填入silence_row；帧数与整段推理相同
+    """
+    check_silence_row(silence_row)
+    total_frames = count_emission_frames(waveform.shape[-1])
+    emission = silence_row.to(waveform.device).expand(1, total_frames, -1).clone()
+    for piece in plan_emission_pieces(waveform.shape[-1], sample_rate, chunk_seconds, overlap_seconds, spans):
+        first, last = piece[:2]
+        emission[:, first:last] = compute_emission_piece(model, waveform, piece)
+    return emission
+
+def split_padded_batches(pieces, max_batch_samples=None):
+    """
+    pieces按输入长度从长到短排列，依次装入mini-batch：每个mini-batch补零后的采样点总数
+    （行数 × 第一块的长度）不超过max_batch_samples，单块超过上限时单独成为一个mini-batch
+    """
+    batches = []
+    for piece in pieces:
+        if batches:
+            batch = batches[-1]
+            width = batch[0][-1] - batch[0][-2]
+            if max_batch_samples is None or (len(batch) + 1) * width <= max_batch_samples:
+                batch.append(piece)
+                continue
+        batches.append([piece])
+    return batches
+
+def compute_emissions_batched(model, waveforms, sample_rate, chunk_seconds=None, overlap_seconds=1.0,
+                              spans_list=None, silence_row=None, max_batch_samples=None):
+    """
+    多首歌曲的批量推理：各歌曲按compute_emission（指定spans时按compute_gated_emission）的方式分块，
+    所有块按长度排序后拼成补零的mini-batch，每个mini-batch只做一次前向（传入每行的真实长度），
+    再把各块的帧放回所属歌曲；每首歌曲的结果与单独推理相同（浮点误差以内）
+    waveforms: 每首歌曲 (1, 采样点) 的波形；spans_list: 每首歌曲的有声帧区间，None表示整首推理
+    返回每首歌曲 (1, 帧数, 字符数) 的emission
+    """
+    import torch
+    if silence_row is not None:
+        check_silence_row(silence_row)
+    pieces = []
+    for song, waveform in enumerate(waveforms):
+        spans = spans_list[song] if spans_list else None
+        for piece in plan_emission_pieces(waveform.shape[-1], sample_rate, chunk_seconds,
+                                          overlap_seconds, spans):
+            pieces.append((song, *piece))
+    # 长度相近的块放在同一个mini-batch，补零最少
+    pieces.sort(key=lambda piece: piece[-1] - piece[-2], reverse=True)
+
+    emissions = [None] * len(waveforms)
+    num_labels = None if silence_row is None else silence_row.shape[-1]
+    for batch in split_padded_batches(pieces, max_batch_samples):
+        lengths = [end - begin for *_, begin, end in batch]
+        inputs = waveforms[0].new_zeros(len(batch), lengths[0])
+        for row, (song, _, _, begin, end) in enumerate(batch):
+            inputs[row, :end - begin] = waveforms[song][0, begin:end]
+        output, _ = model(inputs, torch.tensor(lengths, device=inputs.device))
+        num_labels = output.shape[-1]
+        for row, (song, first, last, begin, _) in enumerate(batch):
+            if emissions[song] is None:
+                emissions[song] = new_song_emission(waveforms[song], num_labels, silence_row)
+            offset = begin // FRAME_SAMPLES
+            emissions[song][:, first:last] = output[row:row + 1, first - offset:last - offset]
+
+    # 没有任何需要推理的帧的歌曲（过短，或能量门判定整首都是静音）
+    return [emission if emission is not None else new_song_emission(waveform, num_labels or 0, silence_row)
+            for waveform, emission in zip(waveforms, emissions)]
+
+def new_song_emission(waveform, num_labels, silence_row=None):
+    """与整段推理帧数相同的emission，先填入silence_row（没有时填0）"""
+    import torch
+    total_frames = count_emission_frames(waveform.shape[-1])
+    if silence_row is not None:
+        return silence_row.to(waveform.device).expand(1, total_frames, -1).clone()
+    return torch.zeros(1, total_frames, num_labels, device=waveform.device)
+
+def get_emissions_batched(audios, chunk_seconds=None, overlap_seconds=1.0, backend='eager',
+                          energy_gate=None, max_batch_seconds=None):
+    """
+    对多首歌曲一起计算emission，每首歌曲的结果与get_emission相同（浮点误差以内，int8后端的
+    激活量化尺度按mini-batch计算，差异略大）
+    max_batch_seconds: 每个mini-batch补零后的音频总长（秒），限制一次前向的内存
+    """
+    import torch
+    audios = [load_audio(audio) for audio in audios]
+    device = torch.device(get_device_type())
+    model = load_alignment_model(device.type, backend)
+    sample_rate = audios[0].sample_rate if audios else SAMPLE_RATE
+
+    spans_list = silence_row = None
+    if energy_gate:
+        with instrument.stage('energy_gate'):
+            spans_list = [find_voiced_spans(audio, *energy_gate) for audio in audios]
+        silence_row = silence_emission()
+
+    waveforms = [audio.as_tensor().unsqueeze(0).to(device) for audio in audios]
+    max_batch_samples = int(max_batch_seconds * sample_rate) if max_batch_seconds else None
+    with instrument.stage('batched_acoustic_model', songs=len(audios),
+                          samples=sum(w.shape[-1] for w in waveforms)) as event:
+        with torch.inference_mode():
+            emissions = compute_emissions_batched(model, waveforms, sample_rate, chunk_seconds,
+                                                  overlap_seconds, spans_list, silence_row,
+                                                  max_batch_samples)
+        event['frames'] = sum(emission.shape[1] for emission in emissions)
+    return emissions
+
+def get_emission_window(audio, first, last, chunk_seconds=None, overlap_seconds=1.0,
+                        emission_cache=None, backend='eager', energy_gate=None):
+    """
+    整首歌曲emission的第[first, last)帧，形状为 (1, 帧数, 字符数)
+    emission_cache中有整首歌曲的结果时直接切片，否则只对这一段音频推理（两侧各带overlap_seconds上下文）；
+    与get_emission一样按chunk_seconds分块推理，窗口覆盖大半首歌曲时峰值内存也不超过一块
+    energy_gate只用于查找整首歌曲的缓存，这一段本身总是完整推理
+    """
+    import torch
+    audio = load_audio(audio)
+    device = torch.device(get_device_type())
+    if emission_cache is not None:
+        cached = emission_cache.get(
+            emission_cache_key(audio, device.type, chunk_seconds, overlap_seconds, backend,
+                               energy_gate))
+        if cached is not None:
+            logger.info("命中emission缓存，跳过声学模型推理")
+            return torch.from_numpy(cached[:, first:last])
+
+    frame_seconds = FRAME_SAMPLES / audio.sample_rate
+    context_frames = int(overlap_seconds * audio.sample_rate) // FRAME_SAMPLES
+    ctx_first = max(0, first - context_frames)
+    segment = audio.segment(ctx_first * frame_seconds,
+                            (last + context_frames - 1) * frame_seconds
+                            + RECEPTIVE_FIELD / audio.sample_rate)
+    model = load_alignment_model(device.type, backend)
+    with instrument.stage('acoustic_model', samples=len(segment.samples)) as event:
+        with torch.inference_mode():
+            emission = compute_emission(model, segment.as_tensor().unsqueeze(0).to(device),
+                                        segment.sample_rate, chunk_seconds, overlap_seconds)
+        event['frames'] = emission.shape[1]
+    return emission[:, first - ctx_first:last - ctx_first]
+
+def align_emission(emission, text_tokens, frame_offset=0):
+    """
+    用CTC对齐器把文本token对齐到emission上，返回每个token的时间（整数百分秒）与置信度
+    emission只是整首歌曲的一段时，frame_offset为这一段第一帧在整首歌曲中的帧号
+    """
+    import torch
+    tokenizer, aligner = load_text_aligner()
+    valid_tokens = [token for token in text_tokens if token]
+    with instrument.stage('ctc_align', frames=emission.shape[1], tokens=len(valid_tokens)):
         with torch.inference_mode():
-            emission, _ = model(waveform.to(device))
             tokens = tokenizer(valid_tokens)
             token_spans = aligner(emission[0], tokens)
-        results = []
-        frame_duration = 1.0 / bundle.sample_rate * 320
-        for i, spans in enumerate(token_spans):
-            if not spans:
-                results.append({
-                    'token': valid_tokens[i],
-                    'start': '[error]',
-                    'end': '[error]',
-                    'score': 0.0  # 添加score，错误时设为0
-                })
-                continue
-            start_time = spans[0].start * frame_duration
-            end_time = spans[-1].end * frame_duration
-            
-            # 计算置信度分数 - 可以取平均值
-            confidence_scores = [span.score for span in spans]
-            avg_score = sum(confidence_scores) / len(confidence_scores)
-            
+    return token_spans_to_results(valid_tokens, token_spans, frame_offset)
+
+def token_spans_to_results(valid_tokens, token_spans, frame_offset=0):
+    """把每个token的CTC span转换为时间（整数百分秒）与平均置信度"""
+    import torchaudio
+    bundle = torchaudio.pipelines.MMS_FA
+    results = []
+    frame_duration = 1.0 / bundle.sample_rate * FRAME_SAMPLES
+    for i, spans in enumerate(token_spans):
+        if not spans:
             results.append({
                 'token': valid_tokens[i],
-                'start': format_time_from_seconds(start_time),
-                'end': format_time_from_seconds(end_time),
-                'score': round(avg_score, 4)  # 添加score，保留4位小数
+                'start': ERROR_TIME,
+                'end': ERROR_TIME,
+                'score': 0.0  # 添加score，错误时设为0
             })
-        return results
+            continue
+        start_time = (spans[0].start + frame_offset) * frame_duration
+        end_time = (spans[-1].end + frame_offset) * frame_duration
+        
+        # 计算置信度分数 - 可以取平均值
+        confidence_scores = [span.score for span in spans]
+        avg_score = sum(confidence_scores) / len(confidence_scores)
+        
+        results.append({
+            'token': valid_tokens[i],
+            'start': seconds_to_hundredths(start_time),
+            'end': seconds_to_hundredths(end_time),
+            'score': round(avg_score, 4)  # 添加score，保留4位小数
+        })
+    return results
+
+# CTC对齐方式：整首一次对齐、沿粗路径分窗对齐、在行间静音处切分后并行对齐
+ALIGNMENT_MODES = ('full', 'banded', 'segmented')
+
+# 分窗对齐：粗对齐时最多合并的帧数，以及精对齐窗口在粗路径之外保留的余量（秒）
+BANDED_MAX_COARSE_FACTOR = 4
+BANDED_MARGIN_SECONDS = 2.0
+
+def align_emission_banded(emission, text_tokens, frame_offset=0, line_starts=None, window_tokens=400):
+    """
+    分窗CTC对齐，结果格式与align_emission相同，适合token很多的长歌曲
+    先在按时间合并帧的粗emission上对齐整首歌曲得到粗路径，再按行把token分成约window_tokens个字符的窗口，
+    每个窗口从上一窗口的结束帧开始，只在粗路径（加余量）覆盖的帧上精对齐
+    line_starts: 每行第一个token在text_tokens中的下标，窗口只在行首切分；None时可在任意token处切分
+    """
+    import torch
+    tokenizer, aligner = load_text_aligner()
+    valid_tokens = [token for token in text_tokens if token]
+    valid_line_starts = to_valid_line_starts(text_tokens, line_starts)
+
+    with instrument.stage('ctc_align', frames=emission.shape[1], tokens=len(valid_tokens),
+                          banded=True) as event:
+        with torch.inference_mode():
+            tokens = tokenizer(valid_tokens)
+            windows = plan_alignment_windows([len(t) for t in tokens], valid_line_starts, window_tokens)
+            factor = choose_coarse_factor(emission.shape[1], tokens)
+            event.update(windows=len(windows), coarse_factor=factor)
+            if len(windows) == 1 or factor == 1:
+                token_spans = aligner(emission[0], tokens)
+            else:
+                try:
+                    coarse_frames = coarse_word_frames(emission[0], tokens, factor, aligner)
+                    token_spans = align_windows(emission[0], tokens, windows,
+                                                [end for _, end in coarse_frames], aligner)
+                except RuntimeError as e:
+                    logger.warning(f"分窗对齐失败（{e}），改为整首对齐")
+                    token_spans = aligner(emission[0], tokens)
+    return token_spans_to_results(valid_tokens, token_spans, frame_offset)
+
+def to_valid_line_starts(text_tokens, line_starts):
+    """把行首在text_tokens中的下标换算为去掉空token之后的下标集合，line_starts为None时返回None"""
+    if line_starts is None:
+        return None
+    valid_index = [0]
+    for token in text_tokens:
+        valid_index.append(valid_index[-1] + bool(token))
+    return {valid_index[i] for i in line_starts if i <= len(text_tokens)}
+
+def shift_spans(word_spans, offset):
+    """把一个词的CTC span平移offset帧"""
+    import dataclasses
+    return [dataclasses.replace(span, start=span.start + offset, end=span.end + offset)
+            for span in word_spans]
+
+def count_ctc_frames(tokens):
+    """CTC对齐一串字符所需的最少帧数：字符数加上相邻重复字符之间必需的blank"""
+    flat = [c for word in tokens for c in word]
+    return len(flat) + sum(a == b for a, b in zip(flat, flat[1:]))
+
+def choose_coarse_factor(num_frames, tokens):
+    """粗对齐合并的帧数：合并后的帧数至少为所需帧数的两倍，否则不做粗对齐（返回1）"""
+    required = count_ctc_frames(tokens)
+    for factor in range(BANDED_MAX_COARSE_FACTOR, 1, -1):
+        if num_frames // factor >= 2 * required:
+            return factor
+    return 1
+
+def plan_alignment_windows(lengths, line_starts, window_tokens):
+    """
+    把词（每个词lengths[i]个字符）依次分成窗口，返回 [(起始词, 结束词)]
+    字符数达到window_tokens后在下一个行首切分；一直没有行首时在两倍window_tokens处强制切分
+    """
+    windows = []
+    start = size = 0
+    for i, length in enumerate(lengths):
+        at_line_start = line_starts is None or i in line_starts
+        if i > start and (size >= 2 * window_tokens or (at_line_start and size >= window_tokens)):
+            windows.append((start, i))
+            start, size = i, 0
+        size += length
+    windows.append((start, len(lengths)))
+    return windows
+
+def coarse_word_frames(emission, tokens, factor, aligner):
+    """
+    在每factor帧合并为一帧（概率求和）的emission上对齐，返回每个词在原始帧上的 (开始帧, 结束帧)
+    没有对齐结果的词沿用前一个词的结束帧
+    """
+    import torch
+    num_frames = emission.shape[0]
+    pad = -num_frames % factor
+    if pad:
+        emission = torch.cat([emission, emission.new_full((pad, emission.shape[1]), float('-inf'))])
+    coarse = emission.reshape(-1, factor, emission.shape[1]).logsumexp(1)
+    frames = []
+    for spans in aligner(coarse, tokens):
+        if spans:
+            frames.append((spans[0].start * factor, min(num_frames, spans[-1].end * factor)))
+        else:
+            end = frames[-1][1] if frames else 0
+            frames.append((end, end))
+    return frames
+
+def align_windows(emission, tokens, windows, coarse_ends, aligner):
+    """
+    依次精对齐各窗口，每个窗口额外带上下一个窗口开头约四分之一窗口的词作为前瞻，只保留本窗口的结果
+    窗口内最后一个词的结束离帧范围末尾太近时，说明粗路径偏早，扩大帧范围重新对齐
+    """
+    num_frames = emission.shape[0]
+    margin = int(BANDED_MARGIN_SECONDS * SAMPLE_RATE / FRAME_SAMPLES)
+    token_spans = []
+    first_frame = 0
+    for index, (start, stop) in enumerate(windows):
+        lookahead = stop
+        if index + 1 < len(windows):
+            lookahead_size = 0
+            limit = max(1, sum(len(t) for t in tokens[start:stop]) // 4)
+            while lookahead < windows[index + 1][1] and lookahead_size < limit:
+                lookahead_size += len(tokens[lookahead])
+                lookahead += 1
+        window_tokens = tokens[start:lookahead]
+        required = count_ctc_frames(window_tokens)
+        last_frame = num_frames if lookahead == len(tokens) else coarse_ends[lookahead - 1] + margin
+        extra = margin
+        while True:
+            last_frame = min(num_frames, max(last_frame, first_frame + required))
+            spans = aligner(emission[first_frame:last_frame], window_tokens)
+            end = max((s[-1].end for s in spans[:stop - start] if s), default=0) + first_frame
+            if last_frame == num_frames or end < last_frame - margin // 2:
+                break
+            last_frame += extra
+            extra *= 2
+        token_spans.extend(shift_spans(word_spans, first_frame) for word_spans in spans[:stop - start])
+        first_frame = end
+    return token_spans
+
+# 分段对齐：只在行间静音不短于该时长（秒）的地方切分
+SEGMENT_MIN_PAUSE_SECONDS = 0.2
+
+def align_emission_segmented(emission, text_tokens, frame_offset=0, line_starts=None, endpoints=(),
+                             region_tokens=400, max_workers=None):
+    """
+    分段并行CTC对齐，结果格式与align_emission相同
+    先在粗emission上对齐得到每行的大致位置，在行与行之间的语音端点（静音开始处）把歌曲切成互不重叠的区域，
+    各区域的emission切片与对应的歌词行在线程池中并行对齐（对齐在C++中运行，不占用GIL），再按绝对时间拼接
+    endpoints: 其他来源（Silero VAD、音量检测）的端点时间（整首歌曲的百分秒），与emission端点一起作为切分候选
+    region_tokens: 每个区域至少包含的字符数
+    """
+    import torch
+    from concurrent.futures import ThreadPoolExecutor
+    tokenizer, aligner = load_text_aligner()
+    valid_tokens = [token for token in text_tokens if token]
+    valid_line_starts = to_valid_line_starts(text_tokens, line_starts)
+
+    with instrument.stage('ctc_align', frames=emission.shape[1], tokens=len(valid_tokens),
+                          segmented=True) as event:
+        with torch.inference_mode():
+            tokens = tokenizer(valid_tokens)
+            factor = choose_coarse_factor(emission.shape[1], tokens)
+            regions = [(0, len(tokens), 0, emission.shape[1])]
+            if factor > 1 and count_ctc_frames(tokens) > region_tokens:
+                coarse_frames = coarse_word_frames(emission[0], tokens, factor, aligner)
+                # 端点换算为这段emission中的帧号
+                frames_per_hundredth = SAMPLE_RATE / FRAME_SAMPLES / 100
+                endpoint_frames = sorted(
+                    int(t * frames_per_hundredth) - frame_offset
+                    for t in list(endpoints) + get_emission_endpoints(emission, frame_offset=frame_offset)
+                )
+                regions = plan_alignment_regions(tokens, valid_line_starts, coarse_frames,
+                                                 endpoint_frames, region_tokens, emission.shape[1])
+            event.update(regions=len(regions), coarse_factor=factor)
+
+            def align_region(region):
+                start, stop, first_frame, last_frame = region
+                spans = aligner(emission[0, first_frame:last_frame], tokens[start:stop])
+                return [shift_spans(word_spans, first_frame) for word_spans in spans]
+
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    token_spans = [spans for region_spans in pool.map(align_region, regions)
+                                   for spans in region_spans]
+            except RuntimeError as e:
+                logger.warning(f"分段对齐失败（{e}），改为整首对齐")
+                token_spans = aligner(emission[0], tokens)
+    return token_spans_to_results(valid_tokens, token_spans, frame_offset)
+
+def plan_alignment_regions(tokens, line_starts, coarse_frames, endpoint_frames, region_tokens, num_frames):
+    """
+    把歌曲切成互不重叠的区域，返回 [(起始词, 结束词, 起始帧, 结束帧)]
+    在每个行首前，找离上一行粗结束帧最近、且之后到下一行粗开始帧至少有一段静音的端点，
+    在端点与下一行开始之间的中点切分；区域不足region_tokens个字符或帧数不够CTC对齐时与下一区域合并
+    """
+    min_pause = int(SEGMENT_MIN_PAUSE_SECONDS * SAMPLE_RATE / FRAME_SAMPLES)
+    lengths = [len(t) for t in tokens]
+    cuts = []
+    for word in range(1, len(tokens)):
+        if line_starts is not None and word not in line_starts:
+            continue
+        previous_end = coarse_frames[word - 1][1]
+        next_start = coarse_frames[word][0]
+        # 粗路径有几帧的误差，端点可以比上一行的粗结束帧略早
+        low = bisect.bisect_left(endpoint_frames, previous_end - min_pause)
+        high = bisect.bisect_left(endpoint_frames, next_start - min_pause)
+        if low >= high:
+            continue
+        endpoint = min(endpoint_frames[low:high], key=lambda frame: abs(frame - previous_end))
+        cuts.append((word, (max(endpoint, previous_end) + next_start) // 2))
+
+    prefix = [0]
+    for length in lengths:
+        prefix.append(prefix[-1] + length)
+    regions = []
+    start = first_frame = 0
+    for word, frame in cuts:
+        if (frame > first_frame and prefix[word] - prefix[start] >= region_tokens
+                and frame - first_frame >= count_ctc_frames(tokens[start:word])):
+            regions.append((start, word, first_frame, frame))
+            start, first_frame = word, frame
+    # 最后一段太短或帧数不够时并入前一个区域
+    if regions and (prefix[-1] - prefix[start] < region_tokens // 2
+                    or num_frames - first_frame < count_ctc_frames(tokens[start:])):
+        start, _, first_frame, _ = regions.pop()
+    regions.append((start, len(tokens), first_frame, num_frames))
+    return regions
+
+def align_audio_with_text(audio, text_tokens, chunk_seconds=None, overlap_seconds=1.0,
+                          emission_cache=None, backend='eager'):
+    """
+    对齐音频与文本
+    audio: 音频路径或AudioData
+    chunk_seconds: 分块计算emission的块长（秒），None表示整段一次推理
+    overlap_seconds: 分块时每块两侧附加的上下文长度（秒）
+    emission_cache: 可选的ArrayCache，歌词修改后重跑时复用emission
+    backend: 声学模型的推理后端（eager / torchscript / int8）
+    """
+    return align_audio_with_emission(audio, text_tokens, chunk_seconds, overlap_seconds,
+                                     emission_cache, backend)[0]
+
+def align_audio_with_emission(audio, text_tokens, chunk_seconds=None, overlap_seconds=1.0,
+                              emission_cache=None, backend='eager'):
+    """与align_audio_with_text相同，同时返回emission（失败时为None）供端点检测复用"""
+    emission = None
+    try:
+        emission = get_emission(audio, chunk_seconds, overlap_seconds, emission_cache, backend)
+        return align_emission(emission, text_tokens), emission
     except Exception as e:
-        print(f"Error during alignment: {e}")
-        return []
+        logger.error(f"Error during alignment: {e}")
+        return [], emission
 
-def get_silero_endpoints(audio_file, min_gap_seconds=0.3):
+def get_silero_endpoints(audio, min_gap_seconds=0.3):
     """获取Silero VAD的端点时间（百分秒格式）"""
-    model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad',
-                                  model='silero_vad',
-                                  force_reload=False,
-                                  trust_repo=True)
+    audio = load_audio(audio)
+    model, utils = load_silero_model()
     
     get_speech_timestamps = utils[0]
-    read_audio = utils[2]
     
-    wav = read_audio(audio_file)
     speech_timestamps = get_speech_timestamps(
-        wav, 
+        audio.as_tensor(), 
         model,
+        sampling_rate=audio.sample_rate,
         min_silence_duration_ms=int(min_gap_seconds * 1000)
     )
     
     # 转换为百分秒格式
     endpoints = []
     for timestamp in speech_timestamps:
-        end_time_seconds = timestamp['end'] / 16000
+        end_time_seconds = timestamp['end'] / audio.sample_rate + audio.offset
         hundredths = int(end_time_seconds * 100)
         endpoints.append(hundredths)
     
     return endpoints
 
-def get_volume_endpoints(audio_file, min_gap_seconds=0.3, volume_threshold=-40):
-    """使用音量检测获取端点时间（百分秒格式）"""
-    # 加载音频
-    y, sr = librosa.load(audio_file, sr=None)
+def compute_rms_db(samples, sample_rate):
+    """计算10ms步长、25ms窗口的RMS能量（dB，以最大值为0dB），返回 (rms_db, hop_length)"""
+    import librosa
+    import numpy as np
+    frame_length = int(0.025 * sample_rate)  # 25ms窗口
+    hop_length = int(0.01 * sample_rate)     # 10ms步长
     
-    # 计算RMS能量（音量）
-    frame_length = int(0.025 * sr)  # 25ms窗口
-    hop_length = int(0.01 * sr)     # 10ms步长
-    
-    rms = librosa.feature.rms(y=y, frame_length=frame_length, hop_length=hop_length)[0]
+    rms = librosa.feature.rms(y=samples, frame_length=frame_length, hop_length=hop_length)[0]
     
     # 转换为dB
-    rms_db = librosa.amplitude_to_db(rms, ref=np.max)
+    return librosa.amplitude_to_db(rms, ref=np.max), hop_length
+
+def find_speech_segments(is_speech, hop_length, sample_rate, min_gap_seconds=0.3, min_duration=0.1):
+    """
+    从逐帧的语音标记中找出语音段（秒），全部使用数组运算
+    过滤短于min_duration的段落，并合并间隔小于min_gap_seconds的相邻段落
+    返回 (starts, ends) 两个float64数组
+    """
+    import numpy as np
+    # 在首尾补False后做差分，+1处为语音段开始帧，-1处为结束帧
+    padded = np.concatenate(([False], np.asarray(is_speech, dtype=bool), [False]))
+    edges = np.diff(padded.astype(np.int8))
+    start_frames = np.flatnonzero(edges == 1)
+    end_frames = np.flatnonzero(edges == -1)
+    
+    starts = start_frames * hop_length / sample_rate
+    ends = end_frames * hop_length / sample_rate
+    
+    # 过滤太短的段落
+    long_enough = ends - starts > min_duration
+    starts, ends = starts[long_enough], ends[long_enough]
+    if len(starts) == 0:
+        return starts, ends
+    
+    # 间隔不小于min_gap_seconds处为合并后段落的分界
+    breaks = starts[1:] - ends[:-1] >= min_gap_seconds
+    group_first = np.concatenate(([True], breaks))
+    group_last = np.concatenate((breaks, [True]))
+    return starts[group_first], ends[group_last]
+
+def get_volume_endpoints(audio, min_gap_seconds=0.3, volume_threshold=-40):
+    """使用音量检测获取端点时间（百分秒格式）"""
+    import numpy as np
+    # 使用共享的16kHz音频，不再单独按原始采样率解码
+    audio = load_audio(audio)
+    rms_db, hop_length = audio.rms_db()
     
     # 检测语音段
     is_speech = rms_db > volume_threshold
-    
-    # 找到语音段的开始和结束
-    speech_segments = []
-    in_speech = False
-    start_frame = 0
-    
-    for i, speech in enumerate(is_speech):
-        if speech and not in_speech:
-            start_frame = i
-            in_speech = True
-        elif not speech and in_speech:
-            # 语音段结束
-            start_time = start_frame * hop_length / sr
-            end_time = i * hop_length / sr
-            
-            # 检查段落长度，过滤太短的段落
-            if end_time - start_time > 0.1:  # 至少100ms
-                speech_segments.append((start_time, end_time))
-            in_speech = False
-    
-    # 处理最后一个段落
-    if in_speech:
-        start_time = start_frame * hop_length / sr
-        end_time = len(is_speech) * hop_length / sr
-        if end_time - start_time > 0.1:
-            speech_segments.append((start_time, end_time))
-    
-    # 合并间隔小于min_gap_seconds的段落
-    merged_segments = []
-    for start, end in speech_segments:
-        if merged_segments and start - merged_segments[-1][1] < min_gap_seconds:
-            # 合并到前一个段落
-            merged_segments[-1] = (merged_segments[-1][0], end)
-        else:
-            merged_segments.append((start, end))
+    _, ends = find_speech_segments(is_speech, hop_length, audio.sample_rate, min_gap_seconds)
     
     # 提取端点（只返回结束时间）
-    endpoints = []
-    for _, end_time in merged_segments:
-        hundredths = int(end_time * 100)
-        endpoints.append(hundredths)
-    
-    return endpoints
+    return ((ends + audio.offset) * 100).astype(np.int64).tolist()
+
+# 由emission判断有声帧：非blank概率的滑动平均窗口（秒）与阈值
+# CTC的非blank概率集中在每个字符的尖峰上，平滑后一个窗口内出现一次确定的尖峰即视为有声
+EMISSION_SMOOTHING_SECONDS = 0.2
+EMISSION_SPEECH_THRESHOLD = 0.08
+
+def get_emission_endpoints(emission, min_gap_seconds=0.3, frame_offset=0):
+    """
+    从MMS_FA emission的逐帧非blank后验概率获取端点时间（百分秒格式），不需要再运行VAD模型
+    emission只是整首歌曲的一段时，frame_offset为这一段第一帧在整首歌曲中的帧号
+    """
+    import numpy as np
+    # blank为下标0；MMS_FA附加的star列不是概率，只用blank列计算
+    speech_prob = 1.0 - np.exp(emission[0, :, 0].float().cpu().numpy())
+    frame_seconds = FRAME_SAMPLES / SAMPLE_RATE
+    width = max(1, int(round(EMISSION_SMOOTHING_SECONDS / frame_seconds)))
+    smoothed = np.convolve(speech_prob, np.ones(width) / width, mode='same')
+    _, ends = find_speech_segments(smoothed > EMISSION_SPEECH_THRESHOLD, FRAME_SAMPLES,
+                                   SAMPLE_RATE, min_gap_seconds)
+    # 滑动平均把尖峰向后扩展了约半个窗口，结束时间减去这部分
+    ends = ends + (frame_offset - (width - 1) // 2) * frame_seconds
+    return (ends * 100).astype(np.int64).tolist()
+
+class EndpointIndex:
+    """
+    按时间排序的端点索引
+    时间、来源、置信度分别保存在并行数组中，可以用二分查找取出某个时间范围内的端点
+    """
+
+    def __init__(self):
+        self.times = []
+        self.sources = []
+        self.confidences = []
 
-def merge_endpoints(silero_endpoints, volume_endpoints, tolerance=200):
+    def append(self, time, source, confidence=None):
+        """按时间顺序追加端点"""
+        self.times.append(time)
+        self.sources.append(source)
+        self.confidences.append(confidence)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, k):
+        """以字典形式返回第k个端点"""
+        endpoint = {'time': self.times[k], 'source': self.sources[k]}
+        if self.confidences[k] is not None:
+            endpoint['confidence'] = self.confidences[k]
+        return endpoint
+
+    def index_range(self, low, high, exclusive_low, exclusive_high):
+        """
+        返回满足 low <= time <= high 且 exclusive_low < time < exclusive_high 的端点下标范围
+        """
+        first = max(bisect.bisect_left(self.times, low),
+                    bisect.bisect_right(self.times, exclusive_low))
+        last = min(bisect.bisect_right(self.times, high),
+                   bisect.bisect_left(self.times, exclusive_high))
+        return range(first, last)
+
+def merge_endpoints(silero_endpoints, volume_endpoints, tolerance=200, emission_endpoints=()):
     """
-    合并两种方法的端点，优先选择更准确的端点
+    合并各种方法的端点，优先选择更准确的端点
     
     参数:
     - silero_endpoints: Silero VAD的端点列表
     - volume_endpoints: 音量检测的端点列表
     - tolerance: 容忍度（百分秒），在此范围内的端点被认为是同一个
+    - emission_endpoints: 由MMS_FA emission得到的端点列表
     
     返回:
-    - merged_endpoints: 合并后的端点列表，每个端点包含来源信息
+    - merged_endpoints: 合并后的EndpointIndex，每个端点包含来源信息
     """
-    merged_endpoints = []
+    merged_endpoints = EndpointIndex()
     
-    # 将两种端点标记来源并合并
-    all_endpoints = []
-    for ep in silero_endpoints:
-        all_endpoints.append({'time': ep, 'source': 'silero'})
-    for ep in volume_endpoints:
-        all_endpoints.append({'time': ep, 'source': 'volume'})
+    # 将各种端点标记来源并合并
+    all_endpoints = [(ep, 'silero') for ep in silero_endpoints]
+    all_endpoints.extend((ep, 'volume') for ep in volume_endpoints)
+    all_endpoints.extend((ep, 'emission') for ep in emission_endpoints)
     
     # 按时间排序
-    all_endpoints.sort(key=lambda x: x['time'])
+    all_endpoints.sort(key=lambda x: x[0])
     
     i = 0
     while i < len(all_endpoints):
-        current = all_endpoints[i]
-        candidates = [current]
+        current_time = all_endpoints[i][0]
         
         # 收集在容忍范围内的所有端点
         j = i + 1
-        while j < len(all_endpoints) and all_endpoints[j]['time'] - current['time'] <= tolerance:
-            candidates.append(all_endpoints[j])
+        while j < len(all_endpoints) and all_endpoints[j][0] - current_time <= tolerance:
             j += 1
         
         # 选择最佳端点
-        best_endpoint = choose_best_endpoint(candidates)
-        merged_endpoints.append(best_endpoint)
+        merged_endpoints.append(*choose_best_endpoint(all_endpoints[i:j]))
         
         i = j
     
     return merged_endpoints
 
+# 端点来源按可靠程度排序：Silero与emission都基于语音特征，音量检测只看能量
+ENDPOINT_SOURCE_PRIORITY = ('silero', 'emission', 'volume')
+
 def choose_best_endpoint(candidates):
     """
-    从候选端点中选择最佳的端点
+    从候选端点 (time, source) 中选择最佳的端点，返回 (time, source, confidence)
     
     优先级规则:
     1. 如果只有一种来源，直接使用
-    2. 如果两种来源都有，优先使用Silero（语音特征更准确）
+    2. 如果有多种来源，使用最可靠的来源（Silero > emission > 音量）
     3. 如果有多个同类型端点，选择时间居中的
     """
     if len(candidates) == 1:
-        return candidates[0]
+        return candidates[0][0], candidates[0][1], None
     
     # 分组
-    silero_candidates = [c for c in candidates if c['source'] == 'silero']
-    volume_candidates = [c for c in candidates if c['source'] == 'volume']
+    times_by_source = {source: [t for t, s in candidates if s == source]
+                       for source in ENDPOINT_SOURCE_PRIORITY}
+    present = [source for source in ENDPOINT_SOURCE_PRIORITY if times_by_source[source]]
+    best_source = present[0]
+    best_times = times_by_source[best_source]
     
-    # 如果两种来源都有，优先选择Silero
-    if silero_candidates and volume_candidates:
-        # 选择Silero中时间最接近volume平均值的
-        volume_avg = sum(c['time'] for c in volume_candidates) / len(volume_candidates)
-        best_silero = min(silero_candidates, key=lambda x: abs(x['time'] - volume_avg))
-        best_silero['confidence'] = 'high'  # 两种方法都检测到，置信度高
-        return best_silero
+    # 如果有多种来源，选择最可靠来源中时间最接近其他来源平均值的
+    if len(present) > 1:
+        other_times = [t for source in present[1:] for t in times_by_source[source]]
+        other_avg = sum(other_times) / len(other_times)
+        best_time = min(best_times, key=lambda t: abs(t - other_avg))
+        return best_time, best_source, 'high'  # 多种方法都检测到，置信度高
     
     # 只有一种来源
-    if silero_candidates:
-        best = silero_candidates[len(silero_candidates)//2]  # 选择中位数
-        best['confidence'] = 'medium'
-        return best
-    else:
-        best = volume_candidates[len(volume_candidates)//2]  # 选择中位数
-        best['confidence'] = 'medium'
-        return best
+    return best_times[len(best_times)//2], best_source, 'medium'  # 选择中位数
 
-def adjust_ends_with_hybrid(result_list, audio_file, min_gap_seconds=0.3, volume_threshold=-40, tolerance=200):
+def adjust_ends_with_hybrid(result_list, audio, min_gap_seconds=0.3, volume_threshold=-40, tolerance=200,
+                            emission=None, sources=('silero', 'volume'), frame_offset=0):
     """
-    使用混合方法（Silero VAD + 音量检测）调整result_list中的end时间
+    使用混合方法（Silero VAD + 音量检测 + emission）调整result_list中的end时间
     优化了端点匹配逻辑，提高了尾音处理的准确性
+    audio 可以是音频路径或AudioData，各种检测共用同一份解码结果
+    sources 选择使用的端点来源；'emission' 复用对齐时已有的emission，不需要Silero时完全不加载Silero
     """
     try:
-        print("开始获取Silero VAD端点...")
-        silero_endpoints = get_silero_endpoints(audio_file, min_gap_seconds)
-        print(f"Silero VAD检测到 {len(silero_endpoints)} 个端点")
-        
-        print("开始获取音量检测端点...")
-        volume_endpoints = get_volume_endpoints(audio_file, min_gap_seconds, volume_threshold)
-        print(f"音量检测到 {len(volume_endpoints)} 个端点")
-        
-        if not silero_endpoints and not volume_endpoints:
-            print("两种方法都未检测到端点，不进行调整")
-            return
-        
-        # 合并端点
-        merged_endpoints = merge_endpoints(silero_endpoints, volume_endpoints, tolerance)
-        print(f"合并后共 {len(merged_endpoints)} 个端点")
-        
-        # 应用智能端点匹配
-        apply_smart_endpoint_matching(result_list, merged_endpoints)
-        
+        audio = load_audio(audio)
+        endpoints = {source: [] for source in ENDPOINT_SOURCE_PRIORITY}
+        for source in ('silero', 'volume', 'emission'):
+            if source in sources:
+                endpoints[source] = collect_endpoints(source, audio, emission, min_gap_seconds,
+                                                      volume_threshold, frame_offset)
+        apply_endpoints(result_list, endpoints['silero'], endpoints['volume'],
+                        endpoints['emission'], tolerance)
     except Exception as e:
-        print(f"端点调整过程中出现错误: {e}")
-        print("跳过端点调整，继续处理...")
+        logger.error(f"端点调整过程中出现错误: {e}")
+        logger.error("跳过端点调整，继续处理...")
+
+def collect_endpoints(source, audio=None, emission=None, min_gap_seconds=0.3, volume_threshold=-40,
+                      frame_offset=0):
+    """获取一种来源（silero / volume / emission）的端点时间（百分秒格式）"""
+    if source == 'silero':
+        logger.info("开始获取Silero VAD端点...")
+        with instrument.stage('silero_vad'):
+            endpoints = get_silero_endpoints(audio, min_gap_seconds)
+        logger.info(f"Silero VAD检测到 {len(endpoints)} 个端点")
+    elif source == 'volume':
+        logger.info("开始获取音量检测端点...")
+        with instrument.stage('volume_endpoints'):
+            endpoints = get_volume_endpoints(audio, min_gap_seconds, volume_threshold)
+        logger.info(f"音量检测到 {len(endpoints)} 个端点")
+    elif source == 'emission':
+        if emission is None:
+            logger.warning("没有可用的emission，跳过emission端点")
+            return []
+        with instrument.stage('emission_endpoints'):
+            endpoints = get_emission_endpoints(emission, min_gap_seconds, frame_offset)
+        logger.info(f"emission检测到 {len(endpoints)} 个端点")
+    else:
+        raise ValueError(f"未知的端点来源: {source}")
+    return endpoints
+
+def apply_endpoints(result_list, silero_endpoints, volume_endpoints, emission_endpoints=(), tolerance=200):
+    """合并各来源的端点并用智能端点匹配调整result_list中的end时间"""
+    if not silero_endpoints and not volume_endpoints and not emission_endpoints:
+        logger.info("各种方法都未检测到端点，不进行调整")
+        return
+    
+    # 合并端点
+    with instrument.stage('merge_endpoints'):
+        merged_endpoints = merge_endpoints(silero_endpoints, volume_endpoints, tolerance,
+                                           emission_endpoints)
+    logger.info(f"合并后共 {len(merged_endpoints)} 个端点")
+    
+    # 应用智能端点匹配
+    with instrument.stage('apply_smart_endpoint_matching', endpoints=len(merged_endpoints)):
+        apply_smart_endpoint_matching(result_list, merged_endpoints)
 
 def apply_smart_endpoint_matching(result_list, merged_endpoints):
     """
     智能端点匹配算法，改进了原有的简单匹配逻辑
     """
     # 收集所有有end的项目
-    end_items = [(i, parse_time_to_hundredths(item['end'])) 
-                 for i, item in enumerate(result_list) if 'end' in item]
+    end_items = [(i, time_or_zero(item.end)) 
+                 for i, item in enumerate(result_list) if item.end is not None]
     
     if not end_items:
-        print("result_list中没有end项目")
+        logger.info("result_list中没有end项目")
         return
     
-    print(f"开始匹配 {len(end_items)} 个end项目与 {len(merged_endpoints)} 个端点")
+    logger.info(f"开始匹配 {len(end_items)} 个end项目与 {len(merged_endpoints)} 个端点")
     
     # 为每个end项目找到最佳匹配的端点
     for i, (item_index, current_end) in enumerate(end_items):
@@ -266,14 +1237,18 @@ def apply_smart_endpoint_matching(result_list, merged_endpoints):
             new_end_time = best_endpoint['time']
             # 只有当新端点明显更好时才调整
             if should_adjust_endpoint(current_end, new_end_time, best_endpoint):
-                result_list[item_index]['end'] = format_hundredths_to_time_str(new_end_time)
-                print(f"调整end: {format_hundredths_to_time_str(current_end)} -> "
-                      f"{format_hundredths_to_time_str(new_end_time)} "
-                      f"(来源: {best_endpoint['source']}, 置信度: {best_endpoint.get('confidence', 'medium')})")
+                result_list[item_index].end = new_end_time
+                logger.debug(f"调整end: {format_token_time(current_end)} -> "
+                             f"{format_token_time(new_end_time)} "
+                             f"(来源: {best_endpoint['source']}, 置信度: {best_endpoint.get('confidence', 'medium')})")
+
+# 端点匹配时各来源的权重
+ENDPOINT_SOURCE_SCORES = {'silero': 1.0, 'emission': 0.9, 'volume': 0.8}
 
 def find_best_endpoint_match(current_end, merged_endpoints, end_items, current_index):
     """
     为当前end时间找到最佳匹配的端点
+    merged_endpoints为EndpointIndex，只检查二分查找得到的范围内的端点
     """
     # 定义搜索范围
     search_range = 500  # 5秒范围内搜索
@@ -282,26 +1257,28 @@ def find_best_endpoint_match(current_end, merged_endpoints, end_items, current_i
     prev_end = end_items[current_index - 1][1] if current_index > 0 else 0
     next_end = end_items[current_index + 1][1] if current_index < len(end_items) - 1 else float('inf')
     
-    # 在合理范围内寻找候选端点
-    candidates = []
-    for endpoint in merged_endpoints:
-        ep_time = endpoint['time']
+    # 端点必须在当前时间附近，且不能超出相邻项目的范围
+    candidate_range = merged_endpoints.index_range(
+        current_end - search_range, current_end + search_range, prev_end, next_end
+    )
+    
+    # 在候选中取得分最高的（得分相同时取时间更早的）
+    best_index = None
+    best_score = None
+    for k in candidate_range:
+        ep_time = merged_endpoints.times[k]
+        
+        # 计算匹配分数
+        distance_score = 1.0 - (abs(ep_time - current_end) / search_range)
+        confidence_score = 1.0 if merged_endpoints.confidences[k] == 'high' else 0.7
+        source_score = ENDPOINT_SOURCE_SCORES[merged_endpoints.sources[k]]
         
-        # 端点必须在当前时间附近，且不能超出相邻项目的范围
-        if (abs(ep_time - current_end) <= search_range and 
-            prev_end < ep_time < next_end):
-            
-            # 计算匹配分数
-            distance_score = 1.0 - (abs(ep_time - current_end) / search_range)
-            confidence_score = 1.0 if endpoint.get('confidence') == 'high' else 0.7
-            source_score = 1.0 if endpoint['source'] == 'silero' else 0.8
-            
-            total_score = distance_score * confidence_score * source_score
-            candidates.append((endpoint, total_score))
-    
-    # 返回得分最高的候选
-    if candidates:
-        return max(candidates, key=lambda x: x[1])[0]
+        total_score = distance_score * confidence_score * source_score
+        if best_score is None or total_score > best_score:
+            best_index, best_score = k, total_score
+    
+    if best_index is not None:
+        return merged_endpoints[best_index]
     return None
 
 def should_adjust_endpoint(current_end, new_end, endpoint_info):
@@ -321,7 +1298,7 @@ def should_adjust_endpoint(current_end, new_end, endpoint_info):
     # 如果新端点明显更晚（处理尾音延长），且来源可靠
     if (new_end > current_end and 
         time_diff < 200 and  # 2秒内
-        endpoint_info['source'] == 'silero'):
+        endpoint_info['source'] in ('silero', 'emission')):
         return True
     
     return False
\ No newline at end of file
@@ -0,0 +1,454 @@
+import argparse
+import json
+import logging
+import os
+import time
+import align
+import instrument
+import main as pipeline
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.m4a')
+
+def find_song_audio(song_dir):
+    """在歌曲目录中查找 i.<音频扩展名>"""
+    for ext in AUDIO_EXTENSIONS:
+        path = os.path.join(song_dir, 'i' + ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def collect_jobs_from_directory(root_dir, output_root=None):
+    """
+    扫描目录，每个包含 i.txt 和 i.mp3 的子目录视为一首歌曲
+    输出默认写回歌曲目录，指定 output_root 时写到 output_root/<歌曲名>
+    """
+    jobs = []
+    for name in sorted(os.listdir(root_dir)):
+        song_dir = os.path.join(root_dir, name)
+        text_path = os.path.join(song_dir, 'i.txt')
+        if not os.path.isdir(song_dir) or not os.path.isfile(text_path):
+            continue
+        audio_path = find_song_audio(song_dir)
+        if audio_path is None:
+            logger.warning(f"警告: {song_dir} 中没有找到音频文件，跳过")
+            continue
+        output_dir = os.path.join(output_root, name) if output_root else song_dir
+        jobs.append({'name': name, 'input_text': text_path,
+                     'input_audio': audio_path, 'output_dir': output_dir})
+    return jobs
+
+def collect_jobs_from_manifest(manifest_path, output_root=None):
+    """
+    读取清单文件，每行格式为: 歌词路径<TAB>音频路径[<TAB>输出目录]
+    相对路径以清单文件所在目录为基准，#开头的行为注释
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        for line_no, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) < 2:
+                logger.warning(f"警告: 清单第 {line_no} 行格式错误，跳过: {line}")
+                continue
+            text_path = os.path.join(base_dir, fields[0])
+            audio_path = os.path.join(base_dir, fields[1])
+            name = os.path.basename(os.path.dirname(os.path.abspath(text_path))) or f"song{line_no}"
+            if len(fields) > 2 and fields[2]:
+                output_dir = os.path.join(base_dir, fields[2])
+            elif output_root:
+                output_dir = os.path.join(output_root, f"{line_no:04d}_{name}")
+            else:
+                output_dir = os.path.dirname(text_path)
+            jobs.append({'name': name, 'input_text': text_path,
+                         'input_audio': audio_path, 'output_dir': output_dir})
+    return jobs
+
+def collect_jobs(source, output_root=None):
+    """根据输入类型（目录或清单文件）收集任务"""
+    if os.path.isdir(source):
+        return collect_jobs_from_directory(source, output_root)
+    return collect_jobs_from_manifest(source, output_root)
+
+# 内存估算系数（粗略值）：每个worker常驻的模型内存，以及每首歌曲随音频长度增长的部分
+# wav2vec2的自注意力矩阵随一次前向的帧数平方增长，因此不分块时长歌曲的内存增长很快
+MODEL_RESIDENT_BYTES = 1536 * 1024 * 1024
+LINEAR_BYTES_PER_SECOND = 12 * 1024 * 1024
+ATTENTION_BYTES_PER_SECOND_SQ = 160 * 1024
+
+def estimate_song_memory(duration, chunk_seconds=None, overlap_seconds=1.0):
+    """估算处理一首歌曲需要的额外内存（字节），不含模型本身"""
+    forward_seconds = duration
+    if chunk_seconds:
+        forward_seconds = min(duration, chunk_seconds + 2 * overlap_seconds)
+    return int(LINEAR_BYTES_PER_SECOND * duration
+               + ATTENTION_BYTES_PER_SECOND_SQ * forward_seconds ** 2)
+
+def get_total_memory():
+    """物理内存总量（字节），无法获取时返回None"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def default_memory_budget(workers):
+    """默认的歌曲内存预算：物理内存的80%减去各worker的模型内存"""
+    total = get_total_memory()
+    if total is None:
+        return None
+    budget = int(total * 0.8) - workers * MODEL_RESIDENT_BYTES
+    if budget <= 0:
+        # 预算为0时每次只能提交一首歌曲，多个worker实际上是顺序处理
+        logger.warning(f"警告: {workers} 个worker的模型内存（每个约 {MODEL_RESIDENT_BYTES / 2**20:.0f}MB）"
+                       f"超过物理内存的80%（{total * 0.8 / 2**20:.0f}MB），歌曲将逐首处理；"
+                       f"请减少 --workers 或用 --memory-budget-mb 指定预算")
+    return max(0, budget)
+
+def make_batch_config(base_config=None):
+    config = dict(pipeline.DEFAULT_CONFIG)
+    config['debug_output'] = False
+    if base_config:
+        config.update(base_config)
+    return config
+
+def set_thread_budget(num_threads):
+    """限制本进程torch的线程数，多个worker并行时避免线程数超过CPU核数"""
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+
+def process_job(job, config, token_cache, trace_path=None, audio=None, emission=None,
+                batched_seconds=0.0):
+    """
+    处理一首歌曲，返回统计信息
+    audio/emission为批量推理的结果，batched_seconds为这首歌曲分摊的批量推理时间（计入用时）
+    """
+    song_config = dict(config)
+    song_config.update(input_text=job['input_text'],
+                       input_audio=job['input_audio'],
+                       output_dir=job['output_dir'])
+    os.makedirs(job['output_dir'], exist_ok=True)
+
+    tracer = instrument.Tracer(name=job['name'], pid=os.getpid())
+    if emission is not None:
+        tracer.set(batched_inference_seconds=batched_seconds)
+    song_start = time.perf_counter()
+    try:
+        duration = align.get_audio_duration(job['input_audio'])
+        pipeline.run_pipeline(song_config, token_cache, tracer, audio, emission)
+        ok = True
+    except Exception as e:
+        logger.error(f"处理 {job['name']} 时出现错误: {e}")
+        duration = 0.0
+        ok = False
+    elapsed = time.perf_counter() - song_start + batched_seconds
+
+    if trace_path:
+        tracer.set(ok=ok)
+        # 以追加模式一次写入一整行，多个worker同时写也不会交错
+        with open(trace_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(tracer.to_dict(), ensure_ascii=False) + '\n')
+
+    return {'name': job['name'], 'ok': ok,
+            'elapsed': elapsed, 'audio_duration': duration}
+
+def split_groups(jobs, group_size):
+    """按顺序每group_size首歌曲分为一组，组内的歌曲一起做批量推理"""
+    group_size = max(1, group_size or 1)
+    return [jobs[i:i + group_size] for i in range(0, len(jobs), group_size)]
+
+def compute_group_emissions(jobs, config):
+    """
+    对一组歌曲做批量推理，返回与jobs对应的 (AudioData, emission) 列表
+    已有emission缓存或解码失败的歌曲为None，由流程逐首处理；批量推理失败时全部为None
+    """
+    results = [None] * len(jobs)
+    if len(jobs) < 2 or config['incremental']:
+        return results
+    emission_cache = pipeline.get_emission_cache(config)
+    pcm_cache = pipeline.get_pcm_cache(config)
+    energy_gate = pipeline.get_energy_gate(config)
+    device_type = align.get_device_type()
+
+    songs = []
+    for index, job in enumerate(jobs):
+        try:
+            audio = align.load_audio(job['input_audio'], pcm_cache=pcm_cache)
+            cache_key = None
+            if emission_cache is not None:
+                cache_key = align.emission_cache_key(
+                    audio, device_type, config['emission_chunk_seconds'],
+                    config['emission_overlap_seconds'], config['inference_backend'], energy_gate)
+                if emission_cache.get(cache_key) is not None:
+                    continue
+            audio.samples
+        except Exception as e:
+            logger.warning(f"警告: {job['name']} 无法参与批量推理（{e}），单独处理")
+            continue
+        songs.append((index, audio, cache_key))
+    if len(songs) < 2:
+        return results
+
+    start = time.perf_counter()
+    try:
+        emissions = align.get_emissions_batched(
+            [audio for _, audio, _ in songs],
+            chunk_seconds=config['emission_chunk_seconds'],
+            overlap_seconds=config['emission_overlap_seconds'],
+            backend=config['inference_backend'],
+            energy_gate=energy_gate,
+            max_batch_seconds=config['inference_batch_seconds'])
+    except Exception as e:
+        logger.warning(f"警告: 批量推理失败（{e}），逐首推理")
+        return results
+    logger.info(f"批量推理 {len(songs)} 首歌曲，用时 {time.perf_counter() - start:.1f}s")
+
+    for (index, audio, cache_key), emission in zip(songs, emissions):
+        if cache_key is not None:
+            emission_cache.put(cache_key, emission.cpu().numpy())
+        results[index] = (audio, emission)
+    return results
+
+def process_group(jobs, config, token_cache, trace_path=None):
+    """
+    处理一组歌曲：先一起做批量推理，再逐首运行其余流程
+    批量推理的时间按音频长度分摊到各首歌曲的用时中
+    """
+    start = time.perf_counter()
+    batched = compute_group_emissions(jobs, config)
+    elapsed = time.perf_counter() - start
+    total_samples = sum(len(item[0].samples) for item in batched if item is not None)
+
+    stats = []
+    for job, item in zip(jobs, batched):
+        if item is None:
+            stats.append(process_job(job, config, token_cache, trace_path))
+            continue
+        audio, emission = item
+        share = elapsed * len(audio.samples) / total_samples if total_samples else 0.0
+        stats.append(process_job(job, config, token_cache, trace_path, audio, emission, share))
+    return stats
+
+def log_song(index, total, stat):
+    duration = stat['audio_duration']
+    rtf = stat['elapsed'] / duration if duration else 0.0
+    logger.info(f"[{index}/{total}] {stat['name']}: 用时 {stat['elapsed']:.1f}s, "
+                f"音频 {duration:.1f}s, RTF {rtf:.3f}")
+
+def run_batch(jobs, base_config=None, trace_path=None, workers=1,
+              threads_per_worker=None, memory_budget=None, worker_setup=None):
+    """
+    处理所有歌曲，模型在每个进程中只加载一次
+    workers大于1时把歌曲分配到多个worker进程，memory_budget（字节）限制同时处理的歌曲的估算内存
+    指定trace_path时每首歌曲的trace以一行JSON追加到该文件
+    返回每首歌曲的统计信息列表（与jobs顺序相同）
+    """
+    config = make_batch_config(base_config)
+    batch_start = time.perf_counter()
+    if workers > 1:
+        stats = run_batch_parallel(jobs, config, trace_path, workers,
+                                   threads_per_worker, memory_budget, worker_setup)
+    else:
+        stats = run_batch_serial(jobs, config, trace_path, threads_per_worker, worker_setup)
+    report_throughput(stats, time.perf_counter() - batch_start)
+    return stats
+
+def run_batch_serial(jobs, config, trace_path=None, threads_per_worker=None, worker_setup=None):
+    """在当前进程中依次处理所有歌曲"""
+    if worker_setup:
+        worker_setup()
+    set_thread_budget(threads_per_worker)
+    logger.info("预加载模型...")
+    load_start = time.perf_counter()
+    align.preload_models(
+        enable_vad=config['enable_vad_adjustment'] and 'silero' in config['endpoint_sources'],
+        backend=config['inference_backend'])
+    logger.info(f"模型加载完成，用时 {time.perf_counter() - load_start:.1f}s")
+
+    # 整个批次共用一个分词缓存，不同歌曲中相同的歌词行只分词一次
+    token_cache = pipeline.get_token_cache(config)
+
+    stats = []
+    for group in split_groups(jobs, config['inference_batch_songs']):
+        for stat in process_group(group, config, token_cache, trace_path):
+            stats.append(stat)
+            log_song(len(stats), len(jobs), stat)
+    return stats
+
+# worker进程内的状态，由init_worker设置
+_worker_config = None
+_worker_token_cache = None
+_worker_trace_path = None
+
+def init_worker(config, trace_path, num_threads, worker_setup=None):
+    """worker进程初始化：设置线程预算并预加载模型，之后该进程处理的歌曲都复用这些模型"""
+    global _worker_config, _worker_token_cache, _worker_trace_path
+    if worker_setup:
+        worker_setup()
+    pipeline.configure_logging(config['log_level'])
+    set_thread_budget(num_threads)
+    align.preload_models(
+        enable_vad=config['enable_vad_adjustment'] and 'silero' in config['endpoint_sources'],
+        backend=config['inference_backend'])
+    _worker_config = config
+    _worker_trace_path = trace_path
+    # 每个worker有自己的内存缓存；sqlite缓存文件可以被多个进程共享
+    _worker_token_cache = pipeline.get_token_cache(config)
+
+def run_worker_group(jobs):
+    return process_group(jobs, _worker_config, _worker_token_cache, _worker_trace_path)
+
+def run_batch_parallel(jobs, config, trace_path, workers, threads_per_worker=None,
+                       memory_budget=None, worker_setup=None):
+    """
+    用进程池并行处理歌曲
+    每首歌曲按音频时长估算内存，正在处理的歌曲的估算总和不超过memory_budget；
+    队列中第一组放不下时先提交后面放得下的组，没有歌曲在处理时总是允许提交一组（即使超出预算）
+    """
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    if memory_budget is None:
+        memory_budget = default_memory_budget(workers)
+    logger.info(f"启动 {workers} 个worker，每个worker {threads_per_worker} 个线程"
+                + (f"，内存预算 {memory_budget / 2**20:.0f}MB" if memory_budget is not None else ""))
+
+    # 每组歌曲（inference_batch_songs首，默认1首）作为一个任务提交，组内一起做批量推理
+    pending = []
+    index = 0
+    for group in split_groups(jobs, config['inference_batch_songs']):
+        need = 0
+        for job in group:
+            try:
+                duration = align.get_audio_duration(job['input_audio'])
+            except Exception:
+                duration = 0.0
+            need += estimate_song_memory(
+                duration, config['emission_chunk_seconds'], config['emission_overlap_seconds'])
+        pending.append((index, group, need))
+        index += len(group)
+
+    stats = [None] * len(jobs)
+    running = {}
+    used = 0
+    finished = 0
+    # torch在fork后的子进程中可能死锁，使用spawn启动worker
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                             initargs=(config, trace_path, threads_per_worker, worker_setup)) as pool:
+        while pending or running:
+            while pending and len(running) < workers:
+                choice = next((i for i, (_, _, need) in enumerate(pending)
+                               if memory_budget is None or used + need <= memory_budget), None)
+                if choice is None and not running:
+                    choice = 0
+                if choice is None:
+                    break
+                index, group, need = pending.pop(choice)
+                running[pool.submit(run_worker_group, group)] = (index, group, need)
+                used += need
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, group, need = running.pop(future)
+                used -= need
+                try:
+                    group_stats = future.result()
+                except Exception as e:
+                    logger.error(f"处理 {', '.join(job['name'] for job in group)} 时worker出现错误: {e}")
+                    group_stats = [{'name': job['name'], 'ok': False,
+                                    'elapsed': 0.0, 'audio_duration': 0.0} for job in group]
+                for offset, stat in enumerate(group_stats):
+                    stats[index + offset] = stat
+                    finished += 1
+                    log_song(finished, len(jobs), stat)
+    return stats
+
+def report_throughput(stats, total_elapsed):
+    """输出批次的总体吞吐量"""
+    succeeded = [s for s in stats if s['ok']]
+    total_audio = sum(s['audio_duration'] for s in succeeded)
+    logger.info(f"\n批量处理完成: 成功 {len(succeeded)}/{len(stats)} 首, 总用时 {total_elapsed:.1f}s")
+    if total_elapsed > 0 and succeeded:
+        logger.info(f"吞吐量: {len(succeeded) / total_elapsed * 60:.1f} 首/分钟, "
+                    f"{total_audio / total_elapsed:.1f} 秒音频/秒, "
+                    f"RTF {total_elapsed / total_audio if total_audio else 0.0:.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='批量生成歌词时间轴')
+    parser.add_argument('source', help='歌曲目录（每个子目录含 i.txt 与 i.mp3）或清单文件')
+    parser.add_argument('-o', '--output-root', help='输出根目录，默认写回各歌曲目录')
+    parser.add_argument('--no-vad', action='store_true', help='关闭VAD端点调整')
+    parser.add_argument('--endpoint-sources', nargs='+', choices=align.ENDPOINT_SOURCE_PRIORITY,
+                        default=['silero', 'volume'],
+                        help='端点调整使用的端点来源，只用 emission volume 时不需要Silero VAD')
+    parser.add_argument('--no-score-correction', action='store_true', help='关闭置信度微调')
+    parser.add_argument('--emission-cache', help='emission缓存目录，修改歌词后重跑时跳过声学模型')
+    parser.add_argument('--pcm-cache', help='解码后PCM的缓存目录，重复运行时跳过MP3解码与重采样')
+    parser.add_argument('--token-cache', help='分词缓存的sqlite文件，跨批次复用相同歌词行的分词结果')
+    parser.add_argument('--incremental', action='store_true',
+                        help='根据上一次运行保存的状态只重新对齐修改过的歌词行')
+    parser.add_argument('--backend', choices=align.INFERENCE_BACKENDS, default='eager',
+                        help='声学模型的推理后端：eager（fp32）、torchscript（冻结图）、int8（动态量化）')
+    parser.add_argument('--energy-gate', action='store_true',
+                        help='只对有声段运行声学模型，跳过前奏、间奏和尾奏中持续的静音')
+    parser.add_argument('--alignment-mode', choices=align.ALIGNMENT_MODES, default='full',
+                        help='CTC对齐方式：full（整首一次对齐）、banded（沿粗路径分窗）、'
+                             'segmented（在行间静音处切分后并行对齐）；长歌曲或串烧可大幅减少对齐时间与内存')
+    parser.add_argument('--alignment-window', type=int, default=400,
+                        help='分窗/分段对齐时每个窗口或区域的字符数')
+    parser.add_argument('--alignment-workers', type=int,
+                        help='分段对齐的线程数，默认为CPU核数')
+    parser.add_argument('--chunk-seconds', type=float, help='分块计算emission的块长（秒），长歌曲可限制内存峰值')
+    parser.add_argument('--inference-batch', type=int, default=1,
+                        help='每N首歌曲一起做声学模型的批量推理（音频块补零拼成mini-batch），1为逐首推理；'
+                             '配合--chunk-seconds可减少补零')
+    parser.add_argument('--inference-batch-seconds', type=float, default=120,
+                        help='批量推理时每个mini-batch补零后的音频总长（秒），限制一次前向的内存')
+    parser.add_argument('--trace', help='每首歌曲的分阶段耗时与内存以JSON Lines追加到此文件')
+    parser.add_argument('--log-level', default='INFO', help='日志级别（DEBUG/INFO/WARNING）')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理歌曲的worker进程数')
+    parser.add_argument('--threads-per-worker', type=int,
+                        help='每个worker的torch线程数，默认为CPU核数除以worker数')
+    parser.add_argument('--stage-workers', type=int, default=4,
+                        help='每首歌曲内并行运行文本、声学模型与端点检测等阶段的线程数，1为顺序执行')
+    parser.add_argument('--memory-budget-mb', type=float,
+                        help='同时处理的歌曲的估算内存上限（MB），默认为物理内存的80%%减去模型内存')
+    args = parser.parse_args()
+    pipeline.configure_logging(args.log_level)
+
+    jobs = collect_jobs(args.source, args.output_root)
+    if not jobs:
+        logger.warning("没有找到需要处理的歌曲")
+        return
+
+    run_batch(jobs, {
+        'enable_vad_adjustment': not args.no_vad,
+        'enable_score_correction': not args.no_score_correction,
+        'endpoint_sources': args.endpoint_sources,
+        'emission_chunk_seconds': args.chunk_seconds,
+        'inference_backend': args.backend,
+        'inference_batch_songs': args.inference_batch,
+        'inference_batch_seconds': args.inference_batch_seconds,
+        'energy_gate': args.energy_gate,
+        'alignment_mode': args.alignment_mode,
+        'alignment_window_tokens': args.alignment_window,
+        'alignment_workers': args.alignment_workers,
+        'emission_cache_dir': args.emission_cache,
+        'pcm_cache_dir': args.pcm_cache,
+        'token_cache_path': args.token_cache,
+        'incremental': args.incremental,
+        'stage_workers': args.stage_workers,
+        'log_level': args.log_level,
+    }, trace_path=args.trace, workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        memory_budget=args.memory_budget_mb * 2**20 if args.memory_budget_mb else None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+声学模型推理后端的速度与精度对比
+
+用法:
+    python benchmarks/bench_backends.py --songs 4 --seconds 120
+    python benchmarks/bench_backends.py --corpus songs/ --tolerance-ms 20
+
+对每首歌曲分别用各个后端计算emission并做CTC对齐，以eager（fp32）的结果为基准，
+报告声学模型耗时与每个token开始/结束时间的偏差，并给出偏差在容差内的最快后端。
+指定--corpus时使用真实的MMS_FA模型处理目录中的歌曲（格式同batch.py），否则使用合成数据与替身模型
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import synthetic
+import align
+import batch
+import main as pipeline
+from utils import ERROR_TIME
+
+def time_emission(audio, backend, repeat):
+    """返回 (emission, 最短耗时)；第一次调用用于预热（TorchScript优化在前几次运行时进行）"""
+    emission = align.get_emission(audio, backend=backend)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        emission = align.get_emission(audio, backend=backend)
+        best = min(best, time.perf_counter() - start)
+    return emission, best
+
+def compare_results(reference, results):
+    """返回 (开始时间偏差列表, 结束时间偏差列表, 只有一方对齐失败的token数)，单位为毫秒"""
+    start_deltas, end_deltas, failed = [], [], 0
+    for ref, res in zip(reference, results):
+        if (ref['start'] == ERROR_TIME) != (res['start'] == ERROR_TIME):
+            failed += 1
+        elif ref['start'] != ERROR_TIME:
+            start_deltas.append(abs(res['start'] - ref['start']) * 10)
+            end_deltas.append(abs(res['end'] - ref['end']) * 10)
+    return start_deltas, end_deltas, failed
+
+def run_song(job, backends, repeat):
+    result_list = pipeline.process_input_text(job['input_text'])
+    alignment_tokens, _ = pipeline.prepare_alignment_tokens(result_list)
+    audio = align.load_audio(job['input_audio'])
+    song = {'name': job['name'], 'duration': audio.duration, 'tokens': len(alignment_tokens),
+            'backends': {}}
+    reference = None
+    for backend in backends:
+        emission, seconds = time_emission(audio, backend, repeat)
+        results = align.align_emission(emission, alignment_tokens)
+        if reference is None:
+            reference = results
+        start_deltas, end_deltas, failed = compare_results(reference, results)
+        song['backends'][backend] = {'seconds': seconds, 'start_deltas': start_deltas,
+                                     'end_deltas': end_deltas, 'failed': failed}
+    return song
+
+def summarize(songs, backends, tolerance_ms):
+    """汇总所有歌曲，返回每个后端的统计"""
+    summary = {}
+    for backend in backends:
+        seconds = sum(song['backends'][backend]['seconds'] for song in songs)
+        starts = np.array([d for song in songs for d in song['backends'][backend]['start_deltas']])
+        ends = np.array([d for song in songs for d in song['backends'][backend]['end_deltas']])
+        deltas = np.concatenate([starts, ends]) if len(starts) else np.zeros(1)
+        summary[backend] = {
+            'seconds': seconds,
+            'mean_start_ms': float(starts.mean()) if len(starts) else 0.0,
+            'mean_end_ms': float(ends.mean()) if len(ends) else 0.0,
+            'p95_ms': float(np.percentile(deltas, 95)),
+            'max_ms': float(deltas.max()),
+            'within_tolerance': float((deltas <= tolerance_ms).mean()),
+            'failed': sum(song['backends'][backend]['failed'] for song in songs),
+        }
+    return summary
+
+def print_summary(summary, tolerance_ms):
+    base = summary['eager']['seconds']
+    print(f"\n{'后端':<12}{'模型耗时':>10}{'加速比':>8}{'平均Δ开始':>10}{'平均Δ结束':>10}"
+          f"{'P95':>8}{'最大':>8}{'容差内':>8}{'失败':>6}")
+    for backend, s in summary.items():
+        print(f"{backend:<12}{s['seconds']:9.2f}s{base / s['seconds']:7.2f}x"
+              f"{s['mean_start_ms']:9.1f}ms{s['mean_end_ms']:9.1f}ms{s['p95_ms']:6.0f}ms"
+              f"{s['max_ms']:6.0f}ms{s['within_tolerance'] * 100:7.1f}%{s['failed']:6d}")
+    accepted = [b for b, s in summary.items() if s['p95_ms'] <= tolerance_ms and not s['failed']]
+    best = min(accepted, key=lambda b: summary[b]['seconds'])
+    print(f"\nP95偏差不超过 {tolerance_ms:.0f}ms 的最快后端: {best}")
+
+def main():
+    parser = argparse.ArgumentParser(description='推理后端的速度与精度对比')
+    parser.add_argument('--corpus', help='歌曲目录（每个子目录含 i.txt 与音频），使用真实模型')
+    parser.add_argument('--songs', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=120)
+    parser.add_argument('--backends', nargs='+', default=list(align.INFERENCE_BACKENDS))
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--tolerance-ms', type=float, default=20.0)
+    parser.add_argument('--output', help='保存逐首歌曲结果的JSON文件')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    backends = ['eager'] + [b for b in args.backends if b != 'eager']
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.corpus:
+            jobs = batch.collect_jobs(args.corpus)
+        else:
+            synthetic.install_stand_ins()
+            for i in range(args.songs):
+                synthetic.make_song(os.path.join(workdir, f"song{i:03d}"), args.seconds, seed=i)
+            jobs = batch.collect_jobs(workdir)
+        songs = []
+        for job in jobs:
+            songs.append(run_song(job, backends, args.repeat))
+            print(f"{job['name']}: " + ", ".join(
+                f"{b} {songs[-1]['backends'][b]['seconds']:.2f}s" for b in backends))
+
+    summary = summarize(songs, backends, args.tolerance_ms)
+    print_summary(summary, args.tolerance_ms)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'summary': summary, 'songs': songs}, file, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
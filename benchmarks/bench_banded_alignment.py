@@ -0,0 +1,149 @@
+"""
+分窗/分段CTC对齐与整首对齐的对比：耗时、内存峰值与时间偏差
+
+用法:
+    python benchmarks/bench_banded_alignment.py --seconds 180 600 1800 --window-tokens 400
+    python benchmarks/bench_banded_alignment.py --corpus songs/ --window-tokens 200 400 --workers 4
+
+不指定--corpus时用合成歌词生成已知真实路径的合成emission（每个字符占若干帧，行间有停顿，偶尔有长间奏），
+--peak控制正确字符的对数几率优势，越小emission越模糊；指定--corpus时用真实的MMS_FA模型计算emission。
+以整首对齐为基准报告分窗对齐与分段对齐（--workers个线程）每个token开始/结束时间的偏差；
+合成数据还报告各方式相对真实路径的偏差
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import synthetic
+import align
+import batch
+import instrument
+import main as pipeline
+from utils import ERROR_TIME
+
+# 合成emission中blank帧额外的对数几率
+BLANK_BONUS = 4.0
+
+def make_emission(words, line_starts, peak, seed=0):
+    """
+    按真实路径生成 (1, 帧数, 字符数) 的对数概率emission，返回 (emission, 每个词的真实开始帧)
+    行首之前插入停顿，约5%的行首之前是10-30秒的间奏；blank帧的blank概率额外提高
+    """
+    import torch
+    rng = np.random.default_rng(seed)
+    line_starts = set(line_starts)
+    labels = []
+    truth = []
+    for i, word in enumerate(words):
+        if i in line_starts:
+            gap = rng.integers(500, 1500) if rng.random() < 0.05 else rng.integers(20, 120)
+        else:
+            gap = rng.integers(0, 4)
+        labels.extend([0] * gap)
+        truth.append(len(labels))
+        for char in word:
+            labels.extend([char] * rng.integers(1, 6))
+            if rng.random() < 0.3:
+                labels.append(0)
+    labels.extend([0] * 100)
+    num_chars = len(align.load_text_aligner()[0].dictionary)
+    logits = rng.normal(0, 2, (len(labels), num_chars)).astype(np.float32)
+    labels = np.array(labels)
+    logits[np.arange(len(labels)), labels] += peak
+    # 与真实的CTC模型一样，静音帧的blank概率接近1
+    logits[labels == 0, 0] += BLANK_BONUS
+    return torch.log_softmax(torch.from_numpy(logits), -1)[None], truth
+
+def measure(func):
+    """返回 (结果, 耗时, 峰值RSS增量)"""
+    instrument.reset_peak_rss()
+    base = instrument.get_current_rss() or 0
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    return result, elapsed, (instrument.get_peak_rss() or 0) - base
+
+def deviations(reference, results):
+    """每个token开始与结束时间的偏差（毫秒），跳过任一方对齐失败的token"""
+    deltas = [(abs(a['start'] - b['start']) * 10, abs(a['end'] - b['end']) * 10)
+              for a, b in zip(reference, results)
+              if a['start'] != ERROR_TIME and b['start'] != ERROR_TIME]
+    return np.array(deltas, dtype=float).reshape(-1, 2)
+
+def describe(deltas):
+    if not len(deltas):
+        return "无可比较的token"
+    return (f"平均 {deltas.mean():6.1f}ms  P95 {np.percentile(deltas, 95):6.0f}ms  "
+            f"最大 {deltas.max():6.0f}ms  完全一致 {(deltas == 0).all(1).mean() * 100:5.1f}%")
+
+def truth_error(results, truth):
+    """开始时间相对真实路径的平均偏差（毫秒）"""
+    frame_hundredths = align.FRAME_SAMPLES * 100 // align.SAMPLE_RATE
+    return np.mean([abs(r['start'] - t * frame_hundredths) * 10 for r, t in zip(results, truth)])
+
+def run_song(name, emission, tokens, line_starts, window_sizes, workers, truth=None):
+    print(f"{name}: {emission.shape[1]} 帧, {len(tokens)} 个token")
+    full, seconds, memory = measure(lambda: align.align_emission(emission, tokens))
+    line = f"  整首对齐      {seconds:7.2f}s  峰值RSS增量 {memory / 2**20:7.0f} MB"
+    if truth is not None:
+        line += f"  相对真实路径 {truth_error(full, truth):6.1f}ms"
+    print(line)
+    for window_tokens in window_sizes:
+        modes = [
+            ('分窗', lambda: align.align_emission_banded(
+                emission, tokens, line_starts=line_starts, window_tokens=window_tokens)),
+            ('分段', lambda: align.align_emission_segmented(
+                emission, tokens, line_starts=line_starts, region_tokens=window_tokens,
+                max_workers=workers)),
+        ]
+        for label, func in modes:
+            tracer = instrument.Tracer()
+            with instrument.activate(tracer):
+                results, mode_seconds, mode_memory = measure(func)
+            parts = tracer.stages[-1].get('windows') or tracer.stages[-1].get('regions')
+            line = (f"  {label} {window_tokens:<6d}  {mode_seconds:7.2f}s  峰值RSS增量 {mode_memory / 2**20:7.0f} MB"
+                    f"  加速 {seconds / mode_seconds:5.2f}x  {parts} 段")
+            if truth is not None:
+                line += f"  相对真实路径 {truth_error(results, truth):6.1f}ms"
+            print(line)
+            print(f"    相对整首对齐: {describe(deviations(full, results))}")
+
+def main():
+    parser = argparse.ArgumentParser(description='分窗CTC对齐与整首对齐的对比')
+    parser.add_argument('--corpus', help='歌曲目录（每个子目录含 i.txt 与音频），使用真实模型')
+    parser.add_argument('--seconds', type=float, nargs='+', default=[180, 600, 1800])
+    parser.add_argument('--window-tokens', type=int, nargs='+', default=[200, 400])
+    parser.add_argument('--workers', type=int, help='分段对齐的线程数，默认为CPU核数')
+    parser.add_argument('--peak', type=float, default=5.0, help='合成emission中正确字符的对数几率优势')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.corpus:
+            for job in batch.collect_jobs(args.corpus):
+                result_list = pipeline.process_input_text(job['input_text'])
+                tokens, _ = pipeline.prepare_alignment_tokens(result_list)
+                emission = align.get_emission(job['input_audio'])
+                run_song(job['name'], emission, tokens, pipeline.find_line_starts(result_list),
+                         args.window_tokens, args.workers)
+            return
+
+        tokenizer = align.load_text_aligner()[0]
+        for seconds in args.seconds:
+            text, _, _ = synthetic.make_song(os.path.join(workdir, f"song{int(seconds)}"), seconds)
+            result_list = pipeline.process_input_text(text)
+            tokens, _ = pipeline.prepare_alignment_tokens(result_list)
+            line_starts = pipeline.find_line_starts(result_list)
+            emission, truth = make_emission(tokenizer(tokens), line_starts, args.peak)
+            run_song(f"合成 {seconds:.0f}s 歌词", emission, tokens, line_starts, args.window_tokens,
+                     args.workers, truth)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+音频解码的内存峰值：整段加载 vs 按块流式解码（离线，使用合成的高采样率多声道WAV）
+
+用法: python benchmarks/bench_decode.py --minutes 10 --sample-rate 48000 --channels 2
+
+每种方式在单独的子进程中解码同一个文件，报告耗时与解码期间增加的峰值RSS，
+并确认两种方式的输出长度相同、采样值只有浮点舍入级别的差异；
+另外确认文件头少报帧数时（VBR MP3的帧数按码率估算）流式解码仍读到文件末尾，结果与整段加载一致
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+METHODS = ('decode_audio_full', 'decode_audio')
+
+def write_stem(path, minutes, sample_rate, channels):
+    """分段写出一个float32 WAV，避免生成文件本身占用大量内存"""
+    import numpy as np
+    import soundfile
+    rng = np.random.default_rng(0)
+    block = sample_rate * 10
+    with soundfile.SoundFile(path, 'w', sample_rate, channels, subtype='FLOAT') as file:
+        for start in range(0, int(minutes * 60 * sample_rate), block):
+            t = (start + np.arange(block)) / sample_rate
+            tone = 0.3 * np.sin(2 * np.pi * 220 * t)[:, None]
+            file.write((tone + 0.05 * rng.standard_normal((block, channels))).astype(np.float32))
+
+def measure(method, path, output):
+    """在子进程中运行：解码并把结果保存到output，打印耗时与峰值RSS增量"""
+    import numpy as np
+    import align
+    import instrument
+    # 预先导入，使导入开销不计入峰值
+    import torchaudio  # noqa: F401
+    import soundfile  # noqa: F401
+    instrument.reset_peak_rss()
+    base = instrument.get_current_rss()
+    start = time.perf_counter()
+    samples = getattr(align, method)(path)
+    elapsed = time.perf_counter() - start
+    peak = instrument.get_peak_rss()
+    np.save(output, samples)
+    print(json.dumps({'seconds': elapsed, 'peak_delta': peak - base, 'output_bytes': samples.nbytes}))
+
+def check_short_header(path, ratio=0.6):
+    """
+    让torchaudio.info只报告ratio比例的帧数（模拟VBR MP3按码率估算的文件头），
+    返回 (流式解码长度, 整段加载长度, 最大差异)
+    """
+    import numpy as np
+    import torchaudio
+    import align
+    real_info = torchaudio.info
+
+    def short_info(*args, **kwargs):
+        info = real_info(*args, **kwargs)
+        info.num_frames = int(info.num_frames * ratio)
+        return info
+
+    torchaudio.info = short_info
+    try:
+        streamed = align.decode_audio(path)
+    finally:
+        torchaudio.info = real_info
+    full = align.decode_audio_full(path)
+    diff = float(np.abs(full - streamed).max()) if full.shape == streamed.shape else float('nan')
+    return len(streamed), len(full), diff
+
+def main():
+    parser = argparse.ArgumentParser(description='音频解码的内存峰值对比')
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--sample-rate', type=int, default=48000)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--measure', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    import numpy as np
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'stem.wav')
+        write_stem(path, args.minutes, args.sample_rate, args.channels)
+        print(f"{args.minutes:.0f}分钟 {args.sample_rate}Hz {args.channels}声道 float32 WAV: "
+              f"{os.path.getsize(path) / 2**20:.0f} MB")
+        outputs = []
+        for method in METHODS:
+            output = os.path.join(workdir, f"{method}.npy")
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure',
+                                     method, path, output],
+                                    capture_output=True, text=True, check=True)
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            outputs.append(np.load(output))
+            print(f"  {method:<20}{stats['seconds']:7.2f}s  峰值RSS增量 {stats['peak_delta'] / 2**20:7.0f} MB"
+                  f"  （输出 {stats['output_bytes'] / 2**20:.0f} MB）")
+        full, streamed = outputs
+        same_length = full.shape == streamed.shape
+        print(f"  长度一致: {same_length}, 最大差异: "
+              f"{float(np.abs(full - streamed).max()) if same_length else float('nan'):.2e}")
+        if not same_length:
+            sys.exit(1)
+
+        short_path = os.path.join(workdir, 'short_header.wav')
+        write_stem(short_path, 1, args.sample_rate, args.channels)
+        streamed, full, diff = check_short_header(short_path)
+        print(f"  文件头少报40%帧数: 流式解码 {streamed} 个采样点, 整段加载 {full} 个, 最大差异 {diff:.2e}")
+        if streamed != full:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
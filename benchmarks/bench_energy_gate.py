@@ -0,0 +1,116 @@
+"""
+能量门的效果：只对有声段运行声学模型时的耗时与对齐偏差
+
+用法:
+    python benchmarks/bench_energy_gate.py --sung 120 --silent 20 30 20
+    python benchmarks/bench_energy_gate.py --corpus songs/
+
+不指定--corpus时生成一首带静音前奏、间奏和尾奏的合成歌曲（使用替身模型），
+--sung为演唱部分的总长，--silent依次为各段静音的长度（前奏、间奏……尾奏）；
+报告完整推理与能量门推理的声学模型耗时、实际推理的帧比例，以及两者CTC对齐结果的偏差；
+同时检查静音帧的填充以blank为主，且能量门的对齐结果没有字符落在被跳过的静音中（否则以非零状态退出）
+
+替身模型不做MMS_FA封装中的输入归一化，输出也不区分字符，因此合成数据上的对齐偏差不代表真实模型；
+静音帧的填充是直接构造的，与模型无关。真实模型的偏差用--corpus测量
+"""
+import argparse
+import bisect
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import synthetic
+import align
+import batch
+import main as pipeline
+from bench_banded_alignment import describe, deviations
+from utils import ERROR_TIME
+
+def make_gapped_song(directory, sung_seconds, silent_seconds, seed=0):
+    """演唱部分平均分成len(silent_seconds)-1段，与静音段交替；返回 (歌词路径, 音频路径)"""
+    text, audio, _ = synthetic.make_song(directory, sung_seconds, seed=seed)
+    vocal = synthetic.make_vocal(sung_seconds, intro_seconds=0.0, seed=seed)
+    pieces = np.array_split(vocal, max(1, len(silent_seconds) - 1))
+    rng = np.random.default_rng(seed)
+    parts = []
+    for i, seconds in enumerate(silent_seconds):
+        silence = int(seconds * align.SAMPLE_RATE)
+        parts.append(rng.normal(0, 1e-4, silence).astype(np.float32))
+        if i < len(pieces):
+            parts.append(pieces[i])
+    synthetic.write_wav(audio, np.concatenate(parts))
+    return text, audio
+
+def count_tokens_in_skipped(results, spans):
+    """开始时间落在能量门跳过的帧（spans之外）中的token数"""
+    frame_hundredths = align.FRAME_SAMPLES * 100 // align.SAMPLE_RATE
+    starts = [first for first, _ in spans]
+    count = 0
+    for result in results:
+        if result['start'] == ERROR_TIME:
+            continue
+        frame = result['start'] // frame_hundredths
+        i = bisect.bisect_right(starts, frame) - 1
+        if i < 0 or frame >= spans[i][1]:
+            count += 1
+    return count
+
+def run_song(name, text, audio_path, gate):
+    """返回能量门的对齐结果中落在被跳过的静音里的token数"""
+
+    result_list = pipeline.process_input_text(text)
+    tokens, _ = pipeline.prepare_alignment_tokens(result_list)
+    audio = align.load_audio(audio_path)
+    audio.samples
+    outputs = {}
+    for label, energy_gate in (('完整', None), ('能量门', gate)):
+        start = time.perf_counter()
+        emission = align.get_emission(audio, energy_gate=energy_gate)
+        seconds = time.perf_counter() - start
+        voiced = emission.shape[1]
+        if energy_gate:
+            voiced = sum(last - first for first, last in align.find_voiced_spans(audio, *energy_gate))
+        outputs[label] = (seconds, voiced / emission.shape[1], align.align_emission(emission, tokens))
+    print(f"{name}: {audio.duration:.0f}s 音频, {len(tokens)} 个token")
+    for label, (seconds, ratio, _) in outputs.items():
+        print(f"  {label:<6}声学模型 {seconds:6.2f}s  推理帧比例 {ratio * 100:5.1f}%")
+    print(f"  加速 {outputs['完整'][0] / outputs['能量门'][0]:.2f}x, 对齐偏差: "
+          f"{describe(deviations(outputs['完整'][2], outputs['能量门'][2]))}")
+    skipped = count_tokens_in_skipped(outputs['能量门'][2], align.find_voiced_spans(audio, *gate))
+    print(f"  能量门对齐中落在被跳过静音里的token: {skipped}")
+    return skipped
+
+def main():
+    parser = argparse.ArgumentParser(description='能量门的耗时与对齐偏差')
+    parser.add_argument('--corpus', help='歌曲目录（每个子目录含 i.txt 与音频），使用真实模型')
+    parser.add_argument('--sung', type=float, default=120)
+    parser.add_argument('--silent', type=float, nargs='+', default=[20, 30, 20])
+    parser.add_argument('--threshold-db', type=float,
+                        default=pipeline.DEFAULT_CONFIG['energy_gate_threshold_db'])
+    parser.add_argument('--min-silence', type=float,
+                        default=pipeline.DEFAULT_CONFIG['energy_gate_min_silence_seconds'])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    gate = (args.threshold_db, args.min_silence)
+    align.check_silence_row(align.silence_emission())
+
+    if args.corpus:
+        skipped = sum(run_song(job['name'], job['input_text'], job['input_audio'], gate)
+                      for job in batch.collect_jobs(args.corpus))
+        sys.exit(1 if skipped else 0)
+
+    synthetic.install_stand_ins()
+    with tempfile.TemporaryDirectory() as workdir:
+        text, audio = make_gapped_song(workdir, args.sung, args.silent)
+        # 预热：模型加载与静音emission不计入
+        align.get_emission(audio, energy_gate=gate)
+        sys.exit(1 if run_song('合成', text, audio, gate) else 0)
+
+if __name__ == "__main__":
+    main()
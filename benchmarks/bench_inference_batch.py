@@ -0,0 +1,86 @@
+"""
+多首歌曲批量推理与逐首推理的声学模型吞吐量对比
+
+用法:
+    python benchmarks/bench_inference_batch.py --songs 8 --seconds 20 60 --chunk-seconds 10 --batch-seconds 40 120
+    python benchmarks/bench_inference_batch.py --random-model 4 --repeat 1
+    python benchmarks/bench_inference_batch.py --corpus songs/ --chunk-seconds 30 --batch-seconds 60 120
+
+不指定--corpus时生成--songs首长度在--seconds范围内的合成歌曲，声学模型默认为轻量替身，
+--random-model N 换成结构与MMS_FA相同、N层Transformer的随机权重模型（更接近真实的计算量）；
+指定--corpus时使用真实的MMS_FA模型；
+对每个--batch-seconds（每个mini-batch补零后的音频总长）报告整组批量推理的耗时、相对逐首推理的加速比，
+以及各首歌曲的emission与逐首推理结果的最大差异
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import synthetic
+import align
+import batch
+
+def best_of(func, repeat):
+    """返回 (结果, 最短耗时)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def run_group(audios, chunk_seconds, batch_seconds_list, repeat):
+    total_audio = sum(audio.duration for audio in audios)
+    print(f"{len(audios)} 首歌曲, 共 {total_audio:.0f}s 音频, 块长 {chunk_seconds or '整首'}")
+    reference, seconds = best_of(
+        lambda: [align.get_emission(audio, chunk_seconds=chunk_seconds) for audio in audios], repeat)
+    print(f"  逐首推理            {seconds:7.2f}s  {total_audio / seconds:7.1f} 秒音频/秒")
+    for batch_seconds in batch_seconds_list:
+        emissions, batched = best_of(lambda: align.get_emissions_batched(
+            audios, chunk_seconds=chunk_seconds, max_batch_seconds=batch_seconds), repeat)
+        diff = max(float((a - b).abs().max()) if a.numel() else 0.0
+                   for a, b in zip(reference, emissions))
+        print(f"  批量 {batch_seconds:>5.0f}s/mini-batch {batched:7.2f}s  {total_audio / batched:7.1f} 秒音频/秒"
+              f"  加速 {seconds / batched:5.2f}x  最大差异 {diff:.1e}")
+
+def main():
+    parser = argparse.ArgumentParser(description='批量推理与逐首推理的吞吐量对比')
+    parser.add_argument('--corpus', help='歌曲目录（每个子目录含 i.txt 与音频），使用真实模型')
+    parser.add_argument('--songs', type=int, default=8)
+    parser.add_argument('--seconds', type=float, nargs=2, default=[20, 60], help='合成歌曲长度的范围')
+    parser.add_argument('--chunk-seconds', type=float, default=10)
+    parser.add_argument('--batch-seconds', type=float, nargs='+', default=[40, 120])
+    parser.add_argument('--random-model', type=int, metavar='LAYERS',
+                        help='使用随机权重、LAYERS层Transformer的MMS_FA结构模型代替替身')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.corpus:
+            paths = [job['input_audio'] for job in batch.collect_jobs(args.corpus)]
+        else:
+            synthetic.install_stand_ins()
+            if args.random_model:
+                synthetic.install_random_mms_model(args.random_model)
+            rng = np.random.default_rng(0)
+            paths = []
+            for i in range(args.songs):
+                seconds = float(rng.uniform(*args.seconds))
+                paths.append(synthetic.make_song(os.path.join(workdir, f"song{i}"), seconds, seed=i)[1])
+        audios = [align.load_audio(path) for path in paths]
+        for audio in audios:
+            audio.samples
+        # 预热：模型加载不计入
+        align.get_emission(audios[0], chunk_seconds=args.chunk_seconds)
+        run_group(audios, args.chunk_seconds, args.batch_seconds, args.repeat)
+
+if __name__ == "__main__":
+    main()
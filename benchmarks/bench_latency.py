@@ -0,0 +1,78 @@
+"""
+单首歌曲的端到端延迟：顺序执行与阶段并行的对比（离线，使用合成数据与替身模型）
+
+用法: python benchmarks/bench_latency.py --seconds 60 180 --stage-workers 1 4 --repeat 3
+
+对每个歌曲长度分别以不同的 stage_workers 运行完整流程，报告最短墙钟时间，
+并打印最后一次并行运行中各阶段的开始时间、耗时与所在线程，确认阶段之间确实重叠；
+同时确认各次运行的输出文件完全一致
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic
+import align
+import instrument
+import main as pipeline
+
+OUTPUT_FILES = ('o.lrc', 'o1.lrc', 'o2.lrc')
+
+def run_once(song_dir, text, audio, stage_workers):
+    config = dict(pipeline.DEFAULT_CONFIG, input_text=text, input_audio=audio, output_dir=song_dir,
+                  debug_output=False, log_level='WARNING', stage_workers=stage_workers)
+    tracer = instrument.Tracer()
+    start = time.perf_counter()
+    pipeline.run_pipeline(config, tracer=tracer)
+    elapsed = time.perf_counter() - start
+    outputs = []
+    for name in OUTPUT_FILES:
+        with open(os.path.join(song_dir, name), 'rb') as file:
+            outputs.append(file.read())
+    return elapsed, tracer, outputs
+
+def print_timeline(tracer):
+    for event in sorted(tracer.stages, key=lambda e: e['start']):
+        print(f"    {event['name']:<32}{event['start'] * 1000:8.0f} ms  +{event['wall'] * 1000:7.0f} ms"
+              f"  {event['thread']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='单首歌曲的阶段并行延迟基准')
+    parser.add_argument('--seconds', type=float, nargs='+', default=[60, 180])
+    parser.add_argument('--stage-workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    synthetic.install_stand_ins()
+    align.preload_models()
+    with tempfile.TemporaryDirectory() as workdir:
+        for seconds in args.seconds:
+            song_dir = os.path.join(workdir, f"song{int(seconds)}")
+            text, audio, _ = synthetic.make_song(song_dir, seconds)
+            # 预热：分词器与模型的首次调用不计入
+            run_once(song_dir, text, audio, 1)
+            print(f"{seconds:.0f}s:")
+            baseline = reference = None
+            for stage_workers in args.stage_workers:
+                best = float('inf')
+                for _ in range(args.repeat):
+                    elapsed, tracer, outputs = run_once(song_dir, text, audio, stage_workers)
+                    best = min(best, elapsed)
+                    reference = reference or outputs
+                    if outputs != reference:
+                        print("  输出与第一次运行不一致")
+                        sys.exit(1)
+                baseline = baseline or best
+                print(f"  stage_workers={stage_workers:<3} {best * 1000:8.0f} ms  "
+                      f"加速比 {baseline / best:5.2f}x")
+            print_timeline(tracer)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+文本规范化吞吐量基准：直接调用pykakasi vs 假名对照表 + 缓存
+
+用法: python benchmarks/bench_normalize.py [歌词文件 ...] --copies 20
+把歌词重复若干份组成大语料，分别统计两种转换方式下 process_token 的吞吐量，并确认输出完全一致
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import normalize
+
+def load_corpus(paths, copies):
+    lines = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            lines.extend(line.strip() for line in file if line.strip())
+    return lines * copies
+
+def run(lines):
+    start = time.perf_counter()
+    tokens = [normalize.process_token(line) for line in lines]
+    return time.perf_counter() - start, tokens
+
+def uncached_hepburn(text):
+    return normalize.get_kks().convert(text)[0]['hepburn']
+
+def uncached_hiragana(text):
+    return "".join(item['hira'] for item in normalize.get_kks().convert(text))
+
+def main():
+    parser = argparse.ArgumentParser(description='文本规范化吞吐量基准')
+    parser.add_argument('lyrics', nargs='*', default=[os.path.join(ROOT, 'i.txt')])
+    parser.add_argument('--copies', type=int, default=20)
+    args = parser.parse_args()
+
+    lines = load_corpus(args.lyrics, args.copies)
+    chars = sum(len(line) for line in lines)
+    # 预热janome词典，避免计入第一次加载的时间
+    normalize.process_token(lines[0])
+
+    cached_to_hepburn, cached_to_hiragana = normalize.to_hepburn, normalize.to_hiragana
+    normalize.to_hepburn, normalize.to_hiragana = uncached_hepburn, uncached_hiragana
+    try:
+        baseline_time, baseline_tokens = run(lines)
+    finally:
+        normalize.to_hepburn, normalize.to_hiragana = cached_to_hepburn, cached_to_hiragana
+
+    cached_time, cached_tokens = run(lines)
+
+    print(f"语料: {len(lines)} 行, {chars} 字符")
+    print(f"直接调用pykakasi: {baseline_time:.2f}s ({len(lines) / baseline_time:.0f} 行/秒)")
+    print(f"对照表 + 缓存:    {cached_time:.2f}s ({len(lines) / cached_time:.0f} 行/秒)")
+    print(f"加速: {baseline_time / cached_time:.2f}x")
+    if cached_tokens != baseline_tokens:
+        print("输出不一致！")
+        sys.exit(1)
+    print("输出一致")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+流水线分阶段基准（离线，使用合成数据与替身模型）
+
+用法:
+    python benchmarks/bench_pipeline.py --seconds 60 180 600 --output results.json
+    python benchmarks/bench_pipeline.py --seconds 60 180 600 --compare results.json
+
+对每个歌曲长度生成合成歌词与音频，分别计时各阶段，观察耗时随歌曲长度和token数的增长；
+结果可保存为JSON，并与之前某次提交的结果对比
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic
+import align
+import formatter
+import main as pipeline
+
+STAGES = [
+    'process_input_text',
+    'load_audio',
+    'emission',
+    'ctc_align',
+    'get_volume_endpoints',
+    'get_silero_endpoints',
+    'get_emission_endpoints',
+    'merge_endpoints',
+    'apply_smart_endpoint_matching',
+    'apply_score_based_correction',
+    'save_output_files',
+]
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run_song(text_path, audio_path, output_dir, config):
+    """按阶段运行一次完整流水线，返回 ({阶段: 秒}, token数)"""
+    timings = {}
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    result_list = timed('process_input_text', pipeline.process_input_text, text_path)
+    alignment_tokens, token_to_index_map = pipeline.prepare_alignment_tokens(result_list)
+
+    audio = align.load_audio(audio_path)
+    timed('load_audio', lambda: audio.samples)
+    emission = timed('emission', align.get_emission, audio,
+                     config['emission_chunk_seconds'], config['emission_overlap_seconds'])
+    alignment_results = timed('ctc_align', align.align_emission, emission, alignment_tokens)
+    pipeline.apply_alignment_results(result_list, alignment_results, token_to_index_map)
+
+    volume_endpoints = timed('get_volume_endpoints', align.get_volume_endpoints, audio,
+                             config['min_gap_seconds'], config['volume_threshold'])
+    silero_endpoints = timed('get_silero_endpoints', align.get_silero_endpoints, audio,
+                             config['min_gap_seconds'])
+    timed('get_emission_endpoints', align.get_emission_endpoints, emission, config['min_gap_seconds'])
+    merged_endpoints = timed('merge_endpoints', align.merge_endpoints,
+                             silero_endpoints, volume_endpoints, config['tolerance'])
+    timed('apply_smart_endpoint_matching', align.apply_smart_endpoint_matching,
+          result_list, merged_endpoints)
+    timed('apply_score_based_correction', pipeline.apply_score_based_correction, result_list)
+    timed('save_output_files', formatter.save_output_files, result_list, output_dir)
+    return timings, len(alignment_tokens)
+
+def run_benchmark(seconds_list, repeat, config):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for seconds in seconds_list:
+            song_dir = os.path.join(workdir, f"song_{int(seconds)}")
+            text_path, audio_path, num_lines = synthetic.make_song(song_dir, seconds)
+            best = {}
+            num_tokens = 0
+            for _ in range(repeat):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    timings, num_tokens = run_song(text_path, audio_path, song_dir, config)
+                for stage, value in timings.items():
+                    best[stage] = min(best.get(stage, float('inf')), value)
+            results.append({'seconds': seconds, 'lines': num_lines,
+                            'tokens': num_tokens, 'timings': best})
+            print_row(results[-1])
+    return results
+
+def print_row(result):
+    print(f"\n歌曲长度 {result['seconds']:.0f}s, {result['lines']} 行, {result['tokens']} 个token")
+    for stage in STAGES:
+        print(f"  {stage:<32}{result['timings'][stage] * 1000:10.1f} ms")
+
+def print_comparison(results, baseline):
+    """与之前保存的结果逐阶段对比（相同歌曲长度）"""
+    base_by_seconds = {r['seconds']: r for r in baseline['results']}
+    print(f"\n与 {baseline.get('revision', '?')} 对比（当前/基准）:")
+    for result in results:
+        base = base_by_seconds.get(result['seconds'])
+        if base is None:
+            continue
+        print(f"  {result['seconds']:.0f}s:")
+        for stage in STAGES:
+            now, before = result['timings'][stage], base['timings'].get(stage)
+            if before:
+                print(f"    {stage:<32}{now * 1000:10.1f} ms / {before * 1000:10.1f} ms  ({now / before:5.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description='流水线分阶段基准')
+    parser.add_argument('--seconds', type=float, nargs='+', default=[60, 180, 600])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--chunk-seconds', type=float, help='分块计算emission的块长（秒）')
+    parser.add_argument('--output', help='保存结果的JSON文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果对比')
+    args = parser.parse_args()
+
+    synthetic.install_stand_ins()
+    config = dict(pipeline.DEFAULT_CONFIG)
+    config['emission_chunk_seconds'] = args.chunk_seconds
+
+    # 预热：加载分词词典、替身模型与librosa，不计入第一首歌曲
+    with contextlib.redirect_stdout(io.StringIO()):
+        align.preload_models()
+        pipeline.process_line('未来へ')
+        align.compute_rms_db(synthetic.make_vocal(1.0, intro_seconds=0.0), align.SAMPLE_RATE)
+
+    results = run_benchmark(args.seconds, args.repeat, config)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'config': {'chunk_seconds': args.chunk_seconds, 'repeat': args.repeat},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            print_comparison(results, json.load(file))
+
+if __name__ == "__main__":
+    main()
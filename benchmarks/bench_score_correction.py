@@ -0,0 +1,128 @@
+"""
+行级分数微调基准：逐行Python循环 vs NumPy数组运算
+
+用法: python benchmarks/bench_score_correction.py --line-length 10 50 200 --lines 60
+生成不同行长的歌曲结果（含相同分数、相同开始时间和对齐失败的项目），
+比较两种实现的耗时，并确认两者调整后的时间完全一致
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as pipeline
+from tokens import Token
+from utils import ERROR_TIME, time_or_zero
+
+def reference_correction(result_list):
+    """原先的逐行循环实现，作为对照，返回调整的项目数"""
+    lines = []
+    current_line = []
+    for item in result_list:
+        if item.type == 0 and item.orig == '\n':
+            if current_line:
+                lines.append(current_line)
+                current_line = []
+        else:
+            current_line.append(item)
+    if current_line:
+        lines.append(current_line)
+
+    total = 0
+    for line_items in lines:
+        timed_items = [item for item in line_items
+                       if item.start is not None and item.end is not None and item.score is not None]
+        if len(timed_items) < 4:
+            continue
+        sorted_items = sorted(timed_items, key=lambda x: x.score, reverse=True)
+        mid_point = len(sorted_items) // 2
+        high_score_items = sorted_items[:mid_point]
+        low_score_items = sorted_items[mid_point:]
+        if sum(item.score for item in high_score_items) / len(high_score_items) < 0.5:
+            continue
+
+        high_score_times = sorted(((time_or_zero(item.start), time_or_zero(item.end), item.score)
+                                   for item in high_score_items), key=lambda x: x[0])
+        for low_item in low_score_items:
+            current_start = time_or_zero(low_item.start)
+            current_end = time_or_zero(low_item.end)
+            ref_start, ref_end, ref_score = min(high_score_times, key=lambda x: abs(x[0] - current_start))
+            score_diff = ref_score - low_item.score
+            if score_diff <= 0:
+                continue
+            time_diff = current_start - ref_start
+            adjustment = int(min(50, abs(time_diff) * 0.3) * min(score_diff * 2, 1.0))
+            if time_diff < -100:
+                pass
+            elif time_diff > 100:
+                adjustment = -adjustment
+            else:
+                adjustment = 0
+            if adjustment == 0:
+                continue
+            new_start = max(0, current_start + adjustment)
+            new_end = max(new_start + 10, current_end + adjustment)
+            valid = new_start < new_end
+            for r_start, r_end, _ in high_score_times:
+                if new_start < r_end and new_end > r_start:
+                    if min(new_end, r_end) - max(new_start, r_start) > (new_end - new_start) * 0.5:
+                        valid = False
+                        break
+            if valid:
+                low_item.start = new_start
+                low_item.end = new_end
+                total += 1
+    return total
+
+def make_result_list(num_lines, line_length, seed=0):
+    """生成带时间与分数的result_list；分数只保留两位小数，制造相同分数"""
+    rnd = random.Random(seed)
+    result_list = []
+    t = 500
+    for _ in range(num_lines):
+        for _ in range(line_length):
+            t += rnd.choice([0, rnd.randint(5, 60), rnd.randint(100, 400)])
+            if rnd.random() < 0.03:
+                result_list.append(Token('x', 3, 'x', None, ERROR_TIME, ERROR_TIME, 0.0))
+                continue
+            score = round(rnd.uniform(0.3, 1.0), 2) if rnd.random() < 0.9 else None
+            result_list.append(Token('x', 3, 'x', None, t, t + rnd.randint(5, 80), score))
+        result_list.append(Token('\n', 0))
+    return result_list
+
+def copy_list(result_list):
+    return [token.copy() for token in result_list]
+
+def best_of(func, result_list, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        tokens = copy_list(result_list)
+        start = time.perf_counter()
+        func(tokens)
+        best = min(best, time.perf_counter() - start)
+    return best, tokens
+
+def main():
+    parser = argparse.ArgumentParser(description='行级分数微调基准')
+    parser.add_argument('--line-length', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--lines', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    for line_length in args.line_length:
+        result_list = make_result_list(args.lines, line_length)
+        ref_time, ref_tokens = best_of(reference_correction, result_list, args.repeat)
+        new_time, new_tokens = best_of(pipeline.apply_score_based_correction, result_list, args.repeat)
+        same = ref_tokens == new_tokens
+        print(f"行长 {line_length:4d} × {args.lines} 行: 循环 {ref_time * 1000:8.2f} ms, "
+              f"数组 {new_time * 1000:8.2f} ms ({ref_time / new_time:5.1f}x), 结果一致: {same}")
+        if not same:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+启动耗时基准
+
+用法: python benchmarks/bench_startup.py --repeat 3
+每个阶段在独立的子进程中测量（排除解释器自身的启动时间），报告各阶段的导入/初始化耗时：
+导入项目模块本身应当很快，重型库与词典只在第一次使用时才加载
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (阶段名称, 准备代码（不计时）, 计时代码)
+STAGES = [
+    ('import utils', '', 'import utils'),
+    ('import normalize', '', 'import normalize'),
+    ('import align', '', 'import align'),
+    ('import formatter', '', 'import formatter'),
+    ('import main', '', 'import main'),
+    ('janome Tokenizer()', 'import normalize', 'normalize.get_tokenizer()'),
+    ('pykakasi kakasi()', 'import normalize', 'normalize.get_kks()'),
+    ('假名对照表', 'import normalize; normalize.get_kks()', 'normalize.build_kana_hepburn_table()'),
+    ('import numpy', '', 'import numpy'),
+    ('import torch', '', 'import torch'),
+    ('import torchaudio', 'import torch', 'import torchaudio'),
+    ('import librosa', 'import numpy', 'import librosa'),
+]
+
+TEMPLATE = '''
+import sys, time
+sys.path.insert(0, {root!r})
+{setup}
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+'''
+
+def measure(setup, code):
+    script = TEMPLATE.format(root=ROOT, setup=setup, code=code)
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                            text=True, check=True, cwd=ROOT)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='启动耗时基准')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for name, setup, code in STAGES:
+        try:
+            best = min(measure(setup, code) for _ in range(args.repeat))
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<22} 失败: {e.stderr.strip().splitlines()[-1] if e.stderr else e}")
+            continue
+        print(f"{name:<22} {best * 1000:9.1f} ms")
+
+if __name__ == "__main__":
+    main()
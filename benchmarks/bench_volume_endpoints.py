@@ -0,0 +1,96 @@
+"""
+音量端点检测基准：逐帧Python循环 vs 数组运算
+
+用法: python benchmarks/bench_volume_endpoints.py --minutes 1 5 10
+在合成的多分钟音频上比较两种语音段检测的耗时，并确认两者输出完全一致
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import align
+
+def reference_segments(is_speech, hop_length, sr, min_gap_seconds):
+    """原先的逐帧循环实现，作为对照"""
+    speech_segments = []
+    in_speech = False
+    start_frame = 0
+    for i, speech in enumerate(is_speech):
+        if speech and not in_speech:
+            start_frame = i
+            in_speech = True
+        elif not speech and in_speech:
+            start_time = start_frame * hop_length / sr
+            end_time = i * hop_length / sr
+            if end_time - start_time > 0.1:
+                speech_segments.append((start_time, end_time))
+            in_speech = False
+    if in_speech:
+        start_time = start_frame * hop_length / sr
+        end_time = len(is_speech) * hop_length / sr
+        if end_time - start_time > 0.1:
+            speech_segments.append((start_time, end_time))
+
+    merged_segments = []
+    for start, end in speech_segments:
+        if merged_segments and start - merged_segments[-1][1] < min_gap_seconds:
+            merged_segments[-1] = (merged_segments[-1][0], end)
+        else:
+            merged_segments.append((start, end))
+    return [int(end_time * 100) for _, end_time in merged_segments]
+
+def synth_vocal(seconds, sample_rate, seed=0):
+    """生成交替出现的有声段与静音段"""
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    pos = 0
+    while pos < len(samples):
+        voiced = int(rng.uniform(0.05, 3.0) * sample_rate)
+        silent = int(rng.uniform(0.02, 1.5) * sample_rate)
+        t = np.arange(min(voiced, len(samples) - pos)) / sample_rate
+        samples[pos:pos + len(t)] = 0.3 * np.sin(2 * np.pi * rng.uniform(150, 600) * t)
+        pos += voiced + silent
+    samples += rng.normal(0, 1e-4, len(samples)).astype(np.float32)
+    return samples
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='音量端点检测基准')
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--sample-rate', type=int, default=align.SAMPLE_RATE)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    sr = args.sample_rate
+    min_gap, threshold = 0.3, -40
+    for minutes in args.minutes:
+        samples = synth_vocal(minutes * 60, sr)
+        rms_db, hop_length = align.compute_rms_db(samples, sr)
+        is_speech = rms_db > threshold
+
+        loop_time, expected = best_of(
+            lambda: reference_segments(is_speech, hop_length, sr, min_gap), args.repeat)
+        vector_time, (_, ends) = best_of(
+            lambda: align.find_speech_segments(is_speech, hop_length, sr, min_gap), args.repeat)
+        actual = (ends * 100).astype(np.int64).tolist()
+
+        status = "一致" if actual == expected else "不一致"
+        print(f"{minutes:5.1f} 分钟, {len(is_speech)} 帧, {len(expected)} 个端点: "
+              f"循环 {loop_time * 1000:8.2f}ms, 数组 {vector_time * 1000:7.2f}ms, "
+              f"加速 {loop_time / vector_time:6.1f}x, 结果{status}")
+        if actual != expected:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+对比分块emission与整段推理的结果
+
+用法: python benchmarks/compare_emission.py i.mp3 --chunk-seconds 30 --overlap-seconds 1 --tolerance 0.05
+输出两种方式的最大绝对误差、逐帧argmax一致率与各自的推理时间，误差超过容忍度时返回非零退出码
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+import torchaudio
+import align
+
+def main():
+    parser = argparse.ArgumentParser(description='对比分块emission与整段推理')
+    parser.add_argument('audio')
+    parser.add_argument('--chunk-seconds', type=float, default=30.0)
+    parser.add_argument('--overlap-seconds', type=float, default=1.0)
+    parser.add_argument('--tolerance', type=float, default=0.05)
+    args = parser.parse_args()
+
+    bundle = torchaudio.pipelines.MMS_FA
+    sample_rate = int(bundle.sample_rate)
+    waveform, orig_rate = torchaudio.load(args.audio)
+    waveform = torchaudio.functional.resample(waveform.mean(0, keepdim=True), orig_rate, sample_rate)
+    model = align.load_alignment_model('cpu')
+
+    with torch.inference_mode():
+        start = time.perf_counter()
+        full = align.compute_emission(model, waveform, sample_rate)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chunked = align.compute_emission(model, waveform, sample_rate,
+                                         args.chunk_seconds, args.overlap_seconds)
+        chunked_time = time.perf_counter() - start
+
+    if full.shape != chunked.shape:
+        print(f"帧数不一致: 整段 {tuple(full.shape)}, 分块 {tuple(chunked.shape)}")
+        sys.exit(1)
+
+    max_diff = (full - chunked).abs().max().item()
+    argmax_agree = (full.argmax(-1) == chunked.argmax(-1)).float().mean().item()
+    print(f"帧数: {full.shape[1]}")
+    print(f"最大绝对误差: {max_diff:.5f} (容忍度 {args.tolerance})")
+    print(f"argmax一致率: {argmax_agree:.4%}")
+    print(f"整段推理 {full_time:.2f}s, 分块推理 {chunked_time:.2f}s")
+    sys.exit(0 if max_diff <= args.tolerance else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+基准测试用的合成数据与离线替身模型
+
+- make_lyrics / write_lyrics: 生成包含汉字、假名、英语和 ((…/…)) 自定义注音的歌词
+- make_vocal / write_wav: 生成指定长度、有声段与静音段交替的人声音频
+- StandInAcousticModel / stand_in_silero: 与MMS_FA、Silero VAD接口相同的轻量替身，不需要联网下载
+- install_stand_ins: 把align中的模型加载函数替换为替身
+- install_random_mms_model: 声学模型换成随机权重、结构与MMS_FA相同的wav2vec2，用于衡量真实的计算量
+"""
+import functools
+import os
+import random
+import sys
+import wave
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+import align
+
+KANJI_WORDS = ['未来', '世界', '夢', '光', '空', '心', '言葉', '約束', '記憶', '涙',
+               '明日', '永遠', '季節', '時間', '星', '願い', '景色', '最後', '奇跡', '道']
+KANA_PHRASES = ['きっと', 'もう一度', 'ずっと', 'あなたと', 'どこまでも', 'ただ',
+                'いつか', 'この', 'まだ', 'そして', 'ねえ', 'ラララ', 'さよなら']
+PARTICLES = ['を', 'に', 'が', 'は', 'の', 'で', 'へ', 'と']
+VERBS = ['見たい', '歩いて', '信じて', '探して', '抱きしめて', '走り出す', '守りたい', '叫んだ']
+ENGLISH_WORDS = ['love', 'dream', 'forever', 'shine', 'baby', 'tonight', 'hello', 'goodbye']
+OVERRIDES = ['((未来/みらい))', '((運命/さだめ))', '((本気/マジ))', '((地球/ほし))',
+             '((イリジウム/irijiumu))', '((宇宙/そら))']
+
+def make_line(rnd):
+    """生成一行歌词"""
+    parts = []
+    for _ in range(rnd.randint(2, 4)):
+        choice = rnd.random()
+        if choice < 0.45:
+            parts.append(rnd.choice(KANJI_WORDS) + rnd.choice(PARTICLES))
+        elif choice < 0.7:
+            parts.append(rnd.choice(KANA_PHRASES))
+        elif choice < 0.85:
+            parts.append(rnd.choice(VERBS))
+        elif choice < 0.93:
+            parts.append(rnd.choice(OVERRIDES))
+        else:
+            parts.append(rnd.choice(ENGLISH_WORDS) + ' ')
+    return ''.join(parts).strip()
+
+def make_lyrics(num_lines, chorus_every=4, seed=0):
+    """
+    生成num_lines行歌词，每隔chorus_every行插入一段重复的副歌（与真实歌词一样有大量重复行）
+    """
+    rnd = random.Random(seed)
+    chorus = [make_line(rnd) for _ in range(4)]
+    lines = []
+    while len(lines) < num_lines:
+        lines.extend(make_line(rnd) for _ in range(chorus_every))
+        lines.extend(chorus)
+    return lines[:num_lines]
+
+def write_lyrics(path, lines):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines) + '\n')
+
+def make_vocal(seconds, sample_rate=align.SAMPLE_RATE, intro_seconds=5.0, seed=0):
+    """生成有声段（带谐波的音调）与静音段交替的单声道float32音频，开头为静音前奏"""
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    pos = int(intro_seconds * sample_rate)
+    while pos < len(samples):
+        voiced = int(rng.uniform(0.3, 3.0) * sample_rate)
+        silent = int(rng.uniform(0.1, 1.2) * sample_rate)
+        n = min(voiced, len(samples) - pos)
+        t = np.arange(n) / sample_rate
+        f0 = rng.uniform(150, 500)
+        tone = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 5))
+        envelope = np.minimum(1.0, np.minimum(t, t[::-1]) * 20) if n else t
+        samples[pos:pos + n] = (0.2 * tone * envelope).astype(np.float32)
+        pos += voiced + silent
+    samples += rng.normal(0, 1e-4, len(samples)).astype(np.float32)
+    return samples
+
+def write_wav(path, samples, sample_rate=align.SAMPLE_RATE):
+    """以16位PCM写出WAV文件"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        file.writeframes(pcm.tobytes())
+
+def make_song(directory, seconds, lines_per_minute=16, seed=0):
+    """在directory中生成 i.txt 与 i.wav，返回 (歌词路径, 音频路径, 行数)"""
+    os.makedirs(directory, exist_ok=True)
+    num_lines = max(1, int(seconds / 60 * lines_per_minute))
+    text_path = os.path.join(directory, 'i.txt')
+    audio_path = os.path.join(directory, 'i.wav')
+    write_lyrics(text_path, make_lyrics(num_lines, seed=seed))
+    write_wav(audio_path, make_vocal(seconds, seed=seed))
+    return text_path, audio_path, num_lines
+
+class StandInAcousticModel(torch.nn.Module):
+    """
+    与MMS_FA模型接口相同的替身：输入 (batch, 采样点)，输出 (emission, lengths)
+    帧数与wav2vec2完全一致（400点感受野、320点步长），静音帧以blank为主
+    卷积之后接两层Linear，使int8动态量化等推理后端也有可以作用的层
+    不做MMS_FA封装中的输入归一化，依赖归一化的行为需要用install_random_mms_model或真实模型检查
+    """
+
+    def __init__(self, num_labels=29, hidden=256, seed=0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.conv = torch.nn.Conv1d(1, hidden, align.RECEPTIVE_FIELD, stride=align.FRAME_SAMPLES)
+        self.proj = torch.nn.Linear(hidden, hidden)
+        self.head = torch.nn.Linear(hidden, num_labels)
+        with torch.no_grad():
+            for layer in (self.conv, self.proj, self.head):
+                layer.weight.copy_(torch.randn(layer.weight.shape, generator=generator) * 0.05)
+                layer.bias.zero_()
+
+    def forward(self, waveforms: torch.Tensor, lengths: Optional[torch.Tensor] = None):
+        hidden = self.conv(waveforms.unsqueeze(1)).transpose(1, 2)
+        logits = self.head(torch.nn.functional.gelu(self.proj(hidden)))
+        frames = waveforms.unfold(1, align.RECEPTIVE_FIELD, align.FRAME_SAMPLES)
+        energy = frames.pow(2).mean(-1).add(1e-8).log10()
+        # 能量低的帧偏向blank（下标0）
+        logits[..., 0] += (-4.0 - energy).clamp(min=0) * 4.0
+        emission = torch.nn.functional.log_softmax(logits, dim=-1)
+        if lengths is not None:
+            lengths = torch.div(lengths - align.RECEPTIVE_FIELD, align.FRAME_SAMPLES,
+                                rounding_mode='floor') + 1
+        return emission, lengths
+
+def stand_in_speech_timestamps(wav, model=None, sampling_rate=align.SAMPLE_RATE,
+                               min_silence_duration_ms=100, **kwargs):
+    """与Silero get_speech_timestamps接口相同的能量VAD替身，返回以采样点为单位的语音段"""
+    samples = wav.numpy() if isinstance(wav, torch.Tensor) else np.asarray(wav)
+    rms_db, hop_length = align.compute_rms_db(samples, sampling_rate)
+    starts, ends = align.find_speech_segments(rms_db > -35, hop_length, sampling_rate,
+                                              min_silence_duration_ms / 1000)
+    return [{'start': int(s * sampling_rate), 'end': int(e * sampling_rate)}
+            for s, e in zip(starts, ends)]
+
+def stand_in_silero():
+    """与 torch.hub.load('snakers4/silero-vad') 返回值结构相同的替身"""
+    return None, (stand_in_speech_timestamps, None, None, None, None)
+
+def install_stand_ins():
+    """把align中的MMS_FA与Silero加载函数替换为离线替身，替身同样按推理后端转换"""
+    model = StandInAcousticModel().eval()
+
+    @functools.lru_cache(maxsize=None)
+    def load_stand_in_model(device_type, backend='eager'):
+        return align.prepare_inference_backend(model.to(torch.device(device_type)),
+                                               backend, device_type)
+
+    align.load_alignment_model = load_stand_in_model
+    align.load_silero_model = stand_in_silero
+
+def install_random_mms_model(num_layers=None):
+    """
+    把align中的声学模型换成与MMS_FA结构相同、权重随机的wav2vec2（num_layers可减少Transformer层数），
+    输出没有意义，但计算量与补零、注意力掩码的行为与真实模型一致
+    """
+    import torchaudio
+    import acoustic_model
+    params = dict(torchaudio.pipelines.MMS_FA._params)
+    if num_layers:
+        params['encoder_num_layers'] = num_layers
+    torch.manual_seed(0)
+    model = acoustic_model.PaddedAcousticModel(torchaudio.models.wav2vec2_model(**params),
+                                               True, True, True).eval()
+
+    @functools.lru_cache(maxsize=None)
+    def load_random_model(device_type, backend='eager'):
+        return align.prepare_inference_backend(model.to(torch.device(device_type)),
+                                               backend, device_type)
+
+    align.load_alignment_model = load_random_model
@@ -0,0 +1,137 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+from tokens import Token
+
+def file_sha256(path):
+    """计算文件内容的SHA-256，同一进程内按路径、大小和修改时间复用结果"""
+    stat = os.stat(path)
+    return _file_sha256(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+@functools.lru_cache(maxsize=256)
+def _file_sha256(path, size, mtime_ns, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_cache_key(*parts):
+    """把若干字段组合成缓存键"""
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+class ArrayCache:
+    """
+    磁盘上的numpy数组缓存
+    每个条目保存为一个 .npy 文件，读取时以内存映射方式打开；
+    以文件修改时间记录最近使用时间，总大小超过 max_bytes 时按LRU淘汰
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def get(self, key):
+        """读取缓存条目，不存在或损坏时返回None"""
+        import numpy as np
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            # 'c' 为写时复制映射，调用方拿到的是可写数组而文件本身不会被修改
+            array = np.load(path, mmap_mode='c')
+        except (OSError, ValueError):
+            self._remove(path)
+            return None
+        os.utime(path)
+        return array
+
+    def put(self, key, array):
+        """写入缓存条目，写入后执行淘汰"""
+        import numpy as np
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """删除最久未使用的条目，直到总大小不超过上限（keep指定的条目不会被删除）"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class TokenCache:
+    """
+    歌词行 -> token列表 的缓存
+    内存层为字典；提供db_path时同时写入sqlite持久化，version变化（分词器或词典升级）时清空
+    取出的token是副本，调用方可以随意修改
+    """
+
+    def __init__(self, db_path=None, version=''):
+        self.memory = {}
+        self.db = None
+        if db_path:
+            # 分词可能在流水线的工作线程中进行，同一时间只有一个线程使用连接
+            self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS tokens (line TEXT PRIMARY KEY, tokens TEXT)')
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != version:
+                self.db.execute('DELETE FROM tokens')
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+                self.db.commit()
+
+    def get(self, line):
+        """查找一行歌词的token列表，未命中返回None"""
+        tokens = self.memory.get(line)
+        if tokens is None and self.db is not None:
+            row = self.db.execute('SELECT tokens FROM tokens WHERE line = ?', (line,)).fetchone()
+            if row is not None:
+                tokens = json.loads(row[0])
+                self.memory[line] = tokens
+        if tokens is None:
+            return None
+        return [Token.from_dict(token) for token in tokens]
+
+    def put(self, line, tokens):
+        """保存一行歌词的token列表"""
+        tokens = [token.to_dict() for token in tokens]
+        self.memory[line] = tokens
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO tokens VALUES (?, ?)',
+                            (line, json.dumps(tokens, ensure_ascii=False)))
+
+    def flush(self):
+        """把新增条目提交到sqlite"""
+        if self.db is not None:
+            self.db.commit()
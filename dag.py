@@ -0,0 +1,35 @@
+"""
+小型阶段DAG执行器
+每个阶段声明依赖的阶段，依赖全部完成后立即提交到线程池，互不依赖的阶段并行执行
+声学模型、Silero VAD、解码与librosa在C代码中运行时会释放GIL，因此线程即可让这些阶段重叠
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+def run_graph(stages, max_workers=None):
+    """
+    stages: {阶段名称: (函数, 依赖的阶段名称元组)}，函数按依赖顺序接收各依赖阶段的返回值
+    返回 {阶段名称: 返回值}
+    任一阶段抛出异常时不再提交新的阶段，等正在运行的阶段结束后重新抛出该异常
+    """
+    for name, (_, deps) in stages.items():
+        missing = [dep for dep in deps if dep not in stages]
+        if missing:
+            raise ValueError(f"阶段 {name} 依赖不存在的阶段: {', '.join(missing)}")
+
+    results = {}
+    pending = dict(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage') as pool:
+        while pending or running:
+            ready = [name for name, (_, deps) in pending.items()
+                     if all(dep in results for dep in deps)]
+            for name in ready:
+                func, deps = pending.pop(name)
+                running[pool.submit(func, *[results[dep] for dep in deps])] = name
+            if not running:
+                raise ValueError(f"阶段之间存在循环依赖: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
@@ -1,143 +1,184 @@
-from utils import parse_time_to_hundredths, format_hundredths_to_time_str
+import os
+from utils import format_hundredths_to_time_str, format_token_time, time_or_zero
+
+# 每个writer逐个接收result_list中的项目，行（或注音）完成时立即写出，
+# save_output_files只遍历一次result_list就生成全部输出文件
+
+class MainWriter:
+    """Main subtitle lines: [start]char ... [end]"""
+
+    def __init__(self, write):
+        self.write = write
+        self.parts = []
+        self.last_end = None
+
+    def add(self, item):
+        if item.type in (1, 3):
+            self.parts.append(f"{format_token_time(item.start)}{item.orig}")
+            self.last_end = item.end
+        elif item.type == 2:
+            if item.orig != '':
+                self.parts.append(f"{format_token_time(item.start)}{item.orig}")
+            self.last_end = item.end
+        elif item.type == 0:
+            if item.orig == '\n':
+                if self.last_end is not None:
+                    self.parts.append(f"{format_token_time(self.last_end)}\n")
+                    self.write("".join(self.parts))
+                    self.parts = []
+                    self.last_end = None
+            else:
+                self.parts.append(item.orig)
+
+    def finish(self):
+        current_line = "".join(self.parts)
+        if current_line and self.last_end is not None:
+            self.write(f"{current_line}{format_token_time(self.last_end)}")
+        self.write("\n")
+
+class RubyWriter:
+    """
+    Ruby annotations: @RubyN=surface,readings,start,next start of the same surface
+    The last annotation of every surface is kept in a dict, so ruby4 is filled without scanning back
+    """
+
+    def __init__(self):
+        # [ruby1, ruby2的各部分, ruby3, ruby4]
+        self.annotations = []
+        self.last_by_surface = {}
+        # 正在接收后续读音（orig为空的汉字项目）的注音
+        self.current = None
+        self.first_start_time = 0
+
+    def add(self, item):
+        if item.type == 2:
+            if item.orig != '':
+                ruby3 = format_token_time(item.start)
+                previous = self.last_by_surface.get(item.orig)
+                if previous is not None:
+                    previous[3] = ruby3
+                self.current = [item.orig, [item.ruby], ruby3, '']
+                self.annotations.append(self.current)
+                self.last_by_surface[item.orig] = self.current
+                self.first_start_time = time_or_zero(item.start)
+                return
+            if self.current is not None:
+                time_diff = time_or_zero(item.start) - self.first_start_time
+                self.current[1].append(f"{format_hundredths_to_time_str(time_diff)}{item.ruby}")
+                return
+        self.current = None
+
+    def finish(self, write):
+        write("\n".join(f"@Ruby{idx}={ruby1},{''.join(ruby2)},{ruby3},{ruby4}"
+                        for idx, (ruby1, ruby2, ruby3, ruby4) in enumerate(self.annotations, 1)))
+
+class SignWriter:
+    """Sign markers before lines that follow a long pause"""
+
+    def __init__(self, write):
+        self.write = write
+        self.last_end_time = None
+        self.last_item_end = None
+        self.line_started = False
+
+    def add(self, item):
+        if (item.start is not None and not self.line_started and item.type in (1, 2, 3)):
+            current_start_time = time_or_zero(item.start)
+
+            if ((self.last_end_time and current_start_time - self.last_end_time > 1000) or
+                (self.last_end_time is None and current_start_time > 500)):
+                marker_time = max(0, current_start_time - 300)
+                marker_time_str = format_hundredths_to_time_str(marker_time)
+                self.write(f"{format_token_time(item.start)}⬤⬤⬤{marker_time_str}\n")
 
-def process_main(result_list):
-    """Generate main subtitle file content"""
-    result = []
-    current_line = ""
-    last_end = None
+            self.line_started = True
 
+        if item.end is not None and item.type in (1, 2, 3):
+            self.last_item_end = time_or_zero(item.end)
+
+        # Handle line end
+        if item.type == 0 and item.orig == '\n':
+            self.line_started = False
+            if self.last_item_end is not None:
+                self.last_end_time = self.last_item_end
+
+    def finish(self):
+        pass
+
+class PronWriter:
+    """Pronunciation subtitle lines"""
+
+    def __init__(self, write):
+        self.write = write
+        self.parts = []
+        self.last_end = None
+
+    def add(self, item):
+        if item.type in (2, 3):
+            if item.pron:
+                self.parts.append(f"{format_token_time(item.start)}{item.pron} ")
+                self.last_end = item.end
+        elif item.type == 0:
+            if item.orig == '\n':
+                if self.last_end is not None:
+                    self.parts.append(f"{format_token_time(self.last_end)}\n")
+                    self.write("".join(self.parts))
+                    self.parts = []
+                    self.last_end = None
+
+    def finish(self):
+        current_line = "".join(self.parts)
+        if current_line and self.last_end is not None:
+            self.write(f"{current_line}{format_token_time(self.last_end)}")
+        self.write("\n")
+
+def render(writer_class, result_list):
+    """Run one writer over result_list and return its output as a string"""
+    parts = []
+    writer = writer_class(parts.append)
     for item in result_list:
-        if item['type'] in [1, 3]:
-            current_line += f"{item['start']}{item['orig']}"
-            last_end = item['end']
-        elif item['type'] == 2:
-            if item['orig'] != '':
-                current_line += f"{item['start']}{item['orig']}"
-            last_end = item['end']
-        elif item['type'] == 0:
-            if item['orig'] == '\n':
-                if last_end:
-                    current_line += f"{last_end}\n"
-                    result.append(current_line)
-                    current_line = ""
-                    last_end = None
-            else:
-                current_line += item['orig']
+        writer.add(item)
+    writer.finish()
+    return "".join(parts)
 
-    if current_line and last_end:
-        current_line += f"{last_end}"
-        result.append(current_line)
-    
-    result.append("\n")
-    return "".join(result)
+def process_main(result_list):
+    """Generate main subtitle file content"""
+    return render(MainWriter, result_list)
 
 def process_ruby(result_list):
     """Generate ruby annotation content"""
-    ruby_annotations = []
-    i = 0
-
-    while i < len(result_list):
-        item = result_list[i]
-
-        if item['type'] == 2 and item['orig'] != '':
-            ruby1 = item['orig']
-            ruby2 = item['ruby']
-            ruby3 = item['start']
-            ruby4 = ''
-
-            first_start_time = parse_time_to_hundredths(item['start'])
-
-            j = i + 1
-            while j < len(result_list) and result_list[j]['type'] == 2 and result_list[j]['orig'] == '':
-                current_item = result_list[j]
-                current_start_time = parse_time_to_hundredths(current_item['start'])
-                time_diff = current_start_time - first_start_time
-                time_diff_str = format_hundredths_to_time_str(time_diff)
-                ruby2 += f"{time_diff_str}{current_item['ruby']}"
-                j += 1
-
-            # Find matching ruby4
-            for k in range(len(ruby_annotations) - 1, -1, -1):
-                if ruby_annotations[k]['ruby1'] == ruby1:
-                    ruby_annotations[k]['ruby4'] = item['start']
-                    break
-
-            ruby_annotations.append({'ruby1': ruby1, 'ruby2': ruby2, 'ruby3': ruby3, 'ruby4': ruby4})
-            i = j
-        else:
-            i += 1
-
-    result = []
-    for idx, annotation in enumerate(ruby_annotations, 1):
-        result.append(f"@Ruby{idx}={annotation['ruby1']},{annotation['ruby2']},{annotation['ruby3']},{annotation['ruby4']}")
-
-    return "\n".join(result)
+    parts = []
+    writer = RubyWriter()
+    for item in result_list:
+        writer.add(item)
+    writer.finish(parts.append)
+    return "".join(parts)
 
 def process_sign(result_list):
     """Generate sign markers for timing"""
-    markers = []
-    last_end_time = None
-    line_started = False
-
-    for i, item in enumerate(result_list):
-        if ('start' in item and not line_started and item['type'] in [1, 2, 3]):
-            current_start_time = parse_time_to_hundredths(item['start'])
-
-            if ((last_end_time and current_start_time - last_end_time > 1000) or
-                (last_end_time is None and current_start_time > 500)):
-                marker_time = max(0, current_start_time - 300)
-                marker_time_str = format_hundredths_to_time_str(marker_time)
-                markers.append(f"{item['start']}⬤⬤⬤{marker_time_str}")
-            
-            line_started = True
-
-        # Handle line end
-        if item['type'] == 0 and item['orig'] == '\n':
-            line_started = False
-            for j in range(i - 1, -1, -1):
-                if 'end' in result_list[j] and result_list[j]['type'] in [1, 2, 3]:
-                    last_end_time = parse_time_to_hundredths(result_list[j]['end'])
-                    break
-
-    return "\n".join(markers) + "\n" if markers else ""
+    return render(SignWriter, result_list)
 
 def process_pron(result_list):
     """Generate pronunciation subtitle file"""
-    result = []
-    current_line = ""
-    last_end = None
-
-    for item in result_list:
-        if item['type'] in [2, 3]:
-            if 'pron' in item and item['pron']:
-                current_line += f"{item['start']}{item['pron']} "
-                last_end = item['end']
-        elif item['type'] == 0:
-            if item['orig'] == '\n':
-                if last_end:
-                    current_line += f"{last_end}\n"
-                    result.append(current_line)
-                    current_line = ""
-                    last_end = None
-
-    if current_line and last_end:
-        current_line += f"{last_end}"
-        result.append(current_line)
-    
-    result.append("\n")
-    return "".join(result)
-
-def save_output_files(result_list):
-    """Save all output files"""
-    main_output = process_main(result_list)
-    ruby_output = process_ruby(result_list)
-    content = f"{main_output}\n{ruby_output}"
-    sign_output = process_sign(result_list)
-    pron_output = process_pron(result_list)
-    
-    with open('o.lrc', 'w', encoding='utf-8') as f:
-        f.write(content)
-    with open('o1.lrc', 'w', encoding='utf-8') as f:
-        f.write(sign_output)
-    with open('o2.lrc', 'w', encoding='utf-8') as f:
-        f.write(pron_output)
\ No newline at end of file
+    return render(PronWriter, result_list)
+
+def save_output_files(result_list, output_dir='.'):
+    """Save all output files in a single pass over result_list"""
+    with open(os.path.join(output_dir, 'o.lrc'), 'w', encoding='utf-8') as main_file, \
+         open(os.path.join(output_dir, 'o1.lrc'), 'w', encoding='utf-8') as sign_file, \
+         open(os.path.join(output_dir, 'o2.lrc'), 'w', encoding='utf-8') as pron_file:
+        main_writer = MainWriter(main_file.write)
+        ruby_writer = RubyWriter()
+        sign_writer = SignWriter(sign_file.write)
+        pron_writer = PronWriter(pron_file.write)
+        for item in result_list:
+            main_writer.add(item)
+            ruby_writer.add(item)
+            sign_writer.add(item)
+            pron_writer.add(item)
+        main_writer.finish()
+        # o.lrc: 主字幕之后空一行接注音
+        main_file.write("\n")
+        ruby_writer.finish(main_file.write)
+        sign_writer.finish()
+        pron_writer.finish()
@@ -0,0 +1,195 @@
+"""
+增量重新对齐：只修改了少数歌词行时，复用上一次运行的结果
+
+每次运行结束时把歌词行与各行token（含时间）保存为状态文件（默认 o.json）。
+增量运行时按行比较新旧歌词，未修改的行直接沿用之前的时间并作为锚点，
+修改或新增的行只在前后最近的未修改行之间的emission帧上重新做CTC对齐，
+端点调整与分数微调也只作用于这些行
+"""
+import difflib
+import json
+import logging
+import align
+import instrument
+import main as pipeline
+from cache import file_sha256
+from tokens import Token
+from utils import ERROR_TIME
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+def save_state(path, audio_path, lines, result_list):
+    """保存歌词行与每行的token（result_list按换行token分行）"""
+    state = {
+        'version': STATE_VERSION,
+        'audio': file_sha256(audio_path),
+        'lines': lines,
+        'tokens': [[token.to_dict() for token in line_tokens]
+                   for line_tokens in split_lines(result_list)],
+    }
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(state, file, ensure_ascii=False)
+
+def load_state(path, audio_path):
+    """读取状态文件；文件不存在、版本不同或音频已更换时返回None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if state.get('version') != STATE_VERSION or state.get('audio') != file_sha256(audio_path):
+        return None
+    if len(state['lines']) != len(state['tokens']):
+        return None
+    return state
+
+def split_lines(result_list):
+    """按换行token把result_list拆成每行的token列表（不含换行token）"""
+    lines = []
+    current = []
+    for token in result_list:
+        if token.orig == '\n':
+            lines.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        lines.append(current)
+    return lines
+
+def join_lines(line_tokens):
+    result_list = []
+    for tokens in line_tokens:
+        result_list.extend(tokens)
+        result_list.append(Token('\n', 0))
+    return result_list
+
+def line_start(tokens):
+    """一行中最早的有效开始时间，没有时返回None"""
+    times = [t.start for t in tokens if t.start is not None and t.start != ERROR_TIME]
+    return min(times) if times else None
+
+def line_end(tokens):
+    """一行中最晚的有效结束时间，没有时返回None"""
+    times = [t.end for t in tokens if t.end is not None and t.end != ERROR_TIME]
+    return max(times) if times else None
+
+def diff_lines(old_lines, old_tokens, new_lines, token_cache):
+    """
+    比较新旧歌词行，返回 (每行token列表, 需要重新对齐的新行区间列表[(j1, j2)])
+    未修改的行复制之前的token（含时间），修改或新增的行重新分词
+    """
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    line_tokens = [None] * len(new_lines)
+    changed_blocks = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for k in range(j2 - j1):
+                line_tokens[j1 + k] = [Token.from_dict(d) for d in old_tokens[i1 + k]]
+            continue
+        for j in range(j1, j2):
+            line_tokens[j] = [t.copy() for t in pipeline.tokenize_line(new_lines[j], token_cache)]
+        if j2 > j1:
+            changed_blocks.append((j1, j2))
+    token_cache.flush()
+    return line_tokens, changed_blocks
+
+def find_anchor_window(line_tokens, j1, j2, audio_duration):
+    """
+    修改区间[j1, j2)前后最近的锚点：前一个有时间的行的结束与后一个有时间的行的开始（百分秒）
+    没有锚点时分别取音频的开头与结尾
+    """
+    start = 0
+    for k in range(j1 - 1, -1, -1):
+        end = line_end(line_tokens[k])
+        if end is not None:
+            start = end
+            break
+    stop = int(audio_duration * 100)
+    for k in range(j2, len(line_tokens)):
+        begin = line_start(line_tokens[k])
+        if begin is not None:
+            stop = begin
+            break
+    return start, stop
+
+def realign_block(block, audio, start, stop, config):
+    """在 [start, stop)（百分秒）对应的emission帧上重新对齐一段歌词行，并做端点调整与分数微调"""
+    alignment_tokens, token_to_index_map = pipeline.prepare_alignment_tokens(block)
+    if not alignment_tokens:
+        return
+    pipeline.validate_alignment_tokens(alignment_tokens)
+
+    # 每帧20ms，即2个百分秒
+    first_frame = start // 2
+    last_frame = -(-stop // 2)
+    with instrument.stage('alignment', alignment_tokens=len(alignment_tokens),
+                          frames=last_frame - first_frame):
+        emission = align.get_emission_window(
+            audio, first_frame, last_frame,
+            chunk_seconds=config['emission_chunk_seconds'],
+            overlap_seconds=config['emission_overlap_seconds'],
+            emission_cache=pipeline.get_emission_cache(config),
+            backend=config['inference_backend'],
+            energy_gate=pipeline.get_energy_gate(config)
+        )
+        alignment_results = align.align_emission(emission, alignment_tokens, frame_offset=first_frame)
+    pipeline.apply_alignment_results(block, alignment_results, token_to_index_map)
+
+    if config['enable_vad_adjustment']:
+        with instrument.stage('adjust_ends_with_hybrid'):
+            align.adjust_ends_with_hybrid(
+                block,
+                audio.segment(start / 100, stop / 100),
+                min_gap_seconds=config['min_gap_seconds'],
+                volume_threshold=config['volume_threshold'],
+                tolerance=config['tolerance'],
+                emission=emission,
+                sources=config['endpoint_sources'],
+                frame_offset=first_frame
+            )
+    if config['enable_score_correction']:
+        with instrument.stage('apply_score_based_correction'):
+            pipeline.apply_score_based_correction(block)
+
+def run_incremental(config, token_cache=None, tracer=None):
+    """
+    根据上一次运行的状态文件增量处理修改后的歌词
+    没有可用的状态文件或重新对齐失败时返回None，由调用方执行完整流程
+    """
+    state_path = pipeline.get_state_path(config)
+    if state_path is None:
+        return None
+    state = load_state(state_path, config['input_audio'])
+    if state is None:
+        logger.info("没有可用的上一次运行状态，执行完整流程")
+        return None
+
+    with instrument.stage('process_input_text') as event:
+        if token_cache is None:
+            token_cache = pipeline.get_token_cache(config)
+        lines = pipeline.read_lyric_lines(config['input_text'])
+        line_tokens, changed_blocks = diff_lines(
+            state['lines'], state['tokens'], lines, token_cache)
+        event['changed_lines'] = sum(j2 - j1 for j1, j2 in changed_blocks)
+    logger.info(f"共 {len(lines)} 行，其中 {event['changed_lines']} 行需要重新对齐")
+
+    audio = align.load_audio(config['input_audio'], pcm_cache=pipeline.get_pcm_cache(config))
+    if tracer is not None:
+        tracer.set(audio_duration=audio.duration, changed_lines=event['changed_lines'])
+    try:
+        for j1, j2 in changed_blocks:
+            start, stop = find_anchor_window(line_tokens, j1, j2, audio.duration)
+            logger.info(f"重新对齐第 {j1 + 1}-{j2} 行，范围 {start / 100:.2f}s - {stop / 100:.2f}s")
+            block = join_lines(line_tokens[j1:j2])
+            realign_block(block, audio, start, stop, config)
+            line_tokens[j1:j2] = split_lines(block)
+    except Exception as e:
+        logger.warning(f"增量对齐失败（{e}），执行完整流程")
+        return None
+
+    result_list = join_lines(line_tokens)
+    pipeline.write_outputs(result_list, lines, config)
+    return result_list
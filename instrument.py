@@ -0,0 +1,137 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+def get_current_rss():
+    """当前常驻内存（字节），无法获取时返回None"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def get_peak_rss():
+    """峰值常驻内存（字节）；Linux上可通过reset_peak_rss按阶段重置"""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS以字节为单位，Linux以KB为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def reset_peak_rss():
+    """重置内核记录的峰值RSS（仅Linux支持），使峰值可以按阶段统计"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+class Tracer:
+    """
+    记录一次运行中每个阶段和模型调用的墙钟时间、CPU时间与内存
+    attrs保存整首歌曲的信息（音频时长、token数等），可写出JSON trace用于汇总实时率
+    """
+
+    def __init__(self, **attrs):
+        self.attrs = dict(attrs)
+        self.stages = []
+        self.start_time = time.time()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        # 每个未结束阶段目前观察到的峰值RSS，重置内核峰值前先记入所有未结束的阶段
+        # 阶段可能在多个线程中同时运行，以锁保护
+        self._open_peaks = {}
+        self._run_peak = 0
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @contextlib.contextmanager
+    def stage(self, name, **attrs):
+        """
+        计时一个阶段；with语句得到的字典可以继续添加字段（如token数）
+        嵌套阶段和并行运行的阶段各自独立记录；start为相对运行开始的秒数，thread为所在线程
+        cpu为整个进程的CPU时间，阶段并行时包含同时运行的其他阶段
+        """
+        event = {'name': name}
+        event.update(attrs)
+        key = object()
+        with self._lock:
+            self._record_open_peaks()
+            reset_peak_rss()
+            self._open_peaks[key] = 0
+        rss_start = get_current_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield event
+        finally:
+            event['start'] = wall_start - self._wall_start
+            event['wall'] = time.perf_counter() - wall_start
+            event['cpu'] = time.process_time() - cpu_start
+            event['thread'] = threading.current_thread().name
+            event['rss_start'] = rss_start
+            event['rss_end'] = get_current_rss()
+            with self._lock:
+                self._record_open_peaks()
+                event['peak_rss'] = self._open_peaks.pop(key) or None
+                self.stages.append(event)
+
+    def _record_open_peaks(self):
+        peak = get_peak_rss() or 0
+        for key, value in self._open_peaks.items():
+            self._open_peaks[key] = max(value, peak)
+        self._run_peak = max(self._run_peak, peak)
+
+    def to_dict(self):
+        wall = time.perf_counter() - self._wall_start
+        duration = self.attrs.get('audio_duration')
+        return {
+            'start_time': self.start_time,
+            'attrs': self.attrs,
+            'wall': wall,
+            'cpu': time.process_time() - self._cpu_start,
+            'peak_rss': max(self._run_peak, get_peak_rss() or 0) or None,
+            'rtf': wall / duration if duration else None,
+            'stages': self.stages,
+        }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+# 当前生效的tracer；align等模块通过stage()记录模型调用，没有tracer时不做任何记录
+_active_tracer = None
+
+@contextlib.contextmanager
+def activate(tracer):
+    """在with语句范围内把tracer设为当前生效的tracer"""
+    global _active_tracer
+    previous = _active_tracer
+    _active_tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _active_tracer = previous
+
+@contextlib.contextmanager
+def stage(name, **attrs):
+    """在当前tracer中计时一个阶段，没有生效的tracer时只返回一个普通字典"""
+    if _active_tracer is None:
+        yield dict(attrs)
+        return
+    with _active_tracer.stage(name, **attrs) as event:
+        yield event
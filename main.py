@@ -1,272 +1,561 @@
+import logging
+import os
+from functools import partial
+import dag
 import normalize
 import align
 import formatter
+import instrument
 import re
-from utils import is_english
+from cache import ArrayCache, TokenCache
+from tokens import Token
+from utils import is_english, time_or_zero
+
+logger = logging.getLogger(__name__)
+
+# Configuration parameters - easily adjustable
+# State file name used by incremental runs when state_file is not set
+DEFAULT_STATE_FILE = 'o.json'
+
+DEFAULT_CONFIG = {
+    'input_text': 'i.txt',
+    'input_audio': 'i.mp3',
+    'output_dir': '.',
+    'emission_chunk_seconds': None,
+    'emission_overlap_seconds': 1.0,
+    'inference_backend': 'eager',
+    'inference_batch_songs': 1,
+    'inference_batch_seconds': 120,
+    'energy_gate': False,
+    'energy_gate_threshold_db': -50,
+    'energy_gate_min_silence_seconds': 2.0,
+    'alignment_mode': 'full',
+    'alignment_window_tokens': 400,
+    'alignment_workers': None,
+    'emission_cache_dir': None,
+    'emission_cache_max_mb': 1024,
+    'pcm_cache_dir': None,
+    'pcm_cache_max_mb': 4096,
+    'token_cache_path': None,
+    'min_gap_seconds': 0.3,
+    'volume_threshold': -40,
+    'tolerance': 200,
+    'enable_vad_adjustment': True,
+    'endpoint_sources': ['silero', 'volume'],
+    'enable_score_correction': True,
+    'debug_output': True,
+    'state_file': None,
+    'incremental': False,
+    'stage_workers': 4,
+    'log_level': 'INFO',
+    'trace_file': None
+}
 
 def main():
     """Main entry point with parameter adjustment capabilities"""
-    # Configuration parameters - easily adjustable
-    config = {
-        'input_text': 'i.txt',
-        'input_audio': 'i.mp3',
-        'min_gap_seconds': 0.3,
-        'volume_threshold': -40,
-        'tolerance': 200,
-        'enable_vad_adjustment': True,
-        'enable_score_correction': True,
-        'debug_output': True
+    config = dict(DEFAULT_CONFIG)
+    configure_logging(config['log_level'])
+    run_pipeline(config)
+
+def configure_logging(level):
+    """Progress messages go through logging; level selects how much is shown"""
+    logging.basicConfig(level=level, format='%(message)s')
+
+def run_pipeline(config, token_cache=None, tracer=None, audio=None, emission=None):
+    """
+    Run the full pipeline for one lyric/audio pair and return result_list
+    token_cache can be shared between songs in batch runs
+    audio/emission already computed by batched inference skip decoding and the acoustic model
+    Every stage is timed by tracer; the trace is written to config['trace_file'] if set
+    """
+    if tracer is None:
+        tracer = instrument.Tracer()
+    tracer.set(input_text=config['input_text'], input_audio=config['input_audio'])
+
+    with instrument.activate(tracer):
+        result_list = None
+        if config['incremental']:
+            import incremental
+            result_list = incremental.run_incremental(config, token_cache, tracer)
+        if result_list is None:
+            result_list = run_stages(config, token_cache, tracer, audio, emission)
+
+    if config['trace_file']:
+        tracer.write_json(config['trace_file'])
+    return result_list
+
+def run_stages(config, token_cache, tracer, audio=None, emission=None):
+    """
+    Run the stages as a dependency graph: text processing, audio decoding plus the
+    acoustic model, and the Silero/volume endpoint detectors run concurrently;
+    alignment waits for text and emission, endpoint matching for alignment and detectors
+    """
+    stages = {
+        'text': (partial(run_text_stage, config, token_cache, tracer), ()),
+        'audio': (partial(run_audio_stage, config, tracer, audio), ()),
+        'emission': (partial(run_emission_stage, config, emission=emission), ('audio',)),
     }
+    alignment_deps = ('text', 'emission')
+    if config['enable_vad_adjustment']:
+        sources = [source for source in ('silero', 'volume', 'emission')
+                   if source in config['endpoint_sources']]
+        for source in sources:
+            # emission端点依赖emission，其他检测只依赖音频
+            deps = ('emission',) if source == 'emission' else ('audio',)
+            stages[f"{source}_endpoints"] = (partial(run_endpoint_stage, config, source), deps)
+        stages['endpoints'] = (
+            partial(run_endpoint_matching_stage, config, sources),
+            ('alignment',) + tuple(f"{source}_endpoints" for source in sources)
+        )
+        if config['alignment_mode'] == 'segmented':
+            # 分段对齐用VAD与音量检测的端点切分歌曲（emission端点在对齐时直接计算）
+            alignment_deps += tuple(f"{source}_endpoints" for source in sources if source != 'emission')
+    stages['alignment'] = (partial(run_alignment_stage, config), alignment_deps)
+    results = dag.run_graph(stages, max_workers=config['stage_workers'])
+    lines, result_list = results['alignment']
     
-    print("开始处理文本...")
-    result_list = process_input_text(config['input_text'])
+    # Apply score-based correction if enabled
+    if config['enable_score_correction']:
+        logger.info("开始基于置信度分数的微调...")
+        with instrument.stage('apply_score_based_correction'):
+            apply_score_based_correction(result_list)
+        logger.info("分数微调完成")
     
-    print("开始音频对齐...")
+    write_outputs(result_list, lines, config)
+    return result_list
+
+def run_text_stage(config, token_cache, tracer):
+    """Read and tokenize the lyrics; returns (lines, result_list, alignment_tokens, index map)"""
+    logger.info("开始处理文本...")
+    with instrument.stage('process_input_text') as event:
+        if token_cache is None:
+            token_cache = get_token_cache(config)
+        lines = read_lyric_lines(config['input_text'])
+        result_list = process_lyric_lines(lines, token_cache)
+        event['tokens'] = len(result_list)
     alignment_tokens, token_to_index_map = prepare_alignment_tokens(result_list)
+    tracer.set(tokens=len(result_list), alignment_tokens=len(alignment_tokens))
     
     # Validate alignment tokens
     validate_alignment_tokens(alignment_tokens)
-    
-    # Perform alignment
-    alignment_results = align.align_audio_with_text(config['input_audio'], alignment_tokens)
+    return lines, result_list, alignment_tokens, token_to_index_map
+
+def run_audio_stage(config, tracer, audio=None):
+    """Open the audio; it is decoded once on first use and shared by all later stages"""
+    if audio is None:
+        audio = align.load_audio(config['input_audio'], pcm_cache=get_pcm_cache(config))
+    tracer.set(audio_duration=audio.duration)
+    return audio
+
+def run_emission_stage(config, audio, emission=None):
+    """Compute the emission for the whole song; returns None if it fails"""
+    logger.info("开始音频对齐...")
+    if emission is not None:
+        logger.info("使用批量推理得到的emission")
+        return emission
+    try:
+        return align.get_emission(
+            audio,
+            chunk_seconds=config['emission_chunk_seconds'],
+            overlap_seconds=config['emission_overlap_seconds'],
+            emission_cache=get_emission_cache(config),
+            backend=config['inference_backend'],
+            energy_gate=get_energy_gate(config)
+        )
+    except Exception as e:
+        logger.error(f"Error during alignment: {e}")
+        return None
+
+def run_alignment_stage(config, text, emission, *source_endpoints):
+    """
+    CTC-align the tokens against the emission and apply the times to result_list
+    source_endpoints are the VAD/volume endpoints used to split the song in segmented mode
+    """
+    lines, result_list, alignment_tokens, token_to_index_map = text
+    alignment_results = []
+    if emission is not None:
+        with instrument.stage('alignment', alignment_tokens=len(alignment_tokens),
+                              mode=config['alignment_mode']):
+            try:
+                alignment_results = align_tokens(config, emission, alignment_tokens, result_list,
+                                                 source_endpoints)
+            except Exception as e:
+                logger.error(f"Error during alignment: {e}")
     
     # Apply alignment results to result_list
     apply_alignment_results(result_list, alignment_results, token_to_index_map)
-    
-    # Apply VAD adjustment if enabled
-    if config['enable_vad_adjustment']:
-        print("开始使用混合方法（Silero VAD + 音量检测）调整end时间...")
-        align.adjust_ends_with_hybrid(
-            result_list, 
-            config['input_audio'], 
-            min_gap_seconds=config['min_gap_seconds'],
-            volume_threshold=config['volume_threshold'], 
-            tolerance=config['tolerance']
+    return lines, result_list
+
+def align_tokens(config, emission, alignment_tokens, result_list, source_endpoints=()):
+    """Align with the aligner selected by config['alignment_mode']"""
+    mode = config['alignment_mode']
+    if mode == 'banded':
+        return align.align_emission_banded(
+            emission, alignment_tokens,
+            line_starts=find_line_starts(result_list),
+            window_tokens=config['alignment_window_tokens']
         )
-        print("混合方法调整完成")
-    
-    # Apply score-based correction if enabled
-    if config['enable_score_correction']:
-        print("开始基于置信度分数的微调...")
-        apply_score_based_correction(result_list)
-        print("分数微调完成")
-    
+    if mode == 'segmented':
+        return align.align_emission_segmented(
+            emission, alignment_tokens,
+            line_starts=find_line_starts(result_list),
+            endpoints=[t for endpoints in source_endpoints if endpoints for t in endpoints],
+            region_tokens=config['alignment_window_tokens'],
+            max_workers=config['alignment_workers']
+        )
+    if mode != 'full':
+        raise ValueError(f"未知的对齐方式: {mode}")
+    return align.align_emission(emission, alignment_tokens)
+
+def run_endpoint_stage(config, source, data):
+    """Detect endpoints from one source; data is the audio or the emission. None on failure"""
+    try:
+        if source == 'emission':
+            return align.collect_endpoints(source, emission=data,
+                                           min_gap_seconds=config['min_gap_seconds'])
+        return align.collect_endpoints(source, data, min_gap_seconds=config['min_gap_seconds'],
+                                       volume_threshold=config['volume_threshold'])
+    except Exception as e:
+        logger.error(f"端点调整过程中出现错误: {e}")
+        return None
+
+def run_endpoint_matching_stage(config, sources, aligned, *source_endpoints):
+    """Merge the detected endpoints and adjust the end times of the aligned tokens"""
+    lines, result_list = aligned
+    # sources已去掉未启用的来源；任一来源检测失败时不做调整，日志与trace中不列出任何来源
+    failed = [source for source, endpoints in zip(sources, source_endpoints) if endpoints is None]
+    used = [] if failed else list(sources)
+    if used:
+        logger.info(f"开始使用混合方法（{' + '.join(used)}）调整end时间...")
+    with instrument.stage('adjust_ends_with_hybrid', sources=used):
+        if failed:
+            logger.error(f"{' + '.join(failed)} 端点检测失败，跳过端点调整，继续处理...")
+        else:
+            endpoints = dict(zip(sources, source_endpoints))
+            try:
+                align.apply_endpoints(result_list, endpoints.get('silero', []),
+                                      endpoints.get('volume', []), endpoints.get('emission', []),
+                                      config['tolerance'])
+            except Exception as e:
+                logger.error(f"端点调整过程中出现错误: {e}")
+                logger.error("跳过端点调整，继续处理...")
+    logger.info("混合方法调整完成")
+    return lines, result_list
+
+def write_outputs(result_list, lines, config):
+    """Write the lyric files and the state used by later incremental runs"""
     # Debug output
     if config['debug_output']:
-        print("\n处理结果:")
+        logger.info("\n处理结果:")
         for item in result_list:
-            print(item)
+            logger.info(item)
     
     # Generate output files
-    print("生成输出文件...")
-    formatter.save_output_files(result_list)
-    print("处理完成！")
+    logger.info("生成输出文件...")
+    with instrument.stage('save_output_files'):
+        formatter.save_output_files(result_list, config['output_dir'])
+        state_path = get_state_path(config)
+        if state_path:
+            import incremental
+            incremental.save_state(state_path, config['input_audio'], lines, result_list)
+    logger.info("处理完成！")
 
-def process_input_text(input_file):
-    """Process input text file and return token list"""
-    result_list = []
+def get_state_path(config):
+    """
+    Path of the state file for incremental runs, or None when no state is kept
+    Only written when state_file is set or the run is incremental, so plain runs skip hashing the audio
+    """
+    if not config['state_file'] and not config['incremental']:
+        return None
+    return os.path.join(config['output_dir'], config['state_file'] or DEFAULT_STATE_FILE)
+
+def get_energy_gate(config):
+    """(threshold dB, minimum silence seconds) for gating the acoustic model, or None"""
+    if not config['energy_gate']:
+        return None
+    return (config['energy_gate_threshold_db'], config['energy_gate_min_silence_seconds'])
+
+def get_emission_cache(config):
+    """Create the on-disk emission cache if one is configured"""
+    if not config['emission_cache_dir']:
+        return None
+    return ArrayCache(config['emission_cache_dir'], config['emission_cache_max_mb'] * 1024 * 1024)
+
+def get_pcm_cache(config):
+    """Create the on-disk decoded PCM cache if one is configured"""
+    if not config['pcm_cache_dir']:
+        return None
+    return ArrayCache(config['pcm_cache_dir'], config['pcm_cache_max_mb'] * 1024 * 1024)
+
+def get_token_cache(config):
+    """Create the line-level token cache, persisted to sqlite if a path is configured"""
+    return TokenCache(config['token_cache_path'], normalize.get_normalize_version())
+
+def process_input_text(input_file, token_cache=None):
+    """
+    Process input text file and return token list
+    Repeated lines (choruses) are tokenized once through token_cache
+    """
+    return process_lyric_lines(read_lyric_lines(input_file), token_cache)
+
+def read_lyric_lines(input_file):
+    """Read the non-empty, stripped lyric lines"""
     with open(input_file, 'r', encoding='utf-8') as file:
-        for line in file:
-            if line.strip():
-                # Split custom pronunciation patterns
-                parts = re.split(r'(\(\([^)]*\)\))', line.strip())  
-                for part in parts:
-                    if part:
-                        if part.startswith('((') and part.endswith('))'):
-                            content = part[2:-2]
-                            result_list.extend(normalize.process_custon(content))
-                        else:
-                            result_list.extend(normalize.process_token(part))
-                result_list.append({'orig': '\n', 'type': 0})
+        return [line for line in (raw.strip() for raw in file) if line]
+
+def process_lyric_lines(lines, token_cache=None):
+    """Tokenize lyric lines; every line is followed by a newline token"""
+    if token_cache is None:
+        token_cache = TokenCache()
+    result_list = []
+    for line in lines:
+        result_list.extend(tokenize_line(line, token_cache))
+        result_list.append(Token('\n', 0))
+    token_cache.flush()
     return result_list
 
+def tokenize_line(line, token_cache):
+    """Tokenize one line through token_cache"""
+    tokens = token_cache.get(line)
+    if tokens is None:
+        tokens = process_line(line)
+        token_cache.put(line, tokens)
+    return tokens
+
+def process_line(line):
+    """Tokenize one lyric line, honouring ((orig/ruby)) overrides"""
+    tokens = []
+    # Split custom pronunciation patterns
+    parts = re.split(r'(\(\([^)]*\)\))', line)
+    for part in parts:
+        if part:
+            if part.startswith('((') and part.endswith('))'):
+                content = part[2:-2]
+                tokens.extend(normalize.process_custon(content))
+            else:
+                tokens.extend(normalize.process_token(part))
+    return tokens
+
 def prepare_alignment_tokens(result_list):
     """Prepare tokens for alignment and create mapping"""
     alignment_tokens = []
     token_to_index_map = {}
     
     for i, item in enumerate(result_list):
-        if 'pron' in item and item['pron']:
-            alignment_tokens.append(item['pron'])
+        if item.pron:
+            alignment_tokens.append(item.pron)
             token_to_index_map[len(alignment_tokens) - 1] = i
     
     return alignment_tokens, token_to_index_map
 
+def find_line_starts(result_list):
+    """Index (into the alignment tokens) of the first token of every lyric line"""
+    line_starts = []
+    count = 0
+    new_line = True
+    for item in result_list:
+        if item.type == 0 and item.orig == '\n':
+            new_line = True
+        elif item.pron:
+            if new_line:
+                line_starts.append(count)
+                new_line = False
+            count += 1
+    return line_starts
+
 def validate_alignment_tokens(alignment_tokens):
     """Validate alignment tokens for potential issues"""
     for item in alignment_tokens:
         if not is_english(item):
-            print(f"警告: alignment_tokens可能包含错误数据: {item}")
+            logger.warning(f"警告: alignment_tokens可能包含错误数据: {item}")
 
 def apply_alignment_results(result_list, alignment_results, token_to_index_map):
     """Apply alignment results to the result list"""
     for i, result in enumerate(alignment_results):
         if i in token_to_index_map:
             original_index = token_to_index_map[i]
-            result_list[original_index]['start'] = result['start']
-            result_list[original_index]['end'] = result['end']
-            result_list[original_index]['score'] = result['score']
+            result_list[original_index].start = result['start']
+            result_list[original_index].end = result['end']
+            result_list[original_index].score = result['score']
 
 def apply_score_based_correction(result_list):
     """
     基于置信度分数的智能行级微调算法
     以每行为单位，用高分项目作为基准调整低分项目
+    所有行的项目一起放入NumPy数组中计算
     """
-    print("开始基于置信度的行级时间微调...")
-    
-    # 按行分组处理
-    lines = group_items_by_line(result_list)
-    
-    total_adjustments = 0
-    for line_items in lines:
-        adjustments = process_line_score_adjustment(line_items)
-        total_adjustments += adjustments
-    
+    logger.info("开始基于置信度的行级时间微调...")
+    
+    items, lines = collect_timed_items(result_list)
+    adjusted, new_starts, new_ends = calculate_score_adjustments(
+        lines,
+        [time_or_zero(item.start) for item in items],
+        [time_or_zero(item.end) for item in items],
+        [item.score for item in items]
+    )
+    for k, new_start, new_end in zip(adjusted, new_starts, new_ends):
+        items[k].start = new_start
+        items[k].end = new_end
+    
+    total_adjustments = len(adjusted)
     if total_adjustments > 0:
-        print(f"完成行级微调，共调整了 {total_adjustments} 个时间点")
+        logger.info(f"完成行级微调，共调整了 {total_adjustments} 个时间点")
     else:
-        print("未发现需要调整的时间点")
+        logger.info("未发现需要调整的时间点")
 
-def group_items_by_line(result_list):
-    """将result_list按行分组，每两个换行符之间为一行"""
+def collect_timed_items(result_list):
+    """
+    收集有时间信息和分数的项目，返回 (项目列表, 每个项目的行号)
+    每两个换行符之间为一行
+    """
+    items = []
     lines = []
-    current_line = []
-    
+    line = 0
     for item in result_list:
-        if item['type'] == 0 and item['orig'] == '\n':
-            if current_line:
-                lines.append(current_line)
-                current_line = []
-        else:
-            current_line.append(item)
-    
-    # 处理最后一行（如果没有以换行符结尾）
-    if current_line:
-        lines.append(current_line)
-    
-    return lines
+        if item.type == 0 and item.orig == '\n':
+            line += 1
+        elif item.start is not None and item.end is not None and item.score is not None:
+            items.append(item)
+            lines.append(line)
+    return items, lines
 
-def process_line_score_adjustment(line_items):
+def calculate_score_adjustments(lines, starts, ends, scores):
     """
-    处理单行的分数调整
-    返回调整的项目数量
+    计算所有行的低分项目的调整结果
+    每行按分数分为高分组和低分组，低分项目参考开始时间最接近的高分项目调整，
+    调整后与高分项目严重重叠的不采用
+    返回 (需要调整的项目下标, 新的start, 新的end) 三个列表
     """
-    # 筛选有时间信息和分数的项目
-    timed_items = [item for item in line_items 
-                   if 'start' in item and 'end' in item and 'score' in item]
-    
-    if len(timed_items) < 4:  # 条目数太少则跳过
-        return 0
-    
-    # 按分数排序
-    sorted_items = sorted(timed_items, key=lambda x: x['score'], reverse=True)
-    
-    # 分为高分组和低分组
-    mid_point = len(sorted_items) // 2
-    high_score_items = sorted_items[:mid_point]
-    low_score_items = sorted_items[mid_point:]
-    
-    # 检查高分组的质量
-    high_score_avg = sum(item['score'] for item in high_score_items) / len(high_score_items)
-    if high_score_avg < 0.5:
-        print(f"警告: 检测到整体得分较低的行 (平均分: {high_score_avg:.3f})，可能影响调整效果")
-        return 0
-    
-    # 执行调整
-    return adjust_low_score_items(high_score_items, low_score_items)
+    import numpy as np
+    lines = np.asarray(lines, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(lines) == 0:
+        return [], [], []
+    
+    # 按行分组（项目已按行排列），每行按分数从高到低排序，分数相同时保持原顺序
+    _, line_of, counts = np.unique(lines, return_inverse=True, return_counts=True)
+    line_first = np.cumsum(counts) - counts
+    order = np.lexsort((np.arange(len(lines)), -scores, line_of))
+    rank = np.arange(len(order)) - line_first[line_of[order]]
+    half = counts // 2
+    is_high = rank < half[line_of[order]]
+    high = order[is_high]
+    low = order[~is_high]
+    
+    # 条目数太少的行跳过；检查高分组的质量
+    accepted = select_reliable_lines(counts, half, scores[high].tolist())
+    high = high[accepted[line_of[high]]]
+    low = low[accepted[line_of[low]]]
+    if len(low) == 0:
+        return [], [], []
+    
+    # 高分项目按行、开始时间排序作为参考
+    refs = high[np.lexsort((np.arange(len(high)), starts[high], line_of[high]))]
+    ref_line = line_of[refs]
+    ref_start = starts[refs]
+    ref_end = ends[refs]
+    
+    nearest = find_nearest_references(ref_line, ref_start, line_of[low], starts[low])
+    adjustment = calculate_optimal_adjustments(
+        starts[low], scores[low], ref_start[nearest], scores[refs][nearest])
+    
+    moved = adjustment != 0
+    low, adjustment = low[moved], adjustment[moved]
+    new_starts = np.maximum(0, starts[low] + adjustment)
+    new_ends = np.maximum(new_starts + 10, ends[low] + adjustment)  # 确保end > start
+    
+    # 验证调整的合理性
+    valid = adjustments_valid(new_starts, new_ends, line_of[low], ref_line, ref_start, ref_end)
+    return low[valid].tolist(), new_starts[valid].tolist(), new_ends[valid].tolist()
 
-def adjust_low_score_items(high_score_items, low_score_items):
+def select_reliable_lines(counts, half, high_scores):
     """
-    基于高分项目调整低分项目的时间
+    返回每行是否参与调整：至少4个项目，且高分组平均分不低于0.5
+    high_scores为按行排列的高分组分数，平均分逐项求和，与逐行计算的结果完全一致
     """
-    from utils import parse_time_to_hundredths, format_hundredths_to_time_str
-    
-    # 构建高分项目的时间基准
-    high_score_times = []
-    for item in high_score_items:
-        start_time = parse_time_to_hundredths(item['start'])
-        end_time = parse_time_to_hundredths(item['end'])
-        high_score_times.append((start_time, end_time, item['score']))
-    
-    # 按时间排序
-    high_score_times.sort(key=lambda x: x[0])
-    
-    adjustments_made = 0
-    
-    for low_item in low_score_items:
-        current_start = parse_time_to_hundredths(low_item['start'])
-        current_end = parse_time_to_hundredths(low_item['end'])
-        
-        # 找到最佳的调整参考
-        adjustment = calculate_optimal_adjustment(
-            current_start, current_end, high_score_times, low_item['score']
-        )
-        
-        if adjustment != 0:
-            # 应用调整
-            new_start = max(0, current_start + adjustment)
-            new_end = max(new_start + 10, current_end + adjustment)  # 确保end > start
-            
-            # 验证调整的合理性
-            if is_adjustment_valid(new_start, new_end, high_score_times):
-                low_item['start'] = format_hundredths_to_time_str(new_start)
-                low_item['end'] = format_hundredths_to_time_str(new_end)
-                adjustments_made += 1
-    
-    return adjustments_made
+    import numpy as np
+    accepted = np.zeros(len(counts), dtype=bool)
+    position = 0
+    for k, size in enumerate(half.tolist()):
+        segment = high_scores[position:position + size]
+        position += size
+        if counts[k] < 4:  # 条目数太少则跳过
+            continue
+        high_score_avg = sum(segment) / size
+        if high_score_avg < 0.5:
+            logger.warning(f"警告: 检测到整体得分较低的行 (平均分: {high_score_avg:.3f})，可能影响调整效果")
+            continue
+        accepted[k] = True
+    return accepted
 
-def calculate_optimal_adjustment(current_start, current_end, high_score_times, current_score):
+# 行号与时间组合成一个键（行号 * LINE_KEY_SPAN + 时间），按行排列的参考项目可以整体二分查找
+LINE_KEY_SPAN = 1 << 32
+
+def find_nearest_references(ref_line, ref_start, low_line, low_start):
+    """
+    用二分查找为每个低分项目找到同一行中开始时间最接近的高分项目（参考项目的下标）
+    距离相同时取较早的参考；开始时间相同时取排在最前的
+    """
+    import numpy as np
+    ref_lo = np.searchsorted(ref_line, low_line, 'left')
+    ref_hi = np.searchsorted(ref_line, low_line, 'right')
+    keys = ref_line * LINE_KEY_SPAN + ref_start
+    pos = np.searchsorted(keys, low_line * LINE_KEY_SPAN + low_start, 'left')
+    
+    has_left = pos > ref_lo
+    has_right = pos < ref_hi
+    left = np.maximum(pos - 1, 0)
+    right = np.minimum(pos, len(keys) - 1)
+    use_left = has_left & (~has_right | (low_start - ref_start[left] <= ref_start[right] - low_start))
+    return np.where(use_left, np.searchsorted(keys, keys[left], 'left'), right)
+
+def calculate_optimal_adjustments(current_start, current_score, ref_start, ref_score):
     """
     计算最优的时间调整量
     """
-    if not high_score_times:
-        return 0
-    
-    # 找到时间上最接近的高分项目
-    closest_ref = min(high_score_times, 
-                     key=lambda x: abs(x[0] - current_start))
-    
-    ref_start, ref_end, ref_score = closest_ref
-    
+    import numpy as np
     # 计算调整强度（基于分数差异）
     score_diff = ref_score - current_score
-    if score_diff <= 0:
-        return 0
     
     # 计算时间差异
     time_diff = current_start - ref_start
     
     # 调整策略：分数差异越大，调整越明显，但有上限
-    max_adjustment = min(50, abs(time_diff) * 0.3)  # 最大调整0.5秒
-    adjustment_ratio = min(score_diff * 2, 1.0)  # 调整比例
-    
-    adjustment = int(max_adjustment * adjustment_ratio)
-    
-    # 如果当前时间明显早于参考时间，适当延后
-    if time_diff < -100:  # 早于参考时间1秒以上
-        return adjustment
-    elif time_diff > 100:  # 晚于参考时间1秒以上
-        return -adjustment
-    
-    return 0
+    max_adjustment = np.minimum(50, np.abs(time_diff) * 0.3)  # 最大调整0.5秒
+    adjustment_ratio = np.minimum(score_diff * 2, 1.0)  # 调整比例
+    adjustment = (max_adjustment * adjustment_ratio).astype(np.int64)
+    
+    # 如果当前时间明显早于参考时间（1秒以上），适当延后；明显晚于参考时间则提前
+    adjustment = np.where(time_diff < -100, adjustment, np.where(time_diff > 100, -adjustment, 0))
+    adjustment[score_diff <= 0] = 0
+    return adjustment
 
-def is_adjustment_valid(new_start, new_end, high_score_times):
+def adjustments_valid(new_starts, new_ends, low_line, ref_line, ref_start, ref_end):
     """
-    验证调整后的时间是否合理
+    验证调整后的时间是否合理：不能与同一行的任何高分项目重叠超过50%
     """
-    # 基本合理性检查
-    if new_start >= new_end:
-        return False
-    
-    # 检查是否与高分项目时间冲突
-    for ref_start, ref_end, _ in high_score_times:
-        # 避免严重重叠
-        if (new_start < ref_end and new_end > ref_start):
-            overlap = min(new_end, ref_end) - max(new_start, ref_start)
-            if overlap > (new_end - new_start) * 0.5:  # 重叠超过50%
-                return False
-    
-    return True
+    import numpy as np
+    # 只有开始早于新end、且行内累计最大结束时间晚于新start的参考项目才可能重叠
+    start_keys = ref_line * LINE_KEY_SPAN + ref_start
+    end_keys = np.maximum.accumulate(ref_line * LINE_KEY_SPAN + ref_end)
+    ref_lo = np.searchsorted(end_keys, low_line * LINE_KEY_SPAN + new_starts, 'right')
+    ref_hi = np.searchsorted(start_keys, low_line * LINE_KEY_SPAN + new_ends, 'left')
+    
+    # 展开为 (调整项目, 可能重叠的参考项目) 对
+    ref_counts = np.maximum(ref_hi - ref_lo, 0)
+    pair_owner = np.repeat(np.arange(len(new_starts)), ref_counts)
+    pair_offset = np.arange(len(pair_owner)) - np.repeat(np.cumsum(ref_counts) - ref_counts, ref_counts)
+    pair_ref = ref_lo[pair_owner] + pair_offset
+    
+    ns, ne = new_starts[pair_owner], new_ends[pair_owner]
+    rs, re_ = ref_start[pair_ref], ref_end[pair_ref]
+    overlap = np.minimum(ne, re_) - np.maximum(ns, rs)
+    # 避免严重重叠
+    conflict = (ns < re_) & (ne > rs) & (overlap > (ne - ns) * 0.5)
+    conflicts = np.bincount(pair_owner[conflict], minlength=len(new_starts))
+    return (new_starts < new_ends) & (conflicts == 0)
 
 if __name__ == "__main__":
     main()
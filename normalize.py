@@ -1,11 +1,65 @@
-from janome.tokenizer import Tokenizer
-import pykakasi
+import functools
+import logging
 import re
+from tokens import Token
 from utils import is_english, is_kanji, is_hiragana, is_katakana, is_kana
 
-# Initialize tokenizers once for better performance
-kks = pykakasi.kakasi()
-tokenizer = Tokenizer()
+logger = logging.getLogger(__name__)
+
+# 分词规则变化时递增，使持久化的分词缓存失效
+NORMALIZE_VERSION = 1
+
+def get_normalize_version():
+    """分词结果的版本标识：规则版本 + janome/pykakasi 版本"""
+    from importlib.metadata import version
+    return f"{NORMALIZE_VERSION}|janome {version('janome')}|pykakasi {version('pykakasi')}"
+
+# Tokenizers are created on first use and then reused
+@functools.lru_cache(maxsize=None)
+def get_kks():
+    """pykakasi转换器（第一次使用时创建）"""
+    import pykakasi
+    return pykakasi.kakasi()
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer():
+    """janome分词器（第一次使用时加载词典）"""
+    from janome.tokenizer import Tokenizer
+    return Tokenizer()
+
+# 单个假名 -> 罗马音 的对照表，第一次使用时生成
+_kana_hepburn_table = None
+
+def build_kana_hepburn_table():
+    """预先转换所有平假名和片假名，生成单字符查找表"""
+    kks = get_kks()
+    table = {}
+    for code in range(0x3041, 0x3100):
+        char = chr(code)
+        try:
+            table[char] = kks.convert(char)[0]['hepburn']
+        except IndexError:
+            continue
+    return table
+
+@functools.lru_cache(maxsize=8192)
+def _convert_hepburn(text):
+    return get_kks().convert(text)[0]['hepburn']
+
+def to_hepburn(text):
+    """与 kks.convert(text)[0]['hepburn'] 结果相同，单个假名查表，其余带缓存"""
+    global _kana_hepburn_table
+    if _kana_hepburn_table is None:
+        _kana_hepburn_table = build_kana_hepburn_table()
+    pron = _kana_hepburn_table.get(text)
+    if pron is not None:
+        return pron
+    return _convert_hepburn(text)
+
+@functools.lru_cache(maxsize=8192)
+def to_hiragana(text):
+    """把读音（片假名）转换为平假名，带缓存"""
+    return "".join(item['hira'] for item in get_kks().convert(text))
 
 def match_token(surface, phonetic):
     result = []
@@ -51,36 +105,36 @@ def process_custon(content):
         ruby = parts[1]
         if any(is_kanji(c) for c in orig):
             for ri in ruby:
-                pi = kks.convert(ri)[0]['hepburn']
-                token_list.append({'orig': orig, 'type': 2, 'pron': pi, 'ruby': ri})
+                pi = to_hepburn(ri)
+                token_list.append(Token(orig, 2, pron=pi, ruby=ri))
                 orig = ''
         else:
-            token_list.append({'orig': orig, 'type': 3, 'pron': ruby})
+            token_list.append(Token(orig, 3, pron=ruby))
     return token_list
 
 def process_token(line):
     token_list = []
-    tokens = tokenizer.tokenize(line)
+    tokens = get_tokenizer().tokenize(line)
 
     for token in tokens:
         surface = token.surface
 
         # 英语
         if is_english(surface):
-            token_list.append({'orig': surface, 'type': 1, 'pron': surface.lower()})
+            token_list.append(Token(surface, 1, pron=surface.lower()))
 
         # 汉字
         elif any(is_kanji(c) for c in surface):
             if token.phonetic == '*':
-                print(f"---无法处理 {surface} ,尝试转换---")
-                phonetic_items = kks.convert(surface)
+                logger.warning(f"---无法处理 {surface} ,尝试转换---")
+                phonetic_items = get_kks().convert(surface)
                 if phonetic_items and phonetic_items[0].get('hira'):
                     phonetic = phonetic_items[0]['hira']
                 else:
-                    token_list.append({'orig': surface, 'type': 0})
+                    token_list.append(Token(surface, 0))
                     continue
             else:
-                phonetic = "".join(item['hira'] for item in kks.convert(token.phonetic))
+                phonetic = to_hiragana(token.phonetic)
 
             if all(is_kanji(c) for c in surface):
                 #print(f"  kanji:{surface}")
@@ -88,14 +142,14 @@ def process_token(line):
                 for ri in phonetic:
                     if ri == 'ー':
                         if not prev_pron:
-                            print(f"---p无法处理长音符 {ri},前面的音节为 {prev_pron}---")
+                            logger.warning(f"---p无法处理长音符 {ri},前面的音节为 {prev_pron}---")
                             pi = None
                         else:
                             pi = prev_pron[-1].lower()
                     else:
-                        pi = kks.convert(ri)[0]['hepburn']    
+                        pi = to_hepburn(ri)    
                         prev_pron = pi
-                    token_list.append({'orig': surface, 'type': 2, 'pron': pi, 'ruby': ri})
+                    token_list.append(Token(surface, 2, pron=pi, ruby=ri))
                     surface = ''
             else:
                 #print(f"  kanji/kana:{surface}")
@@ -106,37 +160,37 @@ def process_token(line):
                         for ri in m_phonetic:
                             if ri == 'ー':
                                 if not prev_pron:
-                                    print(f"---m无法处理长音符 {ri},前面的音节为 {prev_pron}---")
+                                    logger.warning(f"---m无法处理长音符 {ri},前面的音节为 {prev_pron}---")
                                     pi = None
                                 else:
                                     pi = prev_pron[-1].lower()
                             else:
-                                pi = kks.convert(ri)[0]['hepburn']                             
+                                pi = to_hepburn(ri)                             
                                 prev_pron = pi
-                            token_list.append({'orig': m_surface, 'type': 2, 'pron': pi, 'ruby': ri})
+                            token_list.append(Token(m_surface, 2, pron=pi, ruby=ri))
                             m_surface = ''
                     else:
-                        pi = kks.convert(m_surface)[0]['hepburn']
+                        pi = to_hepburn(m_surface)
                         prev_pron = pi
-                        token_list.append({'orig': m_surface, 'type': 3, 'pron': pi})
+                        token_list.append(Token(m_surface, 3, pron=pi))
 
         # 假名
         elif any(is_kana(c) for c in surface):
             #print(f"  kana:{surface}")
-            phonetic = "".join(item['hira'] for item in kks.convert(token.phonetic))
+            phonetic = to_hiragana(token.phonetic)
             if surface == phonetic:
                 prev_pron = None
                 for oi in surface:
-                    pi = kks.convert(oi)[0]['hepburn']
-                    token_list.append({'orig': oi, 'type': 3, 'pron': pi})
+                    pi = to_hepburn(oi)
+                    token_list.append(Token(oi, 3, pron=pi))
                     prev_pron = pi
             else:
-                pron = kks.convert(phonetic)[0]['hepburn']
-                token_list.append({'orig': surface, 'type': 3, 'pron': pron})
+                pron = to_hepburn(phonetic)
+                token_list.append(Token(surface, 3, pron=pron))
 
         # 其他字符
         else:
             #print(f"  other:{surface}")
-            token_list.append({'orig': surface, 'type': 0})
+            token_list.append(Token(surface, 0))
 
     return token_list
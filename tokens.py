@@ -0,0 +1,39 @@
+class Token:
+    """
+    result_list中的一个条目
+
+    type: 0 其他字符/换行, 1 英语, 2 汉字（逐个注音假名）, 3 假名/自定义读音
+    start/end: 整数百分秒，None表示没有时间，ERROR_TIME表示对齐失败
+    时间只在formatter写出文件时才格式化为 [MM:SS:CC]
+    """
+    __slots__ = ('orig', 'type', 'pron', 'ruby', 'start', 'end', 'score')
+
+    def __init__(self, orig, type, pron=None, ruby=None, start=None, end=None, score=None):
+        self.orig = orig
+        self.type = type
+        self.pron = pron
+        self.ruby = ruby
+        self.start = start
+        self.end = end
+        self.score = score
+
+    def to_dict(self):
+        """转换为只包含已设置字段的字典（用于缓存和状态文件）"""
+        return {name: getattr(self, name) for name in self.__slots__
+                if getattr(self, name) is not None}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def copy(self):
+        return Token(self.orig, self.type, self.pron, self.ruby, self.start, self.end, self.score)
+
+    def __eq__(self, other):
+        if not isinstance(other, Token):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={value!r}" for name, value in self.to_dict().items())
+        return f"Token({fields})"
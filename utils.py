@@ -17,6 +17,25 @@ def format_hundredths_to_time_str(total_hundredths):
     hundredths = remaining % 100
     return f"[{minutes:02d}:{seconds:02d}:{hundredths:02d}]"
 
+# Time value for tokens whose alignment failed; written as [error] and treated as 0 in calculations
+ERROR_TIME = -1
+
+def format_token_time(total_hundredths):
+    """Convert a token time in hundredths to its output string, [error] for failed alignments"""
+    if total_hundredths == ERROR_TIME:
+        return '[error]'
+    return format_hundredths_to_time_str(total_hundredths)
+
+def time_or_zero(total_hundredths):
+    """Token time usable in calculations (failed alignments count as 0)"""
+    return 0 if total_hundredths == ERROR_TIME else total_hundredths
+
+def seconds_to_hundredths(time_sec):
+    """Convert seconds to hundredths of seconds, truncating exactly like format_time_from_seconds"""
+    minutes, remainder = divmod(time_sec, 60)
+    seconds, centiseconds = divmod(remainder, 1)
+    return int(minutes) * 6000 + int(seconds) * 100 + math.floor(centiseconds * 100)
+
 def format_time_from_seconds(time_sec):
     """Convert seconds to time string [MM:SS:CC]"""
     minutes, remainder = divmod(time_sec, 60)